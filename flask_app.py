@@ -6,7 +6,7 @@ import sys
 import time
 from typing import Any, Dict, Optional
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request
 
 # Пути
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +18,7 @@ if mybot_src not in sys.path:
     sys.path.append(mybot_src)
 
 from database import Database  # noqa: E402
+from metrics import PROMETHEUS_CONTENT_TYPE, metrics  # noqa: E402
 
 # Создаем Flask приложение
 # На PythonAnywhere приложение должно быть в переменной 'app'
@@ -152,6 +153,33 @@ def api_search_players():
     return jsonify(matched)
 
 
+# ==================== PROMETHEUS ====================
+
+site_latency = metrics.histogram('site_request_seconds', 'Длительность запросов к сайту', ('endpoint',))
+site_requests = metrics.counter('site_requests_total', 'Запросы к сайту по кодам ответа', ('endpoint', 'status'))
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    started = getattr(g, 'request_started', None)
+    endpoint = request.endpoint or 'unknown'
+    if started is not None:
+        site_latency.labels(endpoint).observe(time.perf_counter() - started)
+    site_requests.labels(endpoint, response.status_code).inc()
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики сайта в формате Prometheus (из памяти, без обхода коллекций)"""
+    return Response(metrics.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.route('/api/metrics')
 def api_metrics():
     cached = _cache_get('metrics', ttl=30)
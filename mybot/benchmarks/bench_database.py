@@ -0,0 +1,333 @@
+"""
+Бенчмарк хранилища (src/database.py).
+
+Генерирует синтетические коллекции player_stats, games и requests
+на 1k/10k/100k документов и замеряет основные операции:
+find_one, find с диапазонными запросами, update_one с каждым оператором,
+find_one_and_update под конкуренцией потоков и запись статистики в конце игры.
+
+Результат печатается таблицей и сохраняется в JSON-отчёт, чтобы
+сравнивать изменения хранилища от релиза к релизу.
+
+Запуск:
+    python benchmarks/bench_database.py --sizes 1000,10000 --output bench_database.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from time import perf_counter, time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+REPORT_VERSION = 1
+DEFAULT_SIZES = (1000, 10000, 100000)
+ROLES = ('peace', 'mafia', 'don', 'commissar', 'sergeant', 'doctor', 'maniac', 'mistress', 'lawyer', 'bum')
+
+
+def load_database_class():
+    """Импортирует Database, не создавая рабочую папку data/ в текущем каталоге"""
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='mafbot-bench-import-')
+    try:
+        os.chdir(scratch)
+        from database import Database
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return Database
+
+
+# --- ГЕНЕРАЦИЯ ДАННЫХ ---
+
+def make_player_stats(rng, user_id):
+    games_played = rng.randint(0, 500)
+    games_won = rng.randint(0, games_played)
+    return {
+        'user_id': user_id,
+        'name': f'Игрок {user_id}',
+        'games_played': games_played,
+        'games_won': games_won,
+        'games_lost': games_played - games_won,
+        'roles_played': {r: rng.randint(0, 50) for r in rng.sample(ROLES, 4)},
+        'wins_by_role': {r: rng.randint(0, 20) for r in rng.sample(ROLES, 3)},
+        'wins_by_team': {'peaceful': rng.randint(0, 100), 'mafia': rng.randint(0, 100), 'maniac': rng.randint(0, 10)},
+        'elo_rating': rng.randint(600, 2200),
+        'candies': rng.randint(0, 1000),
+        'achievements': [f'ach_{rng.randint(1, 40)}' for _ in range(rng.randint(0, 8))],
+        'elo_history': [],
+    }
+
+
+def make_game(rng, chat_id, now):
+    players = []
+    for i in range(rng.randint(4, 12)):
+        players.append({
+            'id': chat_id * 100 + i,
+            'name': f'@player{i}',
+            'role': rng.choice(ROLES),
+            'alive': rng.random() > 0.3,
+            'pm_id': None,
+            'position': i + 1,
+        })
+    return {
+        'game': 'mafia', 'mode': 'full', 'chat': chat_id,
+        'stage': rng.choice((-3, 0, 2, 3, 4, 5, 6, 12, 14)),
+        'day_count': rng.randint(0, 5), 'night_count': rng.randint(0, 5),
+        'players': players, 'vote': {}, 'vote_map_ids': {},
+        'shots': [], 'heals': [], 'played': [], 'blocks': [],
+        'next_stage_time': now + rng.uniform(-60, 600),
+        'missed_actions': {},
+    }
+
+
+def make_request(rng, chat_id, now):
+    players = [{'id': chat_id * 100 + i, 'name': f'@player{i}'} for i in range(rng.randint(1, 12))]
+    return {
+        'chat': chat_id,
+        'owner': players[0],
+        'players': players,
+        'players_count': len(players),
+        'time': now + rng.uniform(-120, 120),
+        'message_id': rng.randint(1, 10 ** 6),
+    }
+
+
+def populate(db, size, seed):
+    """Записывает коллекции напрямую в файлы, минуя insert_one (он O(n) на вставку)"""
+    rng = random.Random(seed)
+    now = time()
+    db._write_collection('player_stats', {f'ps-{i}': make_player_stats(rng, 10 ** 6 + i) for i in range(size)})
+    db._write_collection('games', {f'g-{i}': make_game(rng, -10 ** 9 - i, now) for i in range(size)})
+    db._write_collection('requests', {f'r-{i}': make_request(rng, -10 ** 9 - i, now) for i in range(size)})
+
+
+# --- ЗАМЕРЫ ---
+
+def measure(func, repeat, budget):
+    """Вызывает func до repeat раз (не дольше budget секунд), возвращает сводку по времени"""
+    samples = []
+    started = perf_counter()
+    for _ in range(repeat):
+        t0 = perf_counter()
+        func()
+        samples.append(perf_counter() - t0)
+        if perf_counter() - started > budget:
+            break
+    samples.sort()
+    return summarize(samples)
+
+
+def summarize(samples):
+    n = len(samples)
+    mean = statistics.fmean(samples)
+    return {
+        'runs': n,
+        'mean_ms': mean * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'p95_ms': samples[min(n - 1, int(n * 0.95))] * 1000,
+        'min_ms': samples[0] * 1000,
+        'max_ms': samples[-1] * 1000,
+        'ops_per_sec': (1 / mean) if mean > 0 else None,
+    }
+
+
+def micro_benchmarks(db, size, rng, repeat, budget):
+    """Отдельные операции хранилища"""
+    now = time()
+    results = {}
+
+    def random_user():
+        return 10 ** 6 + rng.randrange(size)
+
+    def random_chat():
+        return -10 ** 9 - rng.randrange(size)
+
+    results['find_one.player_stats.user_id'] = measure(
+        lambda: db.find_one('player_stats', {'user_id': random_user()}), repeat, budget)
+    results['find_one.games.chat'] = measure(
+        lambda: db.find_one('games', {'chat': random_chat()}), repeat, budget)
+    results['find_one.games.miss'] = measure(
+        lambda: db.find_one('games', {'chat': 1}), repeat, budget)
+    results['find.games.next_stage_time_lte'] = measure(
+        lambda: db.find('games', {'game': 'mafia', 'next_stage_time': {'$lte': now}}), repeat, budget)
+    results['find.requests.time_gt'] = measure(
+        lambda: db.find('requests', {'time': {'$gt': now}}), repeat, budget)
+    results['find.player_stats.elo_range'] = measure(
+        lambda: db.find('player_stats', {'elo_rating': {'$gte': 1200, '$lt': 1600}}), repeat, budget)
+
+    updates = {
+        '$set': lambda: {'$set': {'candies': rng.randint(0, 1000)}},
+        '$inc': lambda: {'$inc': {'games_played': 1}},
+        '$push': lambda: {'$push': {'elo_history': {'rating': 1000, 'timestamp': now}}},
+        '$addToSet': lambda: {'$addToSet': {'achievements': f'ach_{rng.randint(1, 40)}'}},
+        '$pull': lambda: {'$pull': {'achievements': f'ach_{rng.randint(1, 40)}'}},
+        '$unset': lambda: {'$unset': {'elo_change': ''}},
+    }
+    for op, make_update in updates.items():
+        results[f'update_one.player_stats.{op}'] = measure(
+            lambda: db.update_one('player_stats', {'user_id': random_user()}, make_update()), repeat, budget)
+
+    results['update_one.games.nested_set'] = measure(
+        lambda: db.update_one('games', {'chat': random_chat()}, {'$set': {'players.0.pm_id': rng.randint(1, 10 ** 6)}}),
+        repeat, budget)
+    results['update_one.player_stats.upsert_new'] = measure(
+        lambda: db.update_one('player_stats', {'user_id': -rng.randint(1, 10 ** 9)}, {'$set': {'candies': 0}}, upsert=True),
+        repeat, budget)
+    return results
+
+
+def contention_benchmark(db, threads, per_thread):
+    """find_one_and_update из нескольких потоков по одному документу (как быстрые нажатия кнопок)"""
+    doc_id = db.insert_one('games', {'game': 'bench', 'chat': 0, 'played': [], 'counter': 0})
+    barrier = threading.Barrier(threads)
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker(n):
+        local = []
+        barrier.wait()
+        for i in range(per_thread):
+            t0 = perf_counter()
+            db.find_one_and_update('games', {'_id': doc_id},
+                                   {'$inc': {'counter': 1}, '$addToSet': {'played': n * per_thread + i}})
+            local.append(perf_counter() - t0)
+        with samples_lock:
+            samples.extend(local)
+
+    started = perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = perf_counter() - started
+
+    final = db.find_one('games', {'_id': doc_id})
+    db.delete_one('games', {'_id': doc_id})
+    samples.sort()
+    result = summarize(samples)
+    result.update({
+        'threads': threads,
+        'wall_s': wall,
+        'throughput_ops_per_sec': len(samples) / wall if wall > 0 else None,
+        'lost_updates': threads * per_thread - final.get('counter', 0),
+    })
+    return result
+
+
+def end_of_game_benchmark(db, size, rng, players, repeat, budget):
+    """Повторяет шаблон доступа update_elo_rating + update_player_stats из game.py"""
+    def finish_game():
+        user_ids = [10 ** 6 + rng.randrange(size) for _ in range(players)]
+        # update_elo_rating: чтение всех, затем запись каждого
+        stats = {uid: db.find_one('player_stats', {'user_id': uid}) for uid in user_ids}
+        for uid, s in stats.items():
+            if s:
+                s = {k: v for k, v in s.items() if k != '_id'}
+                s['elo_rating'] = s.get('elo_rating', 1000) + rng.randint(-16, 16)
+                db.update_one('player_stats', {'user_id': uid}, {'$set': s}, upsert=True)
+        # update_player_stats: средний рейтинг (ещё N чтений), затем чтение и запись каждого
+        for uid in user_ids:
+            db.find_one('player_stats', {'user_id': uid})
+        for uid in user_ids:
+            s = db.find_one('player_stats', {'user_id': uid}) or {'user_id': uid}
+            s = {k: v for k, v in s.items() if k != '_id'}
+            s['games_played'] = s.get('games_played', 0) + 1
+            db.update_one('player_stats', {'user_id': uid}, {'$set': s}, upsert=True)
+
+    result = measure(finish_game, repeat, budget)
+    result['players'] = players
+    return result
+
+
+def collection_sizes(db):
+    return {name: os.path.getsize(db._get_collection_path(name))
+            for name in ('player_stats', 'games', 'requests')}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat, budget, threads, per_thread, players, seed):
+    Database = load_database_class()
+    report = {
+        'version': REPORT_VERSION,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': {'repeat': repeat, 'budget_s': budget, 'threads': threads,
+                   'per_thread': per_thread, 'players': players, 'seed': seed},
+        'sizes': {},
+    }
+    for size in sizes:
+        tmp_dir = tempfile.mkdtemp(prefix=f'mafbot-bench-{size}-')
+        try:
+            db = Database(tmp_dir)
+            t0 = perf_counter()
+            populate(db, size, seed)
+            rng = random.Random(seed + size)
+            entry = {
+                'populate_s': perf_counter() - t0,
+                'file_bytes': collection_sizes(db),
+                'operations': micro_benchmarks(db, size, rng, repeat, budget),
+            }
+            entry['operations']['find_one_and_update.games.contention'] = contention_benchmark(db, threads, per_thread)
+            entry['operations']['end_of_game.player_stats'] = end_of_game_benchmark(db, size, rng, players, repeat, budget)
+            report['sizes'][str(size)] = entry
+            print_size(size, entry)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return report
+
+
+def print_size(size, entry):
+    print(f'\n=== {size} документов (заполнение {entry["populate_s"]:.2f} c) ===')
+    print(f'{"операция":<48}{"runs":>6}{"median ms":>12}{"p95 ms":>12}{"ops/s":>10}')
+    for name, r in entry['operations'].items():
+        ops = r.get('throughput_ops_per_sec') or r.get('ops_per_sec') or 0
+        print(f'{name:<48}{r["runs"]:>6}{r["median_ms"]:>12.3f}{r["p95_ms"]:>12.3f}{ops:>10.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк src/database.py')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры коллекций через запятую (по умолчанию 1000,10000,100000)')
+    parser.add_argument('--repeat', type=int, default=50, help='максимум повторов на операцию')
+    parser.add_argument('--budget', type=float, default=5.0, help='лимит времени на операцию, секунд')
+    parser.add_argument('--threads', type=int, default=8, help='потоков в тесте конкуренции')
+    parser.add_argument('--per-thread', type=int, default=10, help='операций на поток в тесте конкуренции')
+    parser.add_argument('--players', type=int, default=10, help='игроков в тесте конца игры')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='bench_database.json', help='путь к JSON-отчёту ("-" — stdout)')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    report = run(sizes, args.repeat, args.budget, args.threads, args.per_thread, args.players, args.seed)
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == '-':
+        print(payload)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        print(f'\nОтчёт сохранён: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Симулятор игр без Telegram (нагрузочное тестирование).
+
+Подменяет HTTP-слой pyTelegramBotAPI (telebot.apihelper._make_request)
+фейковым Telegram, который отвечает правдоподобными объектами, и гоняет
+настоящие обработчики: раздачу ролей, ночные действия, голосование и
+переходы стадий через app.run_stage_transition. Игроки ходят случайно,
+а таймеры стадий перематываются, так что игра длится доли секунды.
+В отчёте - операции с базой и сообщения (вызовы Bot API по чатам) на игру.
+
+Запуск:
+    python benchmarks/simulate_games.py --games 50 --players 10 --output simulate.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from time import perf_counter, sleep, time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+# Какой callback отправляет игрок с нужной ролью на ночной стадии
+NIGHT_CALLBACKS = {
+    4: (('mafia', 'don'), 'shot'),
+    5: (('don',), 'don_check'),
+    6: (('commissar',), 'commissar_check'),
+    7: (('doctor',), 'doctor'),
+    8: (('maniac',), 'maniac'),
+    9: (('mistress',), 'mistress'),
+    10: (('lawyer',), 'lawyer'),
+    11: (('bum',), 'bum'),
+}
+
+
+class FakeTelegram:
+    """Фейковый Bot API: считает вызовы и возвращает то, что вернул бы Telegram"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.chat_calls = Counter()  # chat_id -> вызовы, адресованные чату
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def _next_message(self, params):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': message_id,
+            'date': int(time()),
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Sim', 'username': 'sim_bot'},
+            'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'},
+            'text': params.get('text', ''),
+        }
+
+    def request(self, token, method_name, method='get', params=None, files=None, **kwargs):
+        params = params or {}
+        with self._lock:
+            self.calls[method_name] += 1
+            if 'chat_id' in params:
+                self.chat_calls[int(params['chat_id'])] += 1
+        if self.latency:
+            sleep(self.latency)
+        if method_name == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Sim', 'username': 'sim_bot'}
+        if method_name in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            return self._next_message(params)
+        return True
+
+
+def fake_call(user_id, data, chat_id=None):
+    chat = SimpleNamespace(id=chat_id if chat_id is not None else user_id,
+                           type='supergroup' if chat_id is not None else 'private')
+    return SimpleNamespace(
+        id=f'sim-{user_id}-{random.random()}',
+        data=data,
+        from_user=SimpleNamespace(id=user_id, first_name=f'Sim {user_id}', last_name=None, username=None),
+        message=SimpleNamespace(chat=chat, message_id=1),
+    )
+
+
+class Simulator:
+    def __init__(self, games, players, max_steps, seed):
+        self.games = games
+        self.players = players
+        self.max_steps = max_steps
+        self.seed = seed
+        self.transition_times = []
+        self.finished = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def game_of_chat(chat_id):
+        """Номер игры по чату: группа -10**12 - n, игроки 10**9 + n*100 + i"""
+        if chat_id < 0:
+            return -chat_id - 10 ** 12
+        return (chat_id - 10 ** 9) // 100
+
+    def setup(self):
+        # Импортируем бота только после подмены HTTP-слоя и смены каталога
+        import database
+        import handlers
+        import app
+        self.database = database
+        self.handlers = handlers
+        self.app = app
+
+    def settle(self, game_id):
+        """Дождаться переходов, которые обработчики поставили в пул стадий"""
+        while self.app.stage_pool.is_pending(game_id):
+            sleep(0.001)
+
+    def alive_targets(self, game, exclude=None):
+        return [i for i, p in enumerate(game['players']) if p.get('alive') and p['id'] != exclude]
+
+    def act(self, game, rng):
+        """Случайные ходы игроков на текущей стадии"""
+        stage = game.get('stage')
+        if stage == 0:
+            for p in game['players']:
+                targets = self.alive_targets(game, exclude=p['id'])
+                if p.get('alive') and targets and rng.random() < 0.8:
+                    call = fake_call(p['id'], f'vote_discussion {rng.choice(targets)}')
+                    self.handlers.dispatch_game_callback(call, game['_id'], game)
+                    game = self.database.find_one('games', {'_id': game['_id']}) or game
+        elif stage in NIGHT_CALLBACKS:
+            roles, prefix = NIGHT_CALLBACKS[stage]
+            for p in game['players']:
+                targets = self.alive_targets(game, exclude=p['id'])
+                if p.get('alive') and p['role'] in roles and targets and rng.random() < 0.9:
+                    call = fake_call(p['id'], f'{prefix} {rng.choice(targets)}')
+                    self.handlers.dispatch_game_callback(call, game['_id'], game)
+                    game = self.database.find_one('games', {'_id': game['_id']}) or game
+
+    def play(self, n):
+        rng = random.Random(self.seed + n)
+        chat_id = -10 ** 12 - n
+        players = [{'id': 10 ** 9 + n * 100 + i, 'name': f'@sim{n}_{i}', 'full_name': f'Sim {i}'}
+                   for i in range(self.players)]
+        self.database.insert_one('requests', {
+            'chat': chat_id, 'owner': players[0], 'players': players,
+            'players_count': len(players), 'time': time() + 600, 'message_id': 1,
+        })
+        self.handlers.start_game_logic(SimpleNamespace(chat=SimpleNamespace(id=chat_id)))
+
+        for _ in range(self.max_steps):
+            game = self.database.find_one('games', {'chat': chat_id})
+            if not game:
+                with self._lock:
+                    self.finished['completed'] += 1
+                return
+            self.settle(game['_id'])
+            game = self.database.find_one('games', {'_id': game['_id']})
+            if not game:
+                continue
+            stage_before = game.get('stage')
+            self.act(game, rng)
+            self.settle(game['_id'])
+            game = self.database.find_one('games', {'_id': game['_id']})
+            if not game or game.get('stage') != stage_before:
+                continue  # ход игрока сам перевёл стадию или закончил игру
+            # Перематываем таймер стадии и выполняем переход, как stage_cycle
+            self.database.update_one('games', {'_id': game['_id']}, {'$set': {'next_stage_time': time()}})
+            t0 = perf_counter()
+            self.app.run_stage_transition(game['_id'])
+            with self._lock:
+                self.transition_times.append(perf_counter() - t0)
+        with self._lock:
+            self.finished['step_limit'] += 1
+
+    def run(self):
+        threads = [threading.Thread(target=self.play, args=(n,), name=f'sim-{n}') for n in range(self.games)]
+        started = perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return perf_counter() - started
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless-симулятор игр с фейковым Telegram')
+    parser.add_argument('--games', type=int, default=20, help='сколько игр играть одновременно')
+    parser.add_argument('--players', type=int, default=10, help='игроков в каждой игре')
+    parser.add_argument('--max-steps', type=int, default=60, help='максимум стадий на игру')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка фейкового Telegram, секунд')
+    parser.add_argument('--real-limits', action='store_true', help='не отключать лимиты Telegram из config')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='-', help='путь к JSON-отчёту ("-" — stdout)')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output != '-' else '-'
+    workdir = tempfile.mkdtemp(prefix='mafbot-sim-')
+    cwd = os.getcwd()
+    os.chdir(workdir)  # data/ и logs/ бота создаются во временном каталоге
+    try:
+        from telebot import apihelper
+        telegram = FakeTelegram(args.latency)
+        apihelper._make_request = telegram.request
+
+        sim = Simulator(args.games, args.players, args.max_steps, args.seed)
+        sim.setup()
+        if not args.real_limits:
+            from outbox import RateLimiter
+            sim.handlers.bot.limiter = RateLimiter(10 ** 6, 10 ** 6, 10 ** 6, 10 ** 6, 10 ** 6)
+        from metrics import metrics
+        metrics.reset()  # операции с базой считаем только за время игр
+        wall = sim.run()
+        sim.handlers.bot.outbox.join(60)
+        db_ops = Counter()
+        for (op, _), sample in metrics.snapshot()['db_operation_seconds']['samples'].items():
+            db_ops[op] += sample['count']
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    times = sim.transition_times
+    games = max(args.games, 1)
+    per_game = Counter()
+    group_calls = private_calls = 0
+    for chat_id, count in telegram.chat_calls.items():
+        per_game[sim.game_of_chat(chat_id)] += count
+        if chat_id < 0:
+            group_calls += count
+        else:
+            private_calls += count
+    messages = [per_game[n] for n in range(args.games)]
+    report = {
+        'params': vars(args),
+        'wall_s': wall,
+        'games': dict(sim.finished),
+        'transitions': len(times),
+        'transitions_per_sec': len(times) / wall if wall > 0 else None,
+        'transition_ms': {
+            'mean': statistics.fmean(times) * 1000 if times else None,
+            'p50': percentile(times, 0.5) * 1000 if times else None,
+            'p95': percentile(times, 0.95) * 1000 if times else None,
+            'max': max(times) * 1000 if times else None,
+        },
+        'telegram_calls': dict(telegram.calls),
+        'telegram_calls_total': sum(telegram.calls.values()),
+        'messages_per_game': {
+            'mean': statistics.fmean(messages) if messages else None,
+            'p50': percentile(messages, 0.5),
+            'max': max(messages) if messages else None,
+            'group_mean': group_calls / games,
+            'private_mean': private_calls / games,
+        },
+        'db_ops_per_game': sum(db_ops.values()) / games,
+        'db_ops_per_game_by_op': {op: count / games for op, count in sorted(db_ops.items())},
+        'stage_pool': sim.app.stage_pool.stats(),
+    }
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if output == '-':
+        print(payload)
+    else:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        print(f'Отчёт сохранён: {output}')
+
+
+if __name__ == '__main__':
+    main()
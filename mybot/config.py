@@ -25,6 +25,66 @@ PLAYERS_COUNT_LIMIT = 12
 # Время жизни заявки на игру (в секундах). 10 минут = 600 сек.
 REQUEST_OVERDUE_TIME = 2 * 60 
 
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+
+# Сколько потоков одновременно выполняют переходы стадий (разных игр)
+STAGE_WORKERS = int(os.getenv('STAGE_WORKERS', 8))
+
+# Предупреждать в логе, если переход стадии ждёт в очереди дольше (секунд)
+STAGE_POOL_LAG_WARNING = 2
+# Пороги здоровья цикла стадий: опоздание перехода и длительность итерации
+# stage_cycle (секунд), число игр с просроченным дедлайном
+STAGE_HEALTH_THRESHOLDS = {
+    'transition_delay': 5,
+    'cycle_iteration': 2,
+    'overdue_games': 10,
+}
+
+# --- ЛИМИТЫ TELEGRAM ---
+
+# Не больше 30 сообщений в секунду на бота
+TELEGRAM_GLOBAL_RATE = 30
+# В группу: не больше 20 сообщений в минуту (короткой пачкой можно до 3)
+TELEGRAM_GROUP_RATE = 20 / 60
+TELEGRAM_GROUP_BURST = 3
+# В личку: примерно одно сообщение в секунду на чат
+TELEGRAM_PRIVATE_RATE = 1
+TELEGRAM_PRIVATE_BURST = 3
+# Потоки очереди исходящих сообщений (bot.post_message)
+OUTBOX_WORKERS = 4
+# Живые сообщения (таймеры, голоса) правим не чаще раза в столько секунд
+LIVE_EDIT_INTERVAL = 3
+# ...и не реже раза в столько секунд (таймер, до конца которого ещё далеко)
+LIVE_EDIT_MAX_INTERVAL = 15
+# Сколько личных сообщений игрокам отправлять одновременно (раздача ролей, ночь)
+PM_FANOUT_WORKERS = 8
+
+# Режим акторов: состояние игр хранится в памяти, ходы одной игры идут по очереди.
+# На диск игры пишутся на границах стадий и раз в ACTOR_CHECKPOINT_INTERVAL секунд.
+GAME_ACTORS = os.getenv('GAME_ACTORS', '0') == '1'
+ACTOR_CHECKPOINT_INTERVAL = 15
+
+# Восстановление после перезапуска: игры с просроченным дедлайном продолжаются
+# по очереди (раз в RECOVERY_SPACING секунд) и получают RECOVERY_GRACE секунд
+# на текущий этап. Игры, простоявшие дольше RECOVERY_ABANDON_AFTER секунд, завершаются.
+RECOVERY_GRACE = 60
+RECOVERY_SPACING = 1
+RECOVERY_ABANDON_AFTER = 30 * 60
+# Плавная остановка (SIGTERM/Ctrl+C): сколько секунд ждать незаконченные переходы
+# и исходящие сообщения, прежде чем сохранить игры и выйти
+DRAIN_TIMEOUT = 30
+
+# Шардинг: при SHARD_COUNT > 1 фронт-процесс принимает обновления и раздаёт их
+# SHARD_COUNT процессам-воркерам по кольцу консистентного хеширования chat_id
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 1))
+SHARD_RING_REPLICAS = 160
+
+# Метрики: раз в METRICS_LOG_INTERVAL секунд в лог пишется одна сводная строка
+METRICS_LOG_INTERVAL = 300
+# /metrics в формате Prometheus (0 - не поднимать); воркер шардинга N слушает METRICS_PORT + N
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
 # --- ПУТИ К ФАЙЛАМ ---
 
 # Базовый путь проекта
@@ -34,6 +94,19 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 LOGGER_LEVEL = logging.INFO
 
+# Трассировка: обработчики обновлений и переходы стадий дольше
+# TRACE_SLOW_THRESHOLD секунд пишутся в TRACE_EXPORT_PATH (JSONL, формат Trace Event)
+TRACING_ENABLED = True
+TRACE_SLOW_THRESHOLD = 1.0
+TRACE_EXPORT_PATH = os.path.join('logs', 'traces.jsonl')
+
+# Сэмплирующий профайлер (/profile [секунды], только ADMIN_ID):
+# частота снимков стеков и куда сохранять результат
+PROFILE_SAMPLE_INTERVAL = 0.01
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_DIR = 'logs'
+
 # --- НАСТРОЙКИ WEBHOOK (ДЛЯ СЕРВЕРА) ---
 
 # Если False — используется Polling (для запуска на компьютере)
@@ -0,0 +1,66 @@
+import threading
+from time import sleep
+
+import config
+import database
+from logger import logger
+from workers import KeyedWorkerPool
+
+
+class GameActors:
+    """
+    Режим акторов: каждая игра обрабатывается своим «актором».
+
+    Почтовый ящик актора — очередь ключа в KeyedWorkerPool (ключ — id игры):
+    callback'и игроков и переходы стадий одной игры выполняются строго по очереди.
+    В режиме акторов коллекция games живёт в памяти (database.hold_in_memory),
+    так что find_one/update_one внутри хода не читают и не пишут файл.
+    Состояние сохраняется на диск на границах стадий и раз в
+    ACTOR_CHECKPOINT_INTERVAL секунд.
+    """
+
+    def __init__(self, enabled, workers, checkpoint_interval):
+        self.enabled = enabled
+        self.checkpoint_interval = checkpoint_interval
+        self.pool = KeyedWorkerPool('game', workers)
+        self._started = False
+
+    def start(self):
+        if not self.enabled or self._started:
+            return
+        self._started = True
+        database.hold_in_memory('games')
+        thread = threading.Thread(target=self._checkpoint_loop, name='Game Checkpoint', daemon=True)
+        thread.start()
+        logger.info(f'Game actors enabled, checkpoint every {self.checkpoint_interval}s')
+
+    def tell(self, game_id, func, *args, **kwargs):
+        """Положить сообщение в ящик актора игры (или выполнить сразу, если режим выключен)"""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        self.pool.submit(game_id, func, *args, **kwargs)
+
+    def checkpoint(self):
+        """Сохранить состояние всех игр на диск"""
+        try:
+            return database.checkpoint('games')
+        except Exception as e:
+            logger.error(f'Game checkpoint failed: {e}')
+            return False
+
+    def _checkpoint_loop(self):
+        while True:
+            sleep(self.checkpoint_interval)
+            self.checkpoint()
+
+    def stop(self, wait=True):
+        """
+        Остановить пул акторов и сохранить состояние. wait=False - не ждать
+        зависшие задачи (срок drain уже вышел): игры восстановятся при старте.
+        """
+        self.pool.shutdown(wait=wait)
+        if self._started:
+            database.release_memory('games')
+
+
+game_actors = GameActors(config.GAME_ACTORS, config.STAGE_WORKERS, config.ACTOR_CHECKPOINT_INTERVAL)
@@ -1,9 +1,12 @@
 import os
 import sys
+import json
+import multiprocessing
+import signal
 from time import time, sleep
-from threading import Thread
+from threading import Thread, Event
 import flask
-from telebot import logger
+from telebot import logger, apihelper
 from telebot.types import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telebot.apihelper import ApiException
 
@@ -15,13 +18,27 @@ if current_dir not in sys.path:
 import config
 import database
 from handlers import bot, get_time_str
+from bot import api_error_code
 from game import stop_game
 from stages import go_to_next_stage, update_timer
+from scheduler import scheduler
+from actors import game_actors
+from recovery import recover_games, resume_after_clean_shutdown, write_shutdown_marker
+from sharding import shard, UpdateRouter
+from outbox import RateLimiter
+from metrics import metrics
+from tracing import tracer
 import lang
 
 # Flask app initialization 
 app = flask.Flask(__name__)
 
+tracer.configure(config.TRACE_EXPORT_PATH, config.TRACE_SLOW_THRESHOLD, config.TRACING_ENABLED)
+
+# Пул для переходов стадий: параллельно между играми, последовательно внутри игры.
+# Это тот же пул, что служит почтовыми ящиками акторов игр.
+stage_pool = game_actors.pool
+
 def update_request_timer(request):
     """Обновить таймер в сообщении заявки"""
     try:
@@ -31,6 +48,8 @@ def update_request_timer(request):
         if remaining <= 0:
             # Время истекло, удаляем заявку
             database.delete_one('requests', {'_id': request['_id']})
+            scheduler.untrack_timer(('request', request['_id']))
+            bot.live_edits.discard(request['chat'], request['message_id'])
             try:
                 bot.edit_message_text(
                     '⏰ Время истекло! Заявка удалена.',
@@ -59,72 +78,169 @@ def update_request_timer(request):
         if len(players_list) >= config.PLAYERS_COUNT_TO_START:
             keyboard.add(InlineKeyboardButton(text='▶️ Начать игру', callback_data='start game'))
         
-        try:
-            bot.edit_message_text(
-                text=text,
-                chat_id=request['chat'],
-                message_id=request['message_id'],
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-        except ApiException as e:
-            # Обработка ошибки 429 (Too Many Requests)
-            error_code = e.result.get('error_code', 0) if hasattr(e, 'result') and isinstance(e.result, dict) else 0
-            if error_code == 429:
-                retry_after = e.result.get('parameters', {}).get('retry_after', 1) if hasattr(e, 'result') and isinstance(e.result, dict) else 1
-                logger.warning(f"Rate limit hit, waiting {retry_after} seconds")
-                sleep(retry_after)
-            else:
-                pass  # Сообщение могло быть удалено или изменено
+        # Лимиты и 429 обрабатывает бот; правки с тем же текстом не отправляются
+        bot.edit_live_message(
+            request['chat'],
+            request['message_id'],
+            text,
+            reply_markup=keyboard,
+            parse_mode='HTML'
+        )
     except Exception as e:
         logger.debug(f"Error updating request timer: {e}")
 
+# Здоровье цикла стадий. Пороги (STAGE_HEALTH_THRESHOLDS) тоже отдаются
+# метриками, чтобы правила алертов сравнивали с ними, а не с константами
+DELAY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300)
+transition_delay = metrics.histogram('stage_transition_delay_seconds', 'Опоздание перехода относительно дедлайна', buckets=DELAY_BUCKETS)
+transition_errors = metrics.counter('stage_transition_errors_total', 'Переходы стадий, завершившиеся ошибкой')
+cycle_iteration = metrics.histogram('stage_cycle_iteration_seconds', 'Длительность итерации stage_cycle (без сна)')
+cycle_errors = metrics.counter('stage_cycle_errors_total', 'Исключения в цикле stage_cycle')
+cycle_time = metrics.counter('stage_cycle_busy_seconds_total', 'Время цикла стадий по фазам', ('phase',))
+overdue_games = metrics.gauge('stage_overdue_games', 'Игры, чей дедлайн прошёл, а переход ещё не начался')
+health_threshold = metrics.gauge('stage_health_threshold', 'Порог алерта', ('check',))
+health_degraded = metrics.gauge('stage_health_degraded', '1, если показатель выше порога', ('check',))
+_health_logged = {}
+
+def check_health(check, value, message):
+    """Сравнить показатель с порогом из config; при превышении - предупреждение (не чаще раза в минуту)"""
+    threshold = config.STAGE_HEALTH_THRESHOLDS[check]
+    degraded = value > threshold
+    health_threshold.labels(check).set(threshold)
+    health_degraded.labels(check).set(int(degraded))
+    if degraded and time() - _health_logged.get(check, 0) >= 60:
+        _health_logged[check] = time()
+        logger.warning(f"Stage health: {message} ({value:.1f} > {threshold})")
+
+# Живые таймеры из планировщика: вид ключа -> (коллекция, функция обновления)
+LIVE_TIMER_SOURCES = {
+    'game': ('games', update_timer),
+    'request': ('requests', update_request_timer),
+}
+
+def refresh_live_timers(timers, now, next_refresh):
+    """
+    Обновить живые таймеры [(ключ, дедлайн)] из scheduler.live_timers().
+    У каждого сообщения свой срок следующего обновления (next_refresh):
+    bot.live_edits.refresh_interval() от оставшегося времени и очереди Telegram.
+    Документ читается только для тех сообщений, которые пора обновить.
+    Возвращает, когда понадобится следующее обновление.
+    """
+    due = now + config.LIVE_EDIT_MAX_INTERVAL
+    for key, deadline in timers:
+        at = next_refresh.get(key, now)
+        if at <= now:
+            kind, doc_id = key
+            collection, update = LIVE_TIMER_SOURCES[kind]
+            try:
+                doc = database.find_one(collection, {'_id': doc_id})
+                if doc:
+                    update(doc)
+            except Exception:
+                pass
+            at = now + bot.live_edits.refresh_interval(deadline - now)
+            next_refresh[key] = at
+        due = min(due, at)
+    return due
+
+def run_stage_transition(game_id):
+    """Переход стадии одной игры (выполняется в stage_pool)"""
+    with tracer.trace('stage_transition', game_id=game_id):
+        _run_stage_transition(game_id)
+
+def _run_stage_transition(game_id):
+    started = time()
+    game = database.find_one('games', {'_id': game_id})
+    if not game or game.get('game') != 'mafia' or game.get('next_stage_time') is None:
+        return
+    if game['next_stage_time'] > started:
+        # Дедлайн перенесли мимо планировщика — ставим заново
+        scheduler.schedule(game_id, game['next_stage_time'], live_timer=game.get('stage') == 0)
+        return
+    delay = started - game['next_stage_time']
+    transition_delay.labels().observe(delay)
+    check_health('transition_delay', delay, f"game {game_id} transitioned {delay:.1f}s late")
+    try:
+        go_to_next_stage(game)
+    except Exception as e:
+        transition_errors.labels().inc()
+        logger.error(f"Error switching stage for game {game_id}: {e}")
+        retry_at = time() + 10
+        database.update_one('games', {'_id': game_id}, {'$set': {'next_stage_time': retry_at}})
+        scheduler.schedule(game_id, retry_at)
+    finally:
+        cycle_time.labels('transition').inc(time() - started)
+
 def stage_cycle():
-    """Главный цикл смены стадий игры + Обновление таймеров"""
-    last_timer_update = time()
-    last_request_update = time()
+    """Главный цикл смены стадий игры + Обновление таймеров.
+
+    Спит до ближайшего дедлайна из планировщика (или до следующего
+    обновления таймеров), а не опрашивает базу каждую секунду.
+    """
+    next_refresh = {}  # ключ живого сообщения -> когда его обновить
+    next_timers = time()
     
-    while True:
+    # После чистой остановки игры продолжаются с того же места; остальные игры,
+    # дедлайн которых прошёл, пока бот лежал, продолжаются по очереди.
+    # Затем восстанавливаем дедлайны из хранилища
+    # (при шардинге - только игры чатов этого процесса)
+    try:
+        games = shard.owned(database.find('games', {'game': 'mafia'}))
+        resumed = resume_after_clean_shutdown(games, shard.index)
+        recover_games(games=[g for g in games if g['_id'] not in resumed])
+    except Exception as e:
+        logger.error(f"Recovery failed: {e}")
+    scheduler.rebuild(shard.owned(database.find('games', {'game': 'mafia'})))
+    # Заявки, созданные до перезапуска; новые учитывает сам обработчик
+    for request in shard.owned(database.find('requests', {'time': {'$gt': time()}})):
+        scheduler.track_timer(('request', request['_id']), request['time'])
+    
+    while not stopping.is_set():
         try:
             current_time = time()
             
-            # 1. Проверяем игры, где время истекло (переход на след. стадию)
-            expired_games = database.find('games', {'game': 'mafia', 'next_stage_time': {'$lte': current_time}})
-            
-            for game in expired_games:
-                try:
-                    go_to_next_stage(game)
-                except Exception as e:
-                    logger.error(f"Error switching stage for game {game.get('_id')}: {e}")
-                    database.update_one('games', {'_id': game['_id']}, {'$set': {'next_stage_time': time() + 10}})
-
-            # 2. Обновляем таймеры в активных играх (раз в 10 секунд)
-            # Обновляем только стадию 0 (День), так как там длинный таймер
-            if current_time - last_timer_update >= 10:
-                active_games = database.find('games', {'game': 'mafia', 'stage': 0, 'next_stage_time': {'$gt': current_time}})
-                for game in active_games:
-                    try:
-                        update_timer(game)
-                    except Exception:
-                        pass
-                last_timer_update = current_time
-            
-            # 3. Обновляем таймеры заявок каждые 5 секунд (чтобы не превышать лимиты API)
-            if current_time - last_request_update >= 5:
-                active_requests = database.find('requests', {'time': {'$gt': current_time}})
-                for request in active_requests:
-                    try:
-                        update_request_timer(request)
-                        sleep(0.1)  # Небольшая задержка между обновлениями
-                    except Exception:
-                        pass
-                last_request_update = current_time
+            # 1. Игры, у которых наступил дедлайн — переходы уходят в пул
+            for game_id in scheduler.pop_due(current_time):
+                stage_pool.submit(game_id, run_stage_transition, game_id)
+
+            pool_lag = stage_pool.lag()
+            if pool_lag > config.STAGE_POOL_LAG_WARNING:
+                logger.warning(f"Stage pool lag {pool_lag:.1f}s, queue depth {stage_pool.queue_depth()}")
+            overdue = scheduler.overdue(current_time) + stage_pool.queue_depth()
+            overdue_games.labels().set(overdue)
+            check_health('overdue_games', overdue, f"{overdue} games are waiting for an overdue transition")
+            dispatched = time()
+            cycle_time.labels('dispatch').inc(dispatched - current_time)
+
+            # 2. Таймеры в активных играх (стадия 0 - там длинный таймер) и в заявках.
+            # Какие сообщения живы, знает планировщик - базу не перебираем.
+            # Интервал у каждого сообщения свой: реже, пока до конца далеко
+            # и пока очередь Telegram не разобрана (лимиты соблюдает очередь)
+            timers_done = requests_done = dispatched
+            if current_time >= next_timers:
+                timers = scheduler.live_timers(current_time)
+                next_timers = refresh_live_timers([t for t in timers if t[0][0] == 'game'], current_time, next_refresh)
+                timers_done = time()
+
+                next_timers = min(next_timers, refresh_live_timers(
+                    [t for t in timers if t[0][0] == 'request'], current_time, next_refresh))
+                for key in set(next_refresh) - {key for key, _ in timers}:
+                    del next_refresh[key]
+                requests_done = time()
+            cycle_time.labels('timers').inc(timers_done - dispatched)
+            cycle_time.labels('request_timers').inc(requests_done - timers_done)
+            finished = time()
+            cycle_iteration.labels().observe(finished - current_time)
+            check_health('cycle_iteration', finished - current_time, "stage_cycle iteration is slow")
+
+            # Спим до ближайшего дедлайна или до следующего обновления таймеров
+            if not stopping.is_set():
+                scheduler.wait(until=next_timers)
 
         except Exception as e:
-            logger.error(f"Error in stage_cycle loop: {e}")
+            cycle_errors.labels().inc()
+            logger.exception(f"Error in stage_cycle loop: {e}")
             sleep(1)
-        
-        sleep(1)
 
 def remove_overtimed_requests():
     while True:
@@ -205,10 +321,8 @@ def daily_events():
                             callback_data=f'daily_claim_{chat_id}'
                         ))
                         
-                        # Отправляем сообщение с кнопкой
-                        bot.send_message(chat_id, message_text, parse_mode='HTML', reply_markup=kb)
-                        
-                        sleep(0.5)  # Небольшая задержка между отправками
+                        # Отправляем сообщение с кнопкой (темп рассылки задаёт очередь бота)
+                        bot.post_message(chat_id, message_text, parse_mode='HTML', reply_markup=kb)
                     except Exception as e:
                         logger.debug(f"Error sending daily event to chat {chat_id}: {e}")
                 
@@ -228,21 +342,183 @@ def start_thread(name, target):
     thread.start()
     logger.info(f'Thread started: {name}')
 
+# Фронт шардинга: обновления не обрабатываются здесь, а уходят воркерам
+update_router = None
+
 @app.route(f'/{config.TOKEN}', methods=['POST'])
 def webhook():
     if flask.request.headers.get('content-type') == 'application/json':
         json_string = flask.request.get_data().decode('utf-8')
+        if update_router:
+            update_router.dispatch(json.loads(json_string))
+            return ''
         update = Update.de_json(json_string)
         bot.process_new_updates([update])
         return ''
     return flask.abort(403)
 
-def main():
-    try:
-        print("Starting background threads...")
-        start_thread('Stage Cycle', stage_cycle)
+# Бот останавливается: stage_cycle больше не берёт новые переходы
+stopping = Event()
+
+def drain(timeout=None):
+    """Плавная остановка.
+
+    Новые лобби не создаются, stage_cycle перестаёт запускать переходы,
+    начатые переходы и исходящие сообщения дорабатывают (не дольше timeout),
+    состояние игр сохраняется. Если всё успело завершиться, пишется отметка
+    о чистой остановке - следующий запуск продолжит игры без восстановления.
+    """
+    timeout = config.DRAIN_TIMEOUT if timeout is None else timeout
+    deadline = time() + timeout
+    logger.info(f'Draining (up to {timeout}s)...')
+    bot.draining = True
+    stopping.set()
+    scheduler.wake()
+
+    clean = stage_pool.join(max(deadline - time(), 0))
+    if game_actors.pool is not stage_pool:
+        clean = game_actors.pool.join(max(deadline - time(), 0)) and clean
+    bot.live_edits.flush()
+    clean = bot.outbox.join(max(deadline - time(), 0)) and clean
+
+    # Срок вышел - не ждём зависшие переходы, иначе drain не уложится в DRAIN_TIMEOUT
+    game_actors.stop(wait=clean and time() < deadline)
+    database.checkpoint('games')
+    if clean:
+        write_shutdown_marker(shard.owned(database.find('games', {'game': 'mafia'})), shard.index)
+        logger.info('Drained cleanly')
+    else:
+        logger.warning('Drain timed out: games will be recovered on next start')
+    return clean
+
+def _on_sigterm(signum, frame):
+    # Тот же путь, что Ctrl+C: polling/webhook завершаются, дальше - drain()
+    raise KeyboardInterrupt
+
+# Глубины очередей считаются в момент снятия метрик
+queue_depth = metrics.gauge('queue_depth', 'Задачи в очередях бота', ('queue',))
+queue_lag = metrics.gauge('queue_lag_seconds', 'Возраст самой старой задачи в очереди', ('queue',))
+
+@metrics.register_collector
+def collect_queues():
+    for name, pool in (('outbox', bot.outbox), ('stage', stage_pool)):
+        stats = pool.stats()
+        queue_depth.labels(name).set(stats['queue_depth'])
+        queue_lag.labels(name).set(stats['lag'])
+
+def start_background():
+    print("Starting background threads...")
+    start_thread('Stage Cycle', stage_cycle)
+    metrics.start_log_thread(config.METRICS_LOG_INTERVAL)
+    if config.METRICS_PORT:
+        # В режиме шардинга у каждого воркера свой порт
+        metrics.start_http_server(config.METRICS_PORT + shard.index, config.METRICS_HOST)
+    # Общие задачи (не привязанные к чату) выполняет один процесс
+    if shard.is_primary:
         start_thread('Request Cleaner', remove_overtimed_requests)
         start_thread('Daily Events', daily_events)
+
+def run_worker(index, count, updates):
+    """Воркер шардинга: обновления и стадии только своих чатов"""
+    shard.configure(index, count, config.SHARD_RING_REPLICAS)
+    database.enable_interprocess_locks()
+    # Лимит Telegram на бота общий - делим его между воркерами
+    bot.limiter = RateLimiter(
+        config.TELEGRAM_GLOBAL_RATE / count,
+        config.TELEGRAM_GROUP_RATE, config.TELEGRAM_GROUP_BURST,
+        config.TELEGRAM_PRIVATE_RATE, config.TELEGRAM_PRIVATE_BURST
+    )
+    if game_actors.enabled:
+        # Коллекцию games нельзя держать в памяти, когда её пишут несколько процессов
+        logger.warning('GAME_ACTORS: games stay on disk in sharded mode')
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    start_background()
+    logger.info(f'Shard worker {index + 1}/{count} started')
+    try:
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            try:
+                bot.process_new_updates([Update.de_json(update)])
+            except Exception as e:
+                logger.error(f"Shard {index}: error processing update {update.get('update_id')}: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        drain()
+
+def poll_updates(router):
+    """Long polling во фронте: сырые обновления сразу уходят воркерам"""
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(config.TOKEN, offset, None, 20)
+        except ApiException as e:
+            if "409" in str(e) or "Conflict" in str(e):
+                logger.error("409 Conflict: Another bot instance is running. Please stop it first.")
+                sys.exit(1)
+            logger.error(f"Polling error: {e}")
+            sleep(3)
+            continue
+        except Exception as e:
+            logger.error(f"Polling error: {e}")
+            sleep(3)
+            continue
+        for update in updates:
+            offset = update['update_id'] + 1
+            router.dispatch(update)
+
+def run_front(count):
+    """Фронт шардинга: запускает воркеры и раздаёт им обновления"""
+    global update_router
+    database.enable_interprocess_locks()
+    queues = [multiprocessing.Queue() for _ in range(count)]
+    workers = []
+    for index, queue in enumerate(queues):
+        process = multiprocessing.Process(
+            target=run_worker, args=(index, count, queue), name=f'Shard {index}', daemon=True
+        )
+        process.start()
+        workers.append(process)
+    update_router = UpdateRouter(queues, config.SHARD_RING_REPLICAS)
+    print(f"Sharded mode: {count} worker processes")
+
+    try:
+        if config.SET_WEBHOOK:
+            print(f"Setting webhook to: https://{config.SERVER_IP}/{config.TOKEN}")
+            bot.remove_webhook()
+            sleep(1)
+            cert = open(config.SSL_CERT, 'r') if config.SSL_CERT else None
+            bot.set_webhook(url=f'https://{config.SERVER_IP}/{config.TOKEN}', certificate=cert)
+            if cert: cert.close()
+            app.run(host='0.0.0.0', port=config.SERVER_PORT)
+        else:
+            print("Starting polling...")
+            try:
+                bot.remove_webhook()
+                sleep(1)
+            except Exception as e:
+                logger.warning(f"Error removing webhook: {e}")
+            poll_updates(update_router)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Воркеры дорабатывают свою очередь и выполняют drain()
+        for queue in queues:
+            queue.put(None)
+        for process in workers:
+            process.join(config.DRAIN_TIMEOUT + 5)
+
+def main():
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    try:
+        if config.SHARD_COUNT > 1:
+            run_front(config.SHARD_COUNT)
+            return
+
+        game_actors.start()
+        start_background()
         
         print("Bot logic initialized.")
 
@@ -270,8 +546,7 @@ def main():
                 bot.stop_polling()
                 logger.info("Bot stopped by user")
             except ApiException as e:
-                # Проверяем код ошибки из result
-                error_code = e.result.get('error_code') if hasattr(e, 'result') and e.result else None
+                error_code = api_error_code(e)
                 if error_code == 409 or "Conflict" in str(e) or "409" in str(e):
                     logger.error("409 Conflict: Another bot instance is running. Please stop it first.")
                     print("\n❌ Ошибка: Другой экземпляр бота уже запущен!")
@@ -296,6 +571,10 @@ def main():
         logger.info("Bot stopped by user")
     except Exception as e:
         logger.critical(f"Fatal error: {e}", exc_info=True)
+    finally:
+        # Фронт шардинга сам ничего не обрабатывает - drain выполняют воркеры
+        if config.SHARD_COUNT <= 1:
+            drain()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
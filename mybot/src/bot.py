@@ -1,6 +1,12 @@
 import config
 from logger import logger
 import database
+from seats import player_by_id
+from outbox import RateLimiter, Outbox, EditCoalescer
+from metrics import metrics
+from tracing import tracer
+from time import perf_counter
+from functools import wraps
 
 from telebot import TeleBot
 from telebot.apihelper import ApiException
@@ -16,17 +22,193 @@ STAGE_ENDING = -4
 def group_only(message):
     return message.chat.type in ('group', 'supergroup')
 
+# Метрики вызовов Bot API
+api_latency = metrics.histogram('telegram_request_seconds', 'Длительность вызовов Bot API', ('method',))
+api_errors = metrics.counter('telegram_errors_total', 'Ошибки Bot API по кодам', ('method', 'code'))
+api_retry_after = metrics.counter('telegram_retry_after_seconds_total', 'Сумма retry_after из ответов 429', ('method',))
+api_in_flight = metrics.gauge('telegram_requests_in_flight', 'Вызовы Bot API в процессе', ('method',))
+handler_latency = metrics.histogram('handler_seconds', 'Длительность обработчиков обновлений', ('handler',))
+handler_errors = metrics.counter('handler_errors_total', 'Исключения в обработчиках обновлений', ('handler',))
+
+def update_attrs(update):
+    """Атрибуты трассы для сообщения или callback: чат, пользователь, команда кнопки"""
+    attrs = {}
+    user = getattr(update, 'from_user', None)
+    if user is not None:
+        attrs['user_id'] = user.id
+    chat = getattr(getattr(update, 'message', None), 'chat', None) or getattr(update, 'chat', None)
+    if chat is not None:
+        attrs['chat_id'] = chat.id
+    data = getattr(update, 'data', None)
+    if isinstance(data, str):
+        attrs['callback'] = data.split(' ')[0]
+    return attrs
+
+def api_error_payload(e):
+    """
+    Тело ответа Telegram из ApiException. pyTelegramBotAPI кладёт в e.result
+    requests.Response, а не dict; если JSON не разобрать - берём HTTP-статус.
+    Разбирается один раз и запоминается на исключении.
+    """
+    payload = getattr(e, '_payload', None)
+    if payload is not None:
+        return payload
+    result = getattr(e, 'result', None)
+    if isinstance(result, dict):
+        payload = result
+    else:
+        try:
+            payload = result.json()
+        except Exception:
+            payload = None
+        if not isinstance(payload, dict):
+            payload = {'error_code': getattr(result, 'status_code', 0) or 0}
+    try:
+        e._payload = payload
+    except AttributeError:
+        pass
+    return payload
+
+def api_error_code(e):
+    """Код ошибки из ответа Telegram (0, если ответа нет)"""
+    return api_error_payload(e).get('error_code', 0)
+
+def retry_after_seconds(e):
+    """Сколько ждать по ответу 429 (None, если это не 429)"""
+    if not isinstance(e, ApiException):
+        return None
+    payload = api_error_payload(e)
+    if payload.get('error_code') != 429:
+        return None
+    return (payload.get('parameters') or {}).get('retry_after', 1)
+
 class MafiaHostBot(TeleBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        limiter = RateLimiter(
+            config.TELEGRAM_GLOBAL_RATE,
+            config.TELEGRAM_GROUP_RATE, config.TELEGRAM_GROUP_BURST,
+            config.TELEGRAM_PRIVATE_RATE, config.TELEGRAM_PRIVATE_BURST
+        )
+        # Лимиты и повторы после 429 выполняют потоки очереди, а не вызывающий
+        self.outbox = Outbox(config.OUTBOX_WORKERS, limiter, retry_after_seconds)
+        self.live_edits = EditCoalescer(
+            self._post_live_edit, config.LIVE_EDIT_INTERVAL, config.LIVE_EDIT_MAX_INTERVAL, self.outbox.backlog
+        )
+        # Бот останавливается: новые лобби и игры не создаются
+        self.draining = False
+
+    @property
+    def limiter(self):
+        return self.outbox.limiter
+
+    @limiter.setter
+    def limiter(self, limiter):
+        self.outbox.limiter = limiter
+
+    def _exec_task(self, task, *args, **kwargs):
+        """Запуск обработчика обновления с замером длительности"""
+        name = getattr(task, '__name__', 'unknown')
+
+        def timed_task(*task_args, **task_kwargs):
+            started = perf_counter()
+            try:
+                attrs = update_attrs(task_args[0]) if task_args else {}
+                with tracer.trace(f'handler.{name}', **attrs):
+                    return task(*task_args, **task_kwargs)
+            except Exception:
+                handler_errors.labels(name).inc()
+                raise
+            finally:
+                handler_latency.labels(name).observe(perf_counter() - started)
+        super()._exec_task(timed_task, *args, **kwargs)
+
+    def _timed(self, method, *args, **kwargs):
+        """Вызов API с замером длительности, ошибок и числа одновременных вызовов"""
+        name = method.__name__
+        in_flight = api_in_flight.labels(name)
+        in_flight.inc()
+        started = perf_counter()
+        try:
+            with tracer.span(f'telegram.{name}'):
+                return method(*args, **kwargs)
+        except ApiException as e:
+            api_errors.labels(name, api_error_code(e)).inc()
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                api_retry_after.labels(name).inc(retry_after)
+            raise
+        except Exception:
+            api_errors.labels(name, 'network').inc()
+            raise
+        finally:
+            in_flight.dec()
+            api_latency.labels(name).observe(perf_counter() - started)
+
+    def submit_request(self, chat_id, method, *args, priority=Outbox.NORMAL, **kwargs):
+        """Поставить вызов API в очередь чата и вернуть Future с его результатом"""
+        # Вызов выполнит поток очереди - передаём ему трассу текущего обработчика
+        context = tracer.context()
+        return self.outbox.submit(chat_id, self._timed_in, context, method, *args, priority=priority, **kwargs)
+
+    def _timed_in(self, context, method, *args, **kwargs):
+        """_timed в потоке очереди: спан пишется в трассу того, кто поставил вызов"""
+        with tracer.attach(context):
+            return self._timed(method, *args, **kwargs)
+
+    def _queued(self, chat_id, method, *args, **kwargs):
+        """Вызов через очередь с ожиданием результата (нужен, например, message_id)"""
+        if self.outbox.in_worker():
+            # Поток очереди уже занял токен для этого чата - ждать себя же нельзя
+            return self._timed(method, *args, **kwargs)
+        return self.submit_request(chat_id, method, *args, **kwargs).result()
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self._queued(chat_id, super().send_message, chat_id, *args, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, *args, **kwargs):
+        return self._queued(chat_id, super().edit_message_text, text, chat_id, *args, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id=None, *args, **kwargs):
+        return self._queued(chat_id, super().edit_message_reply_markup, chat_id, *args, **kwargs)
+
+    def delete_message(self, chat_id, message_id, *args, **kwargs):
+        return self._timed(super().delete_message, chat_id, message_id, *args, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        return self._timed(super().answer_callback_query, callback_query_id, *args, **kwargs)
+
+    def _post_live_edit(self, text, chat_id, message_id, **kwargs):
+        return self.submit_request(chat_id, super().edit_message_text, text, chat_id, message_id, **kwargs)
+
+    def edit_live_message(self, chat_id, message_id, text, **kwargs):
+        """Правка часто обновляемого сообщения: повторы и частые правки склеиваются"""
+        self.live_edits.edit(chat_id, message_id, text, **kwargs)
+
+    def post_message(self, chat_id, *args, priority=Outbox.NORMAL, **kwargs):
+        """Отправить сообщение через очередь, не дожидаясь результата; вернуть Future"""
+        future = self.submit_request(chat_id, super().send_message, chat_id, *args, priority=priority, **kwargs)
+        future.add_done_callback(self._log_send_error)
+        return future
+
+    @staticmethod
+    def _log_send_error(future):
+        e = future.exception()
+        if e is None:
+            return
+        if not isinstance(e, ApiException) or api_error_code(e) != 403:
+            logger.error(f'Ошибка API при отправке сообщения: {e}', exc_info=False)
+
     def try_to_send_message(self, *args, **kwargs):
         try:
             return self.send_message(*args, **kwargs)
         except ApiException as e:
             # Логируем только реальные ошибки, игнорируем, если бот заблокирован пользователем
-            error_code = e.result.get('error_code', 0) if hasattr(e, 'result') and isinstance(e.result, dict) else 0
-            if error_code != 403:
+            if api_error_code(e) != 403:
                 logger.error(f'Ошибка API при отправке сообщения: {e}', exc_info=False)
 
     def _game_handler(self, handler):
+        @wraps(handler)
         def decorator(message, *args, **kwargs):
             # 1. Получаем игру
             game = database.find_one('games', {'chat': message.chat.id})
@@ -39,8 +221,7 @@ class MafiaHostBot(TeleBot):
             user_id = message.from_user.id
             
             # 2. Ищем игрока
-            # Используем next с дефолтным значением None, чтобы не ловить StopIteration
-            player = next((p for p in game.get('players', []) if p.get('id') == user_id), None)
+            player = player_by_id(game, user_id)
 
             should_delete = False
 
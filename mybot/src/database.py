@@ -4,40 +4,226 @@ from typing import Dict, Any, List, Optional
 import json
 import uuid
 import threading
-from copy import deepcopy
+from functools import wraps
+from time import perf_counter
+
+from metrics import metrics
+from tracing import tracer
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессные блокировки недоступны
+    fcntl = None
+
+db_latency = metrics.histogram('db_operation_seconds', 'Длительность операций с коллекциями', ('op', 'collection'))
+
+# Сколько записей журнала копится до того, как коллекция целиком перепишется в файл
+JOURNAL_MAX_ENTRIES = 1000
+
+
+def _timed(method):
+    """Замер длительности операции с коллекцией (первый аргумент - имя коллекции)"""
+    op = method.__name__
+
+    @wraps(method)
+    def wrapper(self, collection_name, *args, **kwargs):
+        started = perf_counter()
+        try:
+            with tracer.span(f'db.{op}', collection=collection_name):
+                return method(self, collection_name, *args, **kwargs)
+        finally:
+            db_latency.labels(op, collection_name).observe(perf_counter() - started)
+    return wrapper
+
+
+class _CollectionLock:
+    """Блокировка коллекции: между потоками, а при interprocess - и между процессами (flock)"""
+
+    def __init__(self, lock_path: Path):
+        self._thread_lock = threading.Lock()
+        self._lock_path = lock_path
+        self.interprocess = False
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self.interprocess and fcntl is not None:
+            try:
+                self._file = open(self._lock_path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except Exception:
+                self._thread_lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
 
 class Database:
     def __init__(self, db_path: str = 'data'):
         self.db_path = Path(db_path)
         self.db_path.mkdir(exist_ok=True)
-        self._locks: Dict[str, threading.Lock] = {}
+        self._locks: Dict[str, _CollectionLock] = {}
         self._global_lock = threading.Lock()
+        # Коллекции, которые живут в памяти и пишутся на диск только при checkpoint()
+        self._memory: Dict[str, Dict[str, Any]] = {}
+        # JSON-снимок каждого документа таких коллекций: из него читаются копии
+        # и он же уходит в журнал при checkpoint()
+        self._encoded: Dict[str, Dict[str, str]] = {}
+        # id документов, изменённых (или удалённых) после последнего checkpoint()
+        self._dirty: Dict[str, set] = {}
+        self._journal_size: Dict[str, int] = {}
+        # Несколько процессов бота работают с одними файлами (шардинг)
+        self._interprocess = False
 
-    def _get_lock(self, collection_name: str) -> threading.Lock:
+    def _get_lock(self, collection_name: str) -> _CollectionLock:
         with self._global_lock:
             if collection_name not in self._locks:
-                self._locks[collection_name] = threading.Lock()
+                lock = _CollectionLock(self.db_path / f".{collection_name}.lock")
+                lock.interprocess = self._interprocess
+                self._locks[collection_name] = lock
             return self._locks[collection_name]
+
+    def enable_interprocess_locks(self):
+        """Блокировать коллекции и между процессами (файлы читаются заново при каждой операции)"""
+        with self._global_lock:
+            self._interprocess = True
+            for lock in self._locks.values():
+                lock.interprocess = True
     
     def _get_collection_path(self, collection_name: str) -> Path:
         return self.db_path / f"{collection_name}.json"
+
+    def _get_journal_path(self, collection_name: str) -> Path:
+        return self.db_path / f"{collection_name}.journal"
     
+    def hold_in_memory(self, collection_name: str):
+        """Держать коллекцию в памяти: чтения и записи не трогают диск до checkpoint()"""
+        with self._get_lock(collection_name):
+            if collection_name in self._memory:
+                return
+            data = self._load_collection(collection_name)
+            if self._get_journal_path(collection_name).exists():
+                # Журнал после аварийной остановки уже применён - сворачиваем его в файл
+                self._dump_collection(collection_name, data)
+            self._memory[collection_name] = data
+            self._encoded[collection_name] = {doc_id: json.dumps(doc, ensure_ascii=False) for doc_id, doc in data.items()}
+            self._dirty[collection_name] = set()
+            self._journal_size[collection_name] = 0
+
+    def release_memory(self, collection_name: str):
+        """Сохранить коллекцию и вернуть её в обычный (файловый) режим"""
+        with self._get_lock(collection_name):
+            if collection_name not in self._memory:
+                return
+            self._append_journal(collection_name)
+            self._dump_collection(collection_name, self._memory.pop(collection_name))
+            self._encoded.pop(collection_name, None)
+            self._dirty.pop(collection_name, None)
+            self._journal_size.pop(collection_name, None)
+
+    def checkpoint(self, collection_name: str) -> bool:
+        """
+        Дописать в журнал коллекции документы, изменённые с прошлого раза.
+        Возвращает True, если была запись.
+        """
+        with self._get_lock(collection_name):
+            if collection_name not in self._memory or not self._dirty[collection_name]:
+                return False
+            self._append_journal(collection_name)
+            if self._journal_size[collection_name] > max(JOURNAL_MAX_ENTRIES, len(self._memory[collection_name])):
+                self._dump_collection(collection_name, self._memory[collection_name])
+            return True
+
+    def _append_journal(self, collection_name: str):
+        """Журнал: строка на изменённый документ ({"_id", "doc"}, doc = null - удалён)"""
+        dirty = self._dirty[collection_name]
+        if not dirty:
+            return
+        encoded = self._encoded[collection_name]
+        lines = []
+        for doc_id in dirty:
+            doc = encoded.get(doc_id, 'null')
+            lines.append(f'{{"_id": {json.dumps(doc_id)}, "doc": {doc}}}\n')
+        with open(self._get_journal_path(collection_name), 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+        self._journal_size[collection_name] += len(lines)
+        dirty.clear()
+
+    def _replay_journal(self, collection_name: str, data: Dict[str, Any]):
+        path = self._get_journal_path(collection_name)
+        if not path.exists():
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Недописанная строка при аварийной остановке
+                if entry['doc'] is None:
+                    data.pop(entry['_id'], None)
+                else:
+                    data[entry['_id']] = entry['doc']
+
+    def _isolate(self, collection_name: str, obj):
+        """Для коллекций в памяти внутрь берём только копии"""
+        if collection_name in self._memory:
+            return json.loads(json.dumps(obj, ensure_ascii=False))
+        return obj
+
+    def _export(self, collection_name: str, doc_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Документ наружу: для коллекций в памяти - свежая копия из его JSON-снимка"""
+        encoded = self._encoded.get(collection_name)
+        if encoded is not None:
+            doc = json.loads(encoded[doc_id])
+        return {**doc, '_id': doc_id}
+
     def _read_collection(self, collection_name: str) -> Dict[str, Any]:
+        if collection_name in self._memory:
+            return self._memory[collection_name]
+        return self._load_collection(collection_name)
+
+    def _load_collection(self, collection_name: str) -> Dict[str, Any]:
         path = self._get_collection_path(collection_name)
         if not path.exists():
             return {}
         try:
             with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                data = json.load(f)
         except (json.JSONDecodeError, FileNotFoundError):
-            return {}
+            data = {}
+        self._replay_journal(collection_name, data)
+        return data
     
-    def _write_collection(self, collection_name: str, data: Dict[str, Any]):
+    def _write_collection(self, collection_name: str, data: Dict[str, Any], changed=()):
+        """Сохранить коллекцию; changed - id изменённых (или удалённых) документов"""
+        if collection_name in self._memory:
+            encoded = self._encoded[collection_name]
+            for doc_id in changed:
+                if doc_id in data:
+                    encoded[doc_id] = json.dumps(data[doc_id], ensure_ascii=False)
+                else:
+                    encoded.pop(doc_id, None)
+            self._dirty[collection_name].update(changed)
+            return
+        self._dump_collection(collection_name, data)
+
+    def _dump_collection(self, collection_name: str, data: Dict[str, Any]):
         path = self._get_collection_path(collection_name)
         temp_path = path.with_suffix('.tmp')
         with open(temp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         os.replace(temp_path, path)
+        # Файл теперь содержит всё, что было в журнале
+        journal = self._get_journal_path(collection_name)
+        if journal.exists():
+            journal.unlink()
+        if collection_name in self._journal_size:
+            self._journal_size[collection_name] = 0
 
     def _get_path(self, doc, path):
         keys = path.split('.')
@@ -159,38 +345,48 @@ class Database:
         except (TypeError, KeyError, ValueError):
             return False
 
+    @_timed
     def find_one(self, collection_name: str, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
+            doc_id = query.get('_id') if len(query) == 1 else None
+            if isinstance(doc_id, str):
+                # Поиск по id - без перебора коллекции
+                doc = collection.get(doc_id)
+                return self._export(collection_name, doc_id, doc) if doc is not None else None
             for doc_id, doc in collection.items():
                 full_doc = {**doc, '_id': doc_id}
                 if self._matches_query(full_doc, query):
-                    return full_doc
+                    return self._export(collection_name, doc_id, doc)
             return None
     
+    @_timed
     def find(self, collection_name: str, query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
             if not query:
-                return [{**doc, '_id': doc_id} for doc_id, doc in collection.items()]
+                return [self._export(collection_name, doc_id, doc) for doc_id, doc in collection.items()]
             results = []
             for doc_id, doc in collection.items():
                 full_doc = {**doc, '_id': doc_id}
                 if self._matches_query(full_doc, query):
-                    results.append(full_doc)
+                    results.append(self._export(collection_name, doc_id, doc))
             return results
     
+    @_timed
     def insert_one(self, collection_name: str, document: Dict[str, Any]) -> str:
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
             doc_id = str(uuid.uuid4())
-            collection[doc_id] = document
-            self._write_collection(collection_name, collection)
+            collection[doc_id] = self._isolate(collection_name, document)
+            self._write_collection(collection_name, collection, (doc_id,))
             return doc_id
     
+    @_timed
     def update_one(self, collection_name: str, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> bool:
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
+            update = self._isolate(collection_name, update)
             updated = False
             
             for doc_id, doc in collection.items():
@@ -247,7 +443,7 @@ class Database:
                         for k in update['$unset']: self._unset_path(doc, k)
 
                     collection[doc_id] = doc
-                    self._write_collection(collection_name, collection)
+                    self._write_collection(collection_name, collection, (doc_id,))
                     return True
             
             if not updated and upsert:
@@ -258,11 +454,12 @@ class Database:
                     for k, v in update['$inc'].items(): self._set_path(new_doc, k, v)
                 doc_id = str(uuid.uuid4())
                 collection[doc_id] = new_doc
-                self._write_collection(collection_name, collection)
+                self._write_collection(collection_name, collection, (doc_id,))
                 return True
 
             return False
             
+    @_timed
     def delete_one(self, collection_name: str, query: Dict[str, Any]) -> bool:
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
@@ -270,10 +467,11 @@ class Database:
                 full_doc = {**doc, '_id': doc_id}
                 if self._matches_query(full_doc, query):
                     del collection[doc_id]
-                    self._write_collection(collection_name, collection)
+                    self._write_collection(collection_name, collection, (doc_id,))
                     return True
             return False
 
+    @_timed
     def delete_many(self, collection_name: str, query: Dict[str, Any]) -> int:
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
@@ -286,14 +484,16 @@ class Database:
             if to_delete:
                 for doc_id in to_delete:
                     del collection[doc_id]
-                self._write_collection(collection_name, collection)
+                self._write_collection(collection_name, collection, to_delete)
             
             return len(to_delete)
 
+    @_timed
     def find_one_and_update(self, collection_name: str, query: Dict[str, Any], update: Dict[str, Any], **kwargs):
         """Атомарная операция: найти документ по условию и обновить его"""
         with self._get_lock(collection_name):
             collection = self._read_collection(collection_name)
+            update = self._isolate(collection_name, update)
             
             # Сначала находим документ по условию
             found_doc = None
@@ -360,13 +560,13 @@ class Database:
                     self._unset_path(found_doc, k)
             
             # Сохраняем изменения
-            self._write_collection(collection_name, collection)
+            self._write_collection(collection_name, collection, (found_id,))
             
             # Возвращаем обновленный документ
-            return_document = kwargs.get('return_document', False)
-            if return_document:
-                return {**found_doc, '_id': found_id}
-            return found_doc
+            result = self._export(collection_name, found_id, found_doc)
+            if not kwargs.get('return_document', False):
+                del result['_id']
+            return result
 
 # Инициализация
 db_instance = Database('data')
@@ -378,4 +578,8 @@ insert_one = db_instance.insert_one
 update_one = db_instance.update_one
 delete_one = db_instance.delete_one
 delete_many = db_instance.delete_many
-find_one_and_update = db_instance.find_one_and_update
\ No newline at end of file
+find_one_and_update = db_instance.find_one_and_update
+hold_in_memory = db_instance.hold_in_memory
+release_memory = db_instance.release_memory
+checkpoint = db_instance.checkpoint
+enable_interprocess_locks = db_instance.enable_interprocess_locks
\ No newline at end of file
@@ -1,6 +1,9 @@
 from bot import bot
 import database
+from scheduler import scheduler
 from html import escape 
+from seats import build_seats, build_alive_counts
+from metrics import metrics
 import random
 
 role_titles = {
@@ -297,6 +300,10 @@ def update_player_stats(game, reason):
             except Exception as e:
                 print(f"Error checking achievements for user {user_id}: {e}")
 
+games_started = metrics.counter('games_started_total', 'Начатые игры', ('mode',))
+games_finished = metrics.counter('games_finished_total', 'Завершённые игры', ('mode',))
+games_abandoned = metrics.counter('games_abandoned_total', 'Игры, прерванные без подсчёта итогов', ('mode',))
+
 def stop_game(game, reason):
     winner_text = reason
     roles_list = []
@@ -314,10 +321,11 @@ def stop_game(game, reason):
     try:
         update_player_stats(game, reason)
         
-        # Отправляем личные сообщения с изменением рейтинга
+        # Отправляем личные сообщения с изменением рейтинга (параллельно;
+        # игроков, заблокировавших бота, рассылка просто пропускает)
+        rating_messages = []
         for player in game['players']:
-            user_id = player['id']
-            stats = database.find_one('player_stats', {'user_id': user_id})
+            stats = database.find_one('player_stats', {'user_id': player['id']})
             if stats and 'elo_change' in stats:
                 elo_change = stats.get('elo_change', 0)
                 elo_rating = stats.get('elo_rating', 1000)
@@ -325,14 +333,27 @@ def stop_game(game, reason):
                     change_emoji = "📈" if elo_change > 0 else "📉"
                     change_text = f"{change_emoji} <b>Изменение рейтинга: {elo_change:+d}</b>\n"
                     change_text += f"🏆 <b>Новый рейтинг: {elo_rating}</b>"
-                    try:
-                        bot.send_message(user_id, change_text, parse_mode='HTML')
-                    except:
-                        pass  # Игрок заблокировал бота или не может получать сообщения
+                    rating_messages.append((player, change_text, None))
+        if rating_messages:
+            # stages импортирует game, поэтому импорт здесь
+            from stages import send_player_messages
+            send_player_messages(game, rating_messages, edit=False, save_pm_ids=False)
     except Exception as e:
         print(f"Error updating player stats: {e}")
     
+    scheduler.cancel(game['_id'])
+    database.delete_one('games', {'_id': game['_id']})
+    games_finished.labels(game.get('mode', 'full')).inc()
+
+def abandon_game(game, reason):
+    """
+    Завершить игру без итогов: рейтинг и статистика не меняются.
+    Для игр, прерванных не по вине игроков (бот был недоступен).
+    """
+    bot.try_to_send_message(game['chat'], reason, parse_mode='HTML')
+    scheduler.cancel(game['_id'])
     database.delete_one('games', {'_id': game['_id']})
+    games_abandoned.labels(game.get('mode', 'full')).inc()
 
 def start_game(chat_id, players, mode='full'):
     players_count = len(players)
@@ -387,10 +408,14 @@ def start_game(chat_id, players, mode='full'):
         p_obj['lawyer_client'] = None  # Подзащитный адвоката
         game_players.append(p_obj)
 
+    seats, role_seats = build_seats(game_players)
     game = {
         'game': 'mafia', 'mode': mode, 'chat': chat_id, 'stage': -4,
         'day_count': 0, 'players': game_players, 'cards': cards,
+        'seats': seats, 'role_seats': role_seats,  # id игрока -> место, роль -> места
+        'alive_counts': build_alive_counts(game_players),  # Живые по сторонам: mafia / maniac / civil
         'vote': {}, 'shots': [], 'heals': [], 'played': [], 
+        'vote_counts': {}, 'vote_voters': {},  # Счётчики голосов: {индекс цели: число / [голосовавшие]}
         'blocks': [], 'silenced': [],  # Для Любовницы
         'candidates': [],  # Кандидаты на голосование
         'first_night_done': False,  # Была ли первая ночь
@@ -401,7 +426,10 @@ def start_game(chat_id, players, mode='full'):
         'current_speaker': 0,  # Текущий говорящий
         'speech_start_time': None,  # Время начала речи
         'night_count': 0,  # Счетчик ночей
+        'rng_seed': random.randrange(2 ** 32),  # Зерно случайностей ночи (night.night_rng)
         'missed_actions': {}  # Счетчик пропущенных действий для каждого игрока {user_id: count}
     }
     
-    return database.insert_one('games', game), game
\ No newline at end of file
+    game_id = database.insert_one('games', game)
+    games_started.labels(mode).inc()
+    return game_id, game
\ No newline at end of file
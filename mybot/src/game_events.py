@@ -1,9 +1,12 @@
 # game_events.py
+import bisect
 import random
+import threading
 import logging
 from datetime import datetime, timedelta
 import traceback
 import database
+from seats import revive, alive_counts
 
 logger = logging.getLogger(__name__)
 
@@ -207,8 +210,10 @@ class ResurrectionEvent(GameEvent):
         dead_players = [(i, p) for i, p in enumerate(game['players']) if not p.get('alive')]
         if dead_players:
             target_idx, target = dead_players[-1]
-            game['players'][target_idx]['alive'] = True
-            database.update_one('games', {'_id': game['_id']}, {'$set': {f'players.{target_idx}.alive': True}})
+            revive(game, target_idx)
+            database.update_one('games', {'_id': game['_id']}, {
+                '$set': {f'players.{target_idx}.alive': True, 'alive_counts': alive_counts(game)}
+            })
             return {"effect": "player_resurrected", "target": target['name']}
         return {"effect": "no_dead_players"}
 
@@ -534,123 +539,120 @@ def get_current_season():
     else:
         return 'autumn'
 
+# Порядок событий в магазине
+EVENT_CLASSES = [
+    TimeFreezeEvent, BlizzardEvent, SantaWorkshopEvent,
+    DoubleVoteEvent, NightVisionEvent, ProtectionEvent, ConfusionEvent, ExtraTimeEvent,
+    ResurrectionEvent, RoleRevealEvent, MafiaRevealEvent, ImmunityEvent,
+    TimeRewindEvent, AllRolesRevealEvent,
+    SnowstormEvent, GiftExchangeEvent, SilentNightEvent,
+    HeatWaveEvent, SummerFestivalEvent,
+    SpringRainEvent, BloomEvent,
+    AutumnFogEvent, HarvestEvent,
+    DoubleKillEvent, LuckyDayEvent
+]
+
+# Вероятности: 60% common, 30% rare, 10% legendary
+RARITY_WEIGHTS = {'common': 0.6, 'rare': 0.3, 'legendary': 0.1}
+
+# В магазине у части событий описание короче, чем объявление в игре
+SHOP_DESCRIPTIONS = {
+    'santa_workshop': '🎅 Мастерская Санты! Доктор может снова использовать самолечение.',
+    'night_vision': '🌙 Ночное зрение! Комиссар может проверить двух игроков вместо одного.',
+    'confusion': '🌀 Путаница! Все роли перемешаны - игроки видят чужие роли.',
+    'immunity': '✨ Иммунитет! Случайный живой игрок получает иммунитет от голосования.',
+    'silent_night': '🤫 Тихая ночь! Все ночные способности работают медленнее.',
+    'heat_wave': '☀️ Волна жары! Время на действия сокращается.',
+    'summer_festival': '🎉 Летний фестиваль! Все игроки получают бонус к ELO рейтингу.',
+    'spring_rain': '🌧️ Весенний дождь! Все способности работают с задержкой.',
+    'autumn_fog': '🌫️ Осенний туман! Все проверки дают неверный результат.',
+    'double_kill': '⚔️ Двойное убийство! Мафия может убить двух игроков вместо одного.',
+}
+
+
+class EventRegistry:
+    """
+    Справочник событий. Метаданные (имя, цена, редкость, сезон) читаются
+    один раз при импорте, выборки по текущему сезону пересобираются только
+    при смене сезона, а случайное событие выбирается бисекцией по таблице
+    накопленных весов.
+    """
+
+    def __init__(self, classes):
+        self.events = {}
+        for event_class in classes:
+            prototype = event_class()
+            self.events[prototype.name] = {
+                'name': prototype.name,
+                'class': event_class,
+                'cost': prototype.cost,
+                'description': SHOP_DESCRIPTIONS.get(prototype.name, prototype.description),
+                'rarity': prototype.rarity,
+                'seasonal': prototype.seasonal,
+            }
+        self._lock = threading.Lock()
+        self._season = None
+        self._snapshot = None
+
+    def _current(self):
+        season = get_current_season()
+        snapshot = self._snapshot
+        if snapshot is not None and self._season == season:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._season != season:
+                self._snapshot = self._build(season)
+                self._season = season
+            return self._snapshot
+
+    def _build(self, season):
+        available = [e for e in self.events.values() if e['seasonal'] is None or e['seasonal'] == season]
+        by_rarity = {}
+        for info in available:
+            by_rarity.setdefault(info['rarity'], []).append(info)
+        # Вес редкости делится поровну между её событиями; если какой-то
+        # редкости в сезоне нет, её доля распределяется между остальными
+        classes, cumulative, total = [], [], 0.0
+        for rarity, events in by_rarity.items():
+            weight = RARITY_WEIGHTS.get(rarity, 0) / len(events)
+            for info in events:
+                total += weight
+                classes.append(info['class'])
+                cumulative.append(total)
+        return available, by_rarity, classes, cumulative
+
+    def available(self):
+        return self._current()[0]
+
+    def by_rarity(self, rarity):
+        return self._current()[1].get(rarity, [])
+
+    def draw(self):
+        available, _, classes, cumulative = self._current()
+        if not cumulative or cumulative[-1] <= 0:
+            return random.choice(available)['class']() if available else None
+        pos = bisect.bisect(cumulative, random.random() * cumulative[-1])
+        return classes[min(pos, len(classes) - 1)]()
+
+    def create(self, event_name):
+        info = self.events.get(event_name)
+        return info['class']() if info else None
+
+
+registry = EventRegistry(EVENT_CLASSES)
+
 def get_random_event():
     """Получить случайное событие с учетом сезона и редкости"""
-    current_season = get_current_season()
-    
-    # Все события
-    all_events = [
-        TimeFreezeEvent, BlizzardEvent, SantaWorkshopEvent,
-        DoubleVoteEvent, NightVisionEvent, ProtectionEvent, ConfusionEvent, ExtraTimeEvent,
-        ResurrectionEvent, RoleRevealEvent, MafiaRevealEvent, ImmunityEvent,
-        TimeRewindEvent, AllRolesRevealEvent,
-        SnowstormEvent, GiftExchangeEvent, SilentNightEvent,
-        HeatWaveEvent, SummerFestivalEvent,
-        SpringRainEvent, BloomEvent,
-        AutumnFogEvent, HarvestEvent,
-        DoubleKillEvent, LuckyDayEvent
-    ]
-    
-    # Фильтруем по сезону
-    seasonal_events = []
-    for event_class in all_events:
-        event_instance = event_class()
-        if event_instance.seasonal is None or event_instance.seasonal == current_season:
-            seasonal_events.append(event_class)
-    
-    # Взвешенный выбор по редкости
-    common_events = []
-    rare_events = []
-    legendary_events = []
-    
-    for event_class in seasonal_events:
-        event_instance = event_class()
-        if event_instance.rarity == 'common':
-            common_events.append(event_class)
-        elif event_instance.rarity == 'rare':
-            rare_events.append(event_class)
-        elif event_instance.rarity == 'legendary':
-            legendary_events.append(event_class)
-    
-    # Вероятности: 60% common, 30% rare, 10% legendary
-    rand = random.random()
-    if rand < 0.6 and common_events:
-        return random.choice(common_events)()
-    elif rand < 0.9 and rare_events:
-        return random.choice(rare_events)()
-    elif legendary_events:
-        return random.choice(legendary_events)()
-    else:
-        # Fallback на любое событие
-        return random.choice(seasonal_events)()
+    return registry.draw()
 
 def get_event_by_name(event_name):
     """Получить класс события по имени"""
-    events_map = {
-        'time_freeze': TimeFreezeEvent,
-        'blizzard': BlizzardEvent,
-        'santa_workshop': SantaWorkshopEvent,
-        'double_vote': DoubleVoteEvent,
-        'night_vision': NightVisionEvent,
-        'protection': ProtectionEvent,
-        'confusion': ConfusionEvent,
-        'extra_time': ExtraTimeEvent,
-        'resurrection': ResurrectionEvent,
-        'role_reveal': RoleRevealEvent,
-        'mafia_reveal': MafiaRevealEvent,
-        'immunity': ImmunityEvent,
-        'time_rewind': TimeRewindEvent,
-        'all_roles_reveal': AllRolesRevealEvent,
-        'snowstorm': SnowstormEvent,
-        'gift_exchange': GiftExchangeEvent,
-        'silent_night': SilentNightEvent,
-        'heat_wave': HeatWaveEvent,
-        'summer_festival': SummerFestivalEvent,
-        'spring_rain': SpringRainEvent,
-        'bloom': BloomEvent,
-        'autumn_fog': AutumnFogEvent,
-        'harvest': HarvestEvent,
-        'double_kill': DoubleKillEvent,
-        'lucky_day': LuckyDayEvent
-    }
-    event_class = events_map.get(event_name)
-    if event_class:
-        return event_class()
-    return None
+    return registry.create(event_name)
 
 def get_available_events():
-    """Получить список доступных событий с ценами и редкостью"""
-    current_season = get_current_season()
-    
-    all_events = [
-        {'name': 'time_freeze', 'class': TimeFreezeEvent, 'cost': 30, 'description': '⏱️ Замедление времени! Следующий день длится в 2 раза дольше.', 'rarity': 'common', 'seasonal': None},
-        {'name': 'blizzard', 'class': BlizzardEvent, 'cost': 30, 'description': '❄️ Метель! Случайный живой игрок заблокирован на следующую ночь.', 'rarity': 'common', 'seasonal': 'winter'},
-        {'name': 'santa_workshop', 'class': SantaWorkshopEvent, 'cost': 50, 'description': '🎅 Мастерская Санты! Доктор может снова использовать самолечение.', 'rarity': 'rare', 'seasonal': 'winter'},
-        {'name': 'double_vote', 'class': DoubleVoteEvent, 'cost': 25, 'description': '🗳️ Двойное голосование! Следующее голосование будет проведено дважды.', 'rarity': 'common', 'seasonal': None},
-        {'name': 'night_vision', 'class': NightVisionEvent, 'cost': 35, 'description': '🌙 Ночное зрение! Комиссар может проверить двух игроков вместо одного.', 'rarity': 'common', 'seasonal': None},
-        {'name': 'protection', 'class': ProtectionEvent, 'cost': 40, 'description': '🛡️ Защита! Случайный живой игрок защищен от следующего убийства.', 'rarity': 'common', 'seasonal': None},
-        {'name': 'confusion', 'class': ConfusionEvent, 'cost': 30, 'description': '🌀 Путаница! Все роли перемешаны - игроки видят чужие роли.', 'rarity': 'common', 'seasonal': None},
-        {'name': 'extra_time', 'class': ExtraTimeEvent, 'cost': 20, 'description': '⏰ Дополнительное время! Следующая фаза длится на 30 секунд дольше.', 'rarity': 'common', 'seasonal': None},
-        {'name': 'resurrection', 'class': ResurrectionEvent, 'cost': 80, 'description': '💀 Воскрешение! Последний убитый игрок возвращается в игру.', 'rarity': 'rare', 'seasonal': None},
-        {'name': 'role_reveal', 'class': RoleRevealEvent, 'cost': 60, 'description': '🔍 Раскрытие роли! Роль случайного живого игрока раскрывается всем.', 'rarity': 'rare', 'seasonal': None},
-        {'name': 'mafia_reveal', 'class': MafiaRevealEvent, 'cost': 70, 'description': '😈 Раскрытие мафии! Все мафиози раскрываются мирным игрокам.', 'rarity': 'rare', 'seasonal': None},
-        {'name': 'immunity', 'class': ImmunityEvent, 'cost': 75, 'description': '✨ Иммунитет! Случайный живой игрок получает иммунитет от голосования.', 'rarity': 'rare', 'seasonal': None},
-        {'name': 'time_rewind', 'class': TimeRewindEvent, 'cost': 150, 'description': '⏪ Откат времени! Игра возвращается на предыдущую стадию.', 'rarity': 'legendary', 'seasonal': None},
-        {'name': 'all_roles_reveal', 'class': AllRolesRevealEvent, 'cost': 200, 'description': '👁️ Всевидение! Все роли всех живых игроков раскрываются.', 'rarity': 'legendary', 'seasonal': None},
-        {'name': 'snowstorm', 'class': SnowstormEvent, 'cost': 40, 'description': '🌨️ Снежная буря! Все ночные действия отменяются в следующую ночь.', 'rarity': 'rare', 'seasonal': 'winter'},
-        {'name': 'gift_exchange', 'class': GiftExchangeEvent, 'cost': 50, 'description': '🎁 Обмен подарками! Все живые игроки получают по 5 конфет.', 'rarity': 'rare', 'seasonal': 'winter'},
-        {'name': 'silent_night', 'class': SilentNightEvent, 'cost': 40, 'description': '🤫 Тихая ночь! Все ночные способности работают медленнее.', 'rarity': 'common', 'seasonal': 'winter'},
-        {'name': 'heat_wave', 'class': HeatWaveEvent, 'cost': 35, 'description': '☀️ Волна жары! Время на действия сокращается.', 'rarity': 'common', 'seasonal': 'summer'},
-        {'name': 'summer_festival', 'class': SummerFestivalEvent, 'cost': 45, 'description': '🎉 Летний фестиваль! Все игроки получают бонус к ELO рейтингу.', 'rarity': 'rare', 'seasonal': 'summer'},
-        {'name': 'spring_rain', 'class': SpringRainEvent, 'cost': 30, 'description': '🌧️ Весенний дождь! Все способности работают с задержкой.', 'rarity': 'common', 'seasonal': 'spring'},
-        {'name': 'bloom', 'class': BloomEvent, 'cost': 40, 'description': '🌸 Цветение! Все живые игроки получают по 3 конфеты.', 'rarity': 'common', 'seasonal': 'spring'},
-        {'name': 'autumn_fog', 'class': AutumnFogEvent, 'cost': 35, 'description': '🌫️ Осенний туман! Все проверки дают неверный результат.', 'rarity': 'common', 'seasonal': 'autumn'},
-        {'name': 'harvest', 'class': HarvestEvent, 'cost': 45, 'description': '🌾 Урожай! Все живые игроки получают по 4 конфеты.', 'rarity': 'common', 'seasonal': 'autumn'},
-        {'name': 'double_kill', 'class': DoubleKillEvent, 'cost': 90, 'description': '⚔️ Двойное убийство! Мафия может убить двух игроков вместо одного.', 'rarity': 'rare', 'seasonal': None},
-        {'name': 'lucky_day', 'class': LuckyDayEvent, 'cost': 55, 'description': '🍀 Счастливый день! Все живые игроки получают случайный бонус.', 'rarity': 'rare', 'seasonal': None}
-    ]
-    
-    # Фильтруем по сезону
-    available = [e for e in all_events if e['seasonal'] is None or e['seasonal'] == current_season]
-    
-    return available
+    """Получить список доступных событий с ценами и редкостью (копии: справочник не меняется)"""
+    return [dict(info) for info in registry.available()]
+
+def get_events_by_rarity(rarity):
+    """Доступные в текущем сезоне события указанной редкости"""
+    return [dict(info) for info in registry.by_rarity(rarity)]
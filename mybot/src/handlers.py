@@ -5,8 +5,11 @@ import logging
 import os
 from logging.handlers import RotatingFileHandler
 from game import role_titles, stop_game, start_game
-from stages import stages, go_to_next_stage, format_roles, get_votes, send_player_message
+from stages import stages, go_to_next_stage, check_night_stage_complete, format_roles, get_votes, record_vote, send_player_message, send_player_messages
 from bot import bot
+from actors import game_actors
+from seats import seat_of, player_by_id, player_with_role, role_seats
+from scheduler import scheduler
 
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, LabeledPrice
 from telebot.apihelper import ApiException
@@ -87,38 +90,32 @@ def safe_answer_callback(call_id, text=None, show_alert=False):
             bot.answer_callback_query(callback_query_id=call_id, text=text, show_alert=show_alert)
         else:
             bot.answer_callback_query(callback_query_id=call_id)
-    except ApiException as e:
-        error_code = e.result.get('error_code', 0) if hasattr(e, 'result') and isinstance(e.result, dict) else 0
-        if error_code == 429:
-            retry_after = e.result.get('parameters', {}).get('retry_after', 1) if hasattr(e, 'result') and isinstance(e.result, dict) else 1
-            from time import sleep
-            sleep(retry_after)
-            try:
-                if text is not None:
-                    bot.answer_callback_query(callback_query_id=call_id, text=text, show_alert=show_alert)
-                else:
-                    bot.answer_callback_query(callback_query_id=call_id)
-            except:
-                pass
-        # Для других ошибок (например, 400 - query is too old) просто игнорируем
+    except ApiException:
+        # 400 (query is too old) и 429 просто игнорируем: ответ на кнопку
+        # быстро устаревает, а ждать retry_after в потоке обработчика нельзя
         pass
 
 def safe_send_message(chat_id, text, **kwargs):
-    """Безопасная отправка сообщения с обработкой ошибок 429"""
+    """Безопасная отправка сообщения (429 повторяет очередь бота)"""
     try:
         return bot.send_message(chat_id, text, **kwargs)
-    except ApiException as e:
-        error_code = e.result.get('error_code', 0) if hasattr(e, 'result') and isinstance(e.result, dict) else 0
-        if error_code == 429:
-            retry_after = e.result.get('parameters', {}).get('retry_after', 1) if hasattr(e, 'result') and isinstance(e.result, dict) else 1
-            from time import sleep
-            sleep(retry_after)
-            try:
-                return bot.send_message(chat_id, text, **kwargs)
-            except:
-                return None
+    except ApiException:
         return None
 
+def queue_stage_check(game, func, **kwargs):
+    """
+    Переход стадии из обработчика выполняется в пуле стадий (ключ - id игры),
+    а не в потоке telebot: по очереди с переходами по дедлайну, и drain()
+    его дожидается. Если к запуску стадия уже сменилась - ничего не делаем.
+    """
+    stage = game.get('stage')
+
+    def run():
+        current = database.find_one('games', {'_id': game['_id']})
+        if current and current.get('stage') == stage:
+            func(current, **kwargs)
+    game_actors.pool.submit(game['_id'], run)
+
 def get_time_str(timestamp):
     remaining = int(timestamp - time())
     if remaining < 0: remaining = 0
@@ -844,7 +841,7 @@ def mafia_chat_command(message, *args, **kwargs):
     player = None
     
     for g in all_games:
-        p = next((p for p in g.get('players', []) if p.get('id') == user_id), None)
+        p = player_by_id(g, user_id)
         if p and p.get('role') in ('mafia', 'don'):
             # Проверяем, что это первая ночь (мафия еще не познакомилась или night_count == 0)
             if not g.get('mafia_met') or g.get('night_count', 0) == 0:
@@ -868,11 +865,11 @@ def mafia_chat_command(message, *args, **kwargs):
         return
     
     # Получаем список мафии
-    mafiosi = [p for p in game['players'] if p.get('role') in ('mafia', 'don')]
+    mafiosi = [game['players'][i] for i in role_seats(game, 'mafia', 'don', alive=False)]
     
     # Отправляем сообщение всем мафии
     player_name = player.get('name', 'Игрок')
-    player_pos = player.get('position', game['players'].index(player) + 1)
+    player_pos = player.get('position', seat_of(game, player['id']) + 1)
     
     # Проверяем, есть ли другие мафиози кроме отправителя
     other_mafiosi = [m for m in mafiosi if m['id'] != user_id]
@@ -923,7 +920,7 @@ def show_events_shop(message, *args, **kwargs):
         # Ищем игру по игроку
         all_games = database.find('games', {'game': 'mafia'})
         for g in all_games:
-            if any(p.get('id') == user_id for p in g.get('players', [])):
+            if seat_of(g, user_id) is not None:
                 game = g
                 break
     
@@ -937,7 +934,7 @@ def show_events_shop(message, *args, **kwargs):
         return
     
     # Проверяем, что игрок в игре
-    player = next((p for p in game.get('players', []) if p.get('id') == user_id), None)
+    player = player_by_id(game, user_id)
     if not player:
         bot.send_message(message.chat.id, '❌ Ты не участвуешь в текущей игре.')
         return
@@ -1835,6 +1832,9 @@ def request_interact(call):
 
 @bot.group_message_handler(regexp=command_regexp('create'))
 def create(message, *args, **kwargs):
+    if bot.draining:
+        bot.send_message(message.chat.id, lang.bot_restarting)
+        return
     if database.find_one('requests', {'chat': message.chat.id}) or database.find_one('games', {'chat': message.chat.id, 'game': 'mafia'}):
         bot.send_message(message.chat.id, 'Игра/заявка уже есть!')
         return
@@ -1853,13 +1853,17 @@ def create(message, *args, **kwargs):
     )
     sent = bot.send_message(message.chat.id, answer, reply_markup=kb, parse_mode='HTML')
 
-    database.insert_one('requests', {
+    request_id = database.insert_one('requests', {
         'id': str(uuid4())[:8], 'owner': player_object, 'players': [player_object],
         'time': request_time, 'chat': message.chat.id, 'message_id': sent.message_id, 'players_count': 1
     })
+    scheduler.track_timer(('request', request_id), request_time)
 
 @bot.callback_query_handler(func=lambda call: call.data == 'start game')
 def start_game_button(call):
+    if bot.draining:
+        safe_answer_callback(call.id, lang.bot_restarting, show_alert=True)
+        return
     req = database.find_one('requests', {'chat': call.message.chat.id})
     if req and req['owner']['id'] == call.from_user.id:
         try: bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
@@ -1876,10 +1880,12 @@ def start_game_logic(message):
     req = database.find_one('requests', {'chat': message.chat.id})
     if req and req['players_count'] >= config.PLAYERS_COUNT_TO_START:
         database.delete_one('requests', {'_id': req['_id']})
+        scheduler.untrack_timer(('request', req['_id']))
         
         msg_id, game = start_game(message.chat.id, req['players'], mode='full')
         
-        # Рассылка ролей с описанием
+        # Рассылка ролей с описанием (параллельно)
+        role_cards = []
         for p in game['players']:
             # Получаем описание роли из lang
             role_desc = getattr(lang, f"{p['role']}_role", "Описание отсутствует")
@@ -1893,13 +1899,15 @@ def start_game_logic(message):
                 role_display = role_titles[p['role']]
             
             text = lang.role_card.format(role=role_display, goal=role_goal, description=role_desc)
-            send_player_message(p, game, text)
+            role_cards.append((p, text, None))
+        # id карточек не сохраняем: ночные сообщения не должны затирать карточку роли
+        send_player_messages(game, role_cards, save_pm_ids=False)
             
         bot.send_message(message.chat.id, lang.game_started.format(order="\n".join([p['name'] for p in game['players']])), parse_mode='HTML')
         
         game_w_id = database.find_one('games', {'chat': message.chat.id})
         # Переходим к первой ночи (стадия -3)
-        go_to_next_stage(game_w_id, inc=1)
+        queue_stage_check(game_w_id, go_to_next_stage, inc=1)
     else:
         bot.send_message(message.chat.id, f'Нужно минимум {config.PLAYERS_COUNT_TO_START} игрока!')
 
@@ -1909,6 +1917,7 @@ def cancel(message, *args, **kwargs):
     if req:
         if req['owner']['id'] == message.from_user.id or message.from_user.id == config.ADMIN_ID:
             database.delete_one('requests', {'_id': req['_id']})
+            scheduler.untrack_timer(('request', req['_id']))
             bot.send_message(message.chat.id, 'Заявка отменена.')
     else:
         bot.send_message(message.chat.id, 'Нет заявки.')
@@ -2517,9 +2526,9 @@ def settings_callback_handler(call):
 def candidate_callback_action(call, game):
     """Обработка выбора кандидата через callback (из ЛС)"""
     user_id = call.from_user.id
-    player = next((p for p in game['players'] if p['id'] == user_id and p['alive']), None)
+    player = player_by_id(game, user_id)
     
-    if not player:
+    if not player or not player['alive']:
         safe_answer_callback(call.id, "Ты не участвуешь в игре", show_alert=True)
         return
     
@@ -2538,7 +2547,7 @@ def candidate_callback_action(call, game):
         return
     
     target = game['players'][target_idx]
-    player_idx = game['players'].index(player)
+    player_idx = seat_of(game, user_id)
     
     # Проверяем, что цель жива
     if not target.get('alive'):
@@ -3281,7 +3290,7 @@ def buy_event_handler(call):
     else:
         all_games = database.find('games', {'game': 'mafia'})
         for g in all_games:
-            if any(p.get('id') == user_id for p in g.get('players', [])):
+            if seat_of(g, user_id) is not None:
                 game = g
                 break
     
@@ -3290,7 +3299,7 @@ def buy_event_handler(call):
         return
     
     # Проверяем, что игрок в игре
-    player = next((p for p in game.get('players', []) if p.get('id') == user_id), None)
+    player = player_by_id(game, user_id)
     if not player:
         safe_answer_callback(call.id, "Ты не участвуешь в игре", show_alert=True)
         return
@@ -3356,7 +3365,7 @@ def callback_router(call):
         try:
             all_games = database.find('games', {})
             for g in all_games:
-                if any(p.get('id') == user_id for p in g.get('players', [])):
+                if seat_of(g, user_id) is not None:
                     game = g
                     break
         except:
@@ -3366,6 +3375,20 @@ def callback_router(call):
         safe_answer_callback(call.id, "Игра не найдена", show_alert=True)
         return
 
+    if game_actors.enabled:
+        # Ход обрабатывает актор игры: перечитываем состояние уже в его очереди
+        game_actors.tell(game['_id'], dispatch_game_callback, call, game['_id'])
+        return
+
+    dispatch_game_callback(call, game['_id'], game)
+
+def dispatch_game_callback(call, game_id, game=None):
+    if game is None:
+        game = database.find_one('games', {'_id': game_id})
+        if not game:
+            safe_answer_callback(call.id, "Игра не найдена", show_alert=True)
+            return
+
     action = call.data.split()[0]
     
     if action == 'candidate':
@@ -3387,7 +3410,7 @@ def callback_router(call):
 
 def role_action(call, game, role_key):
     user_id = call.from_user.id
-    player = next((p for p in game['players'] if p['id'] == user_id), None)
+    player = player_by_id(game, user_id)
     
     if not player or player['role'] != role_key: return
     
@@ -3447,8 +3470,8 @@ def role_action(call, game, role_key):
         update['$push'] = {'heals': target_idx}
         resp = "Вылечен!"
         # Проверяем самолечение
-        if target_idx == game['players'].index(player):
-            player_idx = game['players'].index(player)
+        player_idx = seat_of(game, user_id)
+        if target_idx == player_idx:
             if game['players'][player_idx].get('self_heal_used', False):
                 safe_answer_callback(call.id, "Ты уже использовал самолечение!", show_alert=True)
                 return
@@ -3473,12 +3496,12 @@ def role_action(call, game, role_key):
         resp = "Выстрел принят"
     elif role_key == 'lawyer':
         # Адвокат выбирает подзащитного один раз
-        player_idx = next(i for i, p in enumerate(game['players']) if p['id'] == user_id)
+        player_idx = seat_of(game, user_id)
         update['$set'] = {f'players.{player_idx}.lawyer_client': target_idx}
         resp = "Подзащитный выбран"
     elif role_key == 'bum':
         # Бомж следит за игроком
-        source_idx = next(i for i, p in enumerate(game['players']) if p['id'] == user_id)
+        source_idx = seat_of(game, user_id)
         update['$set'] = {'bum_witness': {'source': source_idx, 'target': target_idx}}
         resp = "Слежка начата"
     elif role_key == 'don':
@@ -3533,7 +3556,7 @@ def role_action(call, game, role_key):
     
     # Отправляем сообщение в группу о завершении действия (только для некоторых ролей)
     if role_key in ['doctor', 'maniac', 'mistress', 'lawyer', 'bum']:
-        player_pos = player.get('position', game['players'].index(player) + 1)
+        player_pos = player.get('position', seat_of(game, user_id) + 1)
         role_titles_dict = {
             'doctor': 'Доктор',
             'maniac': 'Маньяк',
@@ -3542,26 +3565,21 @@ def role_action(call, game, role_key):
             'bum': 'Бомж'
         }
         role_display = role_titles_dict.get(role_key, 'Игрок')
-        try:
-            bot.send_message(
-                game['chat'],
-                f'✅ {role_display} №{player_pos} {player["name"]} выполнил действие.',
-                parse_mode='HTML'
-            )
-        except:
-            pass
+        # Ответ не нужен — отправляем через очередь, чтобы не ждать лимита группы
+        bot.post_message(
+            game['chat'],
+            f'✅ {role_display} №{player_pos} {player["name"]} выполнил действие.',
+            parse_mode='HTML'
+        )
     
     # Проверяем, все ли действия выполнены - если да, переходим к следующей стадии
     # Только для ночных ролей (doctor, maniac, mistress, lawyer, bum)
     if role_key in ['doctor', 'maniac', 'mistress', 'lawyer', 'bum']:
-        from stages import check_night_stage_complete
-        updated_game = database.find_one('games', {'_id': game['_id']})
-        if updated_game:
-            check_night_stage_complete(updated_game)
+        queue_stage_check(game, check_night_stage_complete)
 
 def mafia_shot(call, game):
     user_id = call.from_user.id
-    if not any(p['id'] == user_id and p['role'] in ['mafia', 'don'] for p in game['players']): 
+    if seat_of(game, user_id) not in role_seats(game, 'mafia', 'don', alive=False):
         safe_answer_callback(call.id, "Ты не мафия!", show_alert=True)
         return
     
@@ -3572,7 +3590,7 @@ def mafia_shot(call, game):
     if user_id in game.get('played', []):
         safe_answer_callback(call.id, "Ты уже сделал ход.", show_alert=True)
         # Удаляем кнопки
-        player = next((p for p in game['players'] if p['id'] == user_id), None)
+        player = player_by_id(game, user_id)
         if player:
             try: bot.edit_message_reply_markup(player['id'], player.get('pm_id'), reply_markup=None)
             except: pass
@@ -3597,7 +3615,7 @@ def mafia_shot(call, game):
     
     if not result:
         safe_answer_callback(call.id, "Ты уже сделал ход.", show_alert=True)
-        player = next((p for p in game['players'] if p['id'] == user_id), None)
+        player = player_by_id(game, user_id)
         if player:
             try: bot.edit_message_reply_markup(player['id'], player.get('pm_id'), reply_markup=None)
             except: pass
@@ -3606,7 +3624,7 @@ def mafia_shot(call, game):
     safe_answer_callback(call.id, "Выстрел принят")
     
     # Удаляем сообщение с кнопками сразу после действия
-    player = next((p for p in game['players'] if p['id'] == user_id), None)
+    player = player_by_id(game, user_id)
     if player:
         pm_id = player.get('pm_id')
         if pm_id:
@@ -3619,10 +3637,7 @@ def mafia_shot(call, game):
                     pass
     
     # Проверяем, все ли мафия выстрелили - если да, переходим к следующей стадии
-    from stages import check_night_stage_complete
-    updated_game = database.find_one('games', {'_id': game['_id']})
-    if updated_game:
-        check_night_stage_complete(updated_game)
+    queue_stage_check(game, check_night_stage_complete)
 
 def vote_action(call, game):
     user_id = call.from_user.id
@@ -3639,11 +3654,13 @@ def vote_action(call, game):
         safe_answer_callback(call.id, "Ошибка обработки", show_alert=True)
         return
     
-    voter_idx = next(i for i, p in enumerate(game['players']) if p['id'] == user_id)
+    voter_idx = seat_of(game, user_id)
     
-    database.update_one('games', {'_id': game['_id']}, {
-        '$set': {f'vote.{voter_idx}': target_idx, f'vote_map_ids.{user_id}': target_idx}
-    })
+    updated_game = record_vote(game, voter_idx, user_id, target_idx)
+    if not updated_game:
+        # Игра закончилась или голос так и не удалось записать
+        safe_answer_callback(call.id, "Голос не засчитан, попробуй ещё раз", show_alert=True)
+        return
     
     try:
         kb = InlineKeyboardMarkup(row_width=5)
@@ -3652,7 +3669,6 @@ def vote_action(call, game):
         kb.add(InlineKeyboardButton('🤐', callback_data='vote 0'))
         
         # Конкурс печенек - скрытое голосование
-        updated_game = database.find_one('games', {'_id': game['_id']})
         vote_text = lang.vote_start.format(vote_list="🍪 Голосование скрыто (Конкурс печенек)") if updated_game.get('current_event') == 'cookies' else lang.vote_start.format(vote_list=get_votes(updated_game))
         
         bot.edit_message_text(
@@ -3671,7 +3687,7 @@ def vote_discussion_action(call, game):
     user_id = call.from_user.id
     
     # Проверяем, что игрок жив
-    player = next((p for p in game['players'] if p['id'] == user_id), None)
+    player = player_by_id(game, user_id)
     if not player or not player.get('alive', True):
         safe_answer_callback(call.id, "Ты не можешь голосовать", show_alert=True)
         return
@@ -3692,22 +3708,21 @@ def vote_discussion_action(call, game):
         return
     
     # Нельзя голосовать за себя
-    if target_idx == game['players'].index(player):
+    voter_idx = seat_of(game, user_id)
+    if target_idx == voter_idx:
         safe_answer_callback(call.id, "Нельзя голосовать за себя", show_alert=True)
         return
     
     # Обновляем голос
-    voter_idx = game['players'].index(player)
-    database.find_one_and_update('games', {'_id': game['_id']}, {
-        '$set': {f'vote.{voter_idx}': target_idx, f'vote_map_ids.{user_id}': target_idx}
-    })
+    updated_game = record_vote(game, voter_idx, user_id, target_idx)
+    if not updated_game:
+        safe_answer_callback(call.id, "Голос не засчитан, попробуй ещё раз", show_alert=True)
+        return
     
     # Обновляем сообщение обсуждения с новыми голосами
     try:
         from stages import update_timer
-        updated_game = database.find_one('games', {'_id': game['_id']})
-        if updated_game:
-            update_timer(updated_game)
+        update_timer(updated_game)
     except: 
         pass
     
@@ -3716,8 +3731,8 @@ def vote_discussion_action(call, game):
 def don_check_action(call, game):
     """Дон проверяет, является ли игрок комиссаром"""
     user_id = call.from_user.id
-    don = next((p for p in game['players'] if p['id'] == user_id and p['role'] == 'don'), None)
-    if not don: return
+    don = player_by_id(game, user_id)
+    if not don or don['role'] != 'don': return
     
     # Быстрая проверка перед атомарной операцией
     if user_id in game.get('blocks', []):
@@ -3759,18 +3774,15 @@ def don_check_action(call, game):
         except: pass
         
         # Проверяем, все ли действия выполнены - если да, переходим к следующей стадии
-        from stages import check_night_stage_complete
-        updated_game = database.find_one('games', {'_id': game['_id']})
-        if updated_game:
-            check_night_stage_complete(updated_game)
+        queue_stage_check(game, check_night_stage_complete)
     except:
         pass
 
 def commissar_check_action(call, game):
     """Комиссар проверяет роль игрока"""
     user_id = call.from_user.id
-    commissar = next((p for p in game['players'] if p['id'] == user_id and p['role'] == 'commissar'), None)
-    if not commissar: return
+    commissar = player_by_id(game, user_id)
+    if not commissar or commissar['role'] != 'commissar': return
     
     # Быстрая проверка перед атомарной операцией
     if user_id in game.get('blocks', []):
@@ -3815,7 +3827,7 @@ def commissar_check_action(call, game):
         bot.send_message(commissar['id'], msg, parse_mode='HTML')
         
         # Сержант узнаёт о проверке
-        sergeant = next((p for p in game['players'] if p['role'] == 'sergeant' and p['alive']), None)
+        sergeant = player_with_role(game, 'sergeant')
         if sergeant:
             target_pos = target.get('position', target_idx + 1)
             bot.send_message(sergeant['id'], lang.sergeant_info.format(target_num=target_pos), parse_mode='HTML')
@@ -3845,18 +3857,15 @@ def commissar_check_action(call, game):
             pass
         
         # Проверяем, все ли действия выполнены - если да, переходим к следующей стадии
-        from stages import check_night_stage_complete
-        updated_game = database.find_one('games', {'_id': game['_id']})
-        if updated_game:
-            check_night_stage_complete(updated_game)
+        queue_stage_check(game, check_night_stage_complete)
     except:
         pass
 
 def commissar_kill_action(call, game):
     """Комиссар убивает игрока"""
     user_id = call.from_user.id
-    commissar = next((p for p in game['players'] if p['id'] == user_id and p['role'] == 'commissar'), None)
-    if not commissar: return
+    commissar = player_by_id(game, user_id)
+    if not commissar or commissar['role'] != 'commissar': return
     
     # Быстрая проверка перед атомарной операцией
     if user_id in game.get('blocks', []):
@@ -3919,10 +3928,7 @@ def commissar_kill_action(call, game):
             pass
         
         # Проверяем, все ли действия выполнены - если да, переходим к следующей стадии
-        from stages import check_night_stage_complete
-        updated_game = database.find_one('games', {'_id': game['_id']})
-        if updated_game:
-            check_night_stage_complete(updated_game)
+        queue_stage_check(game, check_night_stage_complete)
     except:
         pass
 
@@ -3933,6 +3939,23 @@ def reset(message, *args, **kwargs):
     database.delete_many('games', {})
     bot.send_message(message.chat.id, 'База игр очищена!')
 
+@bot.message_handler(commands=['profile'], func=lambda message: message.from_user.id == config.ADMIN_ID)
+def profile(message, *args, **kwargs):
+    """Сэмплирующий профайлер на N секунд: /profile [секунды]"""
+    from profiler import profiler
+    parts = message.text.split()
+    seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else config.PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, config.PROFILE_MAX_SECONDS))
+    chat_id = message.chat.id
+    
+    def send_report(report):
+        bot.send_message(chat_id, f'<pre>{html.escape(report.summary()[:3900])}</pre>', parse_mode='HTML')
+    
+    if not profiler.start(seconds, send_report):
+        bot.send_message(chat_id, 'Профилирование уже идёт.')
+        return
+    bot.send_message(chat_id, f'Профилирую все потоки {seconds} с...')
+
 @bot.group_message_handler(content_types=['text'])
 def game_suggestion(message, game, *args, **kwargs):
     if not game or not message.text: return
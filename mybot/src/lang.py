@@ -206,3 +206,12 @@ commissar_kill_result = 'Комиссар убил игрока №{target_num}.
 sergeant_info = '👮 Сержант узнал: Комиссар проверил игрока №{target_num}.'
 lawyer_protection = '⚖️ Адвокат защитил подзащитного. Комиссар видит "мирный житель".'
 bum_witness = '🧊 Бродяга видел: игрок №{source_num} ходил к игроку №{target_num}.'
+
+# --- ВОССТАНОВЛЕНИЕ ПОСЛЕ ПЕРЕЗАПУСКА ---
+recovery_resumed = (
+    '⏯ <b>Бот снова на связи!</b>\n'
+    'Игра стояла {downtime} — продолжаем с текущего этапа.\n'
+    'На ход есть ещё {grace} сек.'
+)
+recovery_abandoned = '⏹ Игра прервана: бот был недоступен слишком долго ({downtime}).'
+bot_restarting = '🔄 Бот перезапускается. Создать игру можно будет через минуту.'
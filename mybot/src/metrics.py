@@ -1,50 +1,351 @@
 # metrics.py
+"""
+Реестр метрик бота: счётчики, gauge и гистограммы с метками.
+
+Счётчики и гистограммы шардированы по потокам: каждый поток пишет в свою
+ячейку без блокировки, блокировка нужна только при первой записи потока
+и при чтении (snapshot). Значения не логируются на каждое событие -
+раз в METRICS_LOG_INTERVAL пишется одна сводная строка (start_log_thread).
+render_prometheus() отдаёт реестр в текстовом формате Prometheus,
+start_http_server() поднимает для него /metrics в процессе бота.
+"""
 import logging
-from datetime import datetime
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import get_ident
+from time import sleep
 
 logger = logging.getLogger(__name__)
 
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class _ShardedChild:
+    """Значение одного набора меток: по ячейке [..] на поток"""
+
+    __slots__ = ('_lock', '_cells', '_size')
+
+    def __init__(self, size=1):
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._size = size
+
+    def _cell(self):
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            with self._lock:
+                cell = self._cells.setdefault(get_ident(), [0] * self._size)
+        return cell
+
+    def _merged(self):
+        with self._lock:
+            cells = list(self._cells.values())
+        return [sum(column) for column in zip(*cells)] if cells else [0] * self._size
+
+    def reset(self):
+        with self._lock:
+            self._cells = {}
+
+
+class _CounterChild(_ShardedChild):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        self._cell()[0] += amount
+
+    @property
+    def value(self):
+        return self._merged()[0]
+
+
+class _HistogramChild(_ShardedChild):
+    """Ячейка потока: счётчики корзин (последняя - +Inf) и сумма наблюдений"""
+
+    __slots__ = ('buckets',)
+
+    def __init__(self, buckets):
+        super().__init__(len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    @property
+    def value(self):
+        merged = self._merged()
+        counts, total = merged[:-1], merged[-1]
+        cumulative, running = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': total, 'count': running}
+
+
+class _GaugeChild:
+    """Gauge меняется редко и может уменьшаться, поэтому просто под блокировкой"""
+
+    __slots__ = ('_lock', '_value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+    def reset(self):
+        self._value = 0
+
+
+class _Family:
+    """Метрика с набором меток: значения для каждого сочетания меток"""
+
+    type = None
+
+    def __init__(self, name, help='', labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values, **kwargs):
+        if kwargs or not values:
+            values = tuple(kwargs.get(name, '') for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        return {key: child.value for key, child in children}
+
+    def reset(self):
+        with self._lock:
+            children = list(self._children.values())
+        for child in children:
+            child.reset()
+
+
+class Counter(_Family):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Family):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Family):
+    type = 'histogram'
+
+    def __init__(self, name, help='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
 class GameMetrics:
     _instance = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(GameMetrics, cls).__new__(cls)
-            cls._instance.metrics = {
-                'games_started': 0,
-                'games_completed': 0,
-                'events_triggered': {},
-                'role_actions': {},
-                'errors': 0
-            }
+            cls._instance.families = {}
+            cls._instance._lock = threading.Lock()
+            cls._instance._last_logged = {}
+            cls._instance._collectors = []
         return cls._instance
     
+    def _family(self, cls, name, help, labelnames, **kwargs):
+        family = self.families.get(name)
+        if family is None:
+            with self._lock:
+                family = self.families.get(name)
+                if family is None:
+                    family = self.families[name] = cls(name, help, labelnames, **kwargs)
+        return family
+
+    def counter(self, name, help='', labelnames=()):
+        return self._family(Counter, name, help, labelnames)
+
+    def gauge(self, name, help='', labelnames=()):
+        return self._family(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._family(Histogram, name, help, labelnames, buckets=buckets)
+
     def increment(self, metric, tags=None):
-        try:
-            if metric not in self._instance.metrics:
-                if isinstance(self._instance.metrics.get(metric), dict):
-                    tag_key = tuple(sorted(tags.items())) if tags else 'default'
-                    self._instance.metrics[metric][tag_key] = self._instance.metrics[metric].get(tag_key, 0) + 1
-                else:
-                    self._instance.metrics[metric] = 0
-            self._instance.metrics[metric] += 1
-            
-            logger.info(f"METRIC: {metric} increased to {self._instance.metrics[metric]}")
-            
-            if metric == 'games_started':
-                self._log_game_start(tags)
-            elif metric == 'errors':
-                logger.error(f"Error occurred: {tags}")
-                
-        except Exception as e:
-            logger.error(f"Error in metrics: {str(e)}")
-
-    def _log_game_start(self, tags):
-        game_info = {
-            'mode': tags.get('mode', 'unknown'),
-            'player_count': tags.get('player_count', 0),
-            'timestamp': datetime.utcnow().isoformat()
+        """Увеличить счётчик metric; tags - метки (набор ключей задаёт первый вызов)"""
+        tags = tags or {}
+        self.counter(metric, labelnames=sorted(tags)).labels(**tags).inc()
+        if metric == 'errors':
+            logger.error(f"Error occurred: {tags}")
+
+    def register_collector(self, func):
+        """func() вызывается перед каждым снимком - обновить gauge (глубины очередей и т.п.)"""
+        self._collectors.append(func)
+        return func
+
+    def snapshot(self):
+        """Текущие значения: {имя: {'type', 'help', 'labelnames', 'samples': {метки: значение}}}"""
+        for collect in list(self._collectors):
+            try:
+                collect()
+            except Exception as e:
+                logger.error(f"Error in metrics collector: {str(e)}")
+        with self._lock:
+            families = list(self.families.values())
+        return {
+            f.name: {'type': f.type, 'help': f.help, 'labelnames': f.labelnames, 'samples': f.samples()}
+            for f in families
         }
-        logger.info(f"GAME_START: {game_info}")
+
+    def reset(self):
+        """Обнулить все значения (семейства и метки остаются)"""
+        with self._lock:
+            families = list(self.families.values())
+            self._last_logged = {}
+        for family in families:
+            family.reset()
+
+    def summary_line(self):
+        """Сводка для лога: приращения счётчиков и гистограмм с прошлой сводки, текущие gauge"""
+        parts = []
+        logged = {}
+        for name, family in sorted(self.snapshot().items()):
+            if family['type'] == 'gauge':
+                total = sum(family['samples'].values())
+                if total:
+                    parts.append(f'{name}={total:g}')
+                continue
+            if family['type'] == 'counter':
+                count = sum(family['samples'].values())
+                total = count
+            else:
+                count = sum(s['count'] for s in family['samples'].values())
+                total = sum(s['sum'] for s in family['samples'].values())
+            prev_count, prev_total = self._last_logged.get(name, (0, 0))
+            logged[name] = (count, total)
+            delta = count - prev_count
+            if not delta:
+                continue
+            if family['type'] == 'counter':
+                parts.append(f'{name}+{delta:g}')
+            else:
+                parts.append(f'{name}+{delta} avg={(total - prev_total) / delta * 1000:.1f}ms')
+        self._last_logged = logged
+        return ', '.join(parts)
+
+    def render_prometheus(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for name, family in sorted(self.snapshot().items()):
+            if family['help']:
+                help_text = family['help'].replace('\\', '\\\\').replace('\n', '\\n')
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {family["type"]}')
+            for labels, value in sorted(family['samples'].items()):
+                pairs = list(zip(family['labelnames'], labels))
+                if family['type'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_value(value)}')
+                    continue
+                for bound, count in value['buckets']:
+                    lines.append(f'{name}_bucket{_format_labels(pairs + [("le", _format_value(bound))])} {count}')
+                lines.append(f'{name}_sum{_format_labels(pairs)} {_format_value(value["sum"])}')
+                lines.append(f'{name}_count{_format_labels(pairs)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """Отдавать /metrics для Prometheus из фонового потока"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name='Metrics HTTP', daemon=True)
+        thread.start()
+        logger.info(f'Metrics endpoint: http://{host}:{port}/metrics')
+        return server
+
+    def start_log_thread(self, interval):
+        """Раз в interval секунд писать одну сводную строку метрик"""
+        def loop():
+            while True:
+                sleep(interval)
+                try:
+                    line = self.summary_line()
+                    if line:
+                        logger.info(f'METRICS: {line}')
+                except Exception as e:
+                    logger.error(f"Error in metrics: {str(e)}")
+        thread = threading.Thread(target=loop, name='Metrics Log', daemon=True)
+        thread.start()
+        return thread
 
 metrics = GameMetrics()
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Расчёт итогов ночи и проверка победы.
+
+Здесь нет ни Telegram, ни базы: функции получают документ игры и возвращают
+результат, поэтому их можно вызывать из тестов, симулятора или актора игры.
+Отправкой сообщений и записью занимается stages.morning_results.
+"""
+import random
+from collections import Counter
+
+from seats import role_seats, promote, kill, alive_counts, build_alive_counts, faction_of
+
+
+def winner_from_counts(counts):
+    """Текст победы по счётчикам живых {'mafia', 'maniac', 'civil'}, иначе None"""
+    mafia, maniac = counts['mafia'], counts['maniac']
+    alive = mafia + maniac + counts['civil']
+
+    if not mafia and not maniac:
+        return 'Мирные победили!'
+    if mafia >= alive - mafia:
+        return 'Мафия победила!'
+    if maniac and maniac >= alive - 1:
+        return 'Маньяк победил!'
+    return None
+
+
+def check_winner(game):
+    """Текст победы, если игра закончилась, иначе None (по счётчикам игры, без перебора игроков)"""
+    return winner_from_counts(alive_counts(game))
+
+
+def winner_reason(players):
+    """Текст победы для произвольного списка игроков"""
+    return winner_from_counts(build_alive_counts(players))
+
+
+def night_rng(game):
+    """
+    Генератор случайностей ночи из зерна игры и номера ночи: итоги ночи
+    воспроизводятся по документу игры. У игр без зерна - общий random.
+    """
+    seed = game.get('rng_seed')
+    if seed is None:
+        return random
+    return random.Random(seed + game.get('night_count', 0))
+
+
+def resolve_night(game, rng=random):
+    """
+    Итоги ночи. game не меняется, результат - словарь:
+        deaths         - индексы погибших (по порядку)
+        lucky_saved    - индексы счастливчиков, переживших выстрел мафии
+        commissar_kill - индекс убитого комиссаром (или None)
+        promotions     - [(индекс, новая роль)]: сержант -> комиссар, мафия -> дон
+        best_move      - индексы погибших, которым положен «лучший ход»
+        bum_witness    - {'bum', 'source', 'target'} для бомжа (или None)
+        winner         - текст победы (или None)
+    """
+    players = game['players']
+    heals = {int(x) for x in game.get('heals', [])}
+    dead = []
+    lucky_saved = []
+    commissar_kill = None
+
+    # Выстрелы мафии
+    if game.get('shots'):
+        target_idx = int(Counter(game['shots']).most_common(1)[0][0])
+        is_healed = target_idx in heals
+        is_lucky = players[target_idx]['role'] == 'lucky' and rng.random() < 0.5
+        if not is_healed and not is_lucky:
+            dead.append(target_idx)
+        elif is_lucky:
+            lucky_saved.append(target_idx)
+
+    # Выстрел маньяка
+    if game.get('maniac_shot') is not None:
+        maniac_target = int(game['maniac_shot'])
+        is_healed = maniac_target in heals
+        is_lucky = players[maniac_target]['role'] == 'lucky' and rng.random() < 0.5
+        if not is_healed and not is_lucky:
+            dead.append(maniac_target)
+
+    # Убийство комиссара
+    if game.get('commissar_action') == 'kill' and game.get('commissar_target') is not None:
+        kill_target = int(game['commissar_target'])
+        if kill_target not in heals:
+            dead.append(kill_target)
+            commissar_kill = kill_target
+
+    # Смерти и передача ролей считаем на копиях, чтобы не трогать game
+    roles = [p['role'] for p in players]
+    alive = [p['alive'] for p in players]
+    deaths = sorted(set(dead))
+    promotions = []
+    best_move = []
+    gives_best_move = game.get('night_count', 0) > 1 and game.get('day_count', 0) > 0 \
+        and len(game.get('candidates', [])) < 2
+
+    for idx in deaths:
+        alive[idx] = False
+        # Если убит комиссар, сержант становится комиссаром
+        if roles[idx] == 'commissar':
+            heir = next((i for i in role_seats(game, 'sergeant', alive=False)
+                         if alive[i] and roles[i] == 'sergeant'), None)
+            if heir is not None:
+                roles[heir] = 'commissar'
+                promotions.append((heir, 'commissar'))
+        # Если убит дон, мафия выбирает нового
+        if roles[idx] == 'don':
+            heir = next((i for i in role_seats(game, 'mafia', alive=False)
+                         if alive[i] and roles[i] == 'mafia'), None)
+            if heir is not None:
+                roles[heir] = 'don'
+                promotions.append((heir, 'don'))
+        if gives_best_move:
+            best_move.append(idx)
+
+    # Информация бомжу
+    bum_witness = None
+    witness = game.get('bum_witness')
+    if witness:
+        bum = next((i for i, r in enumerate(roles) if r == 'bum' and alive[i]), None)
+        if bum is not None:
+            bum_witness = {'bum': bum, 'source': witness['source'], 'target': witness['target']}
+
+    # Передача ролей не меняет сторону, поэтому достаточно вычесть погибших
+    counts = dict(alive_counts(game))
+    for idx in deaths:
+        if players[idx].get('alive', True):
+            counts[faction_of(players[idx]['role'])] -= 1
+    return {
+        'deaths': deaths,
+        'lucky_saved': lucky_saved,
+        'commissar_kill': commissar_kill,
+        'promotions': promotions,
+        'best_move': best_move,
+        'bum_witness': bum_witness,
+        'winner': winner_from_counts(counts),
+    }
+
+
+def apply_night(game, result):
+    """Применить итоги ночи к game['players'] (в памяти)"""
+    players = game['players']
+    for idx in result['deaths']:
+        kill(game, idx)
+        players[idx]['died_night'] = True
+    for idx, role in result['promotions']:
+        promote(game, idx, role)
+    return game
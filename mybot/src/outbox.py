@@ -0,0 +1,408 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+from logger import logger
+from metrics import metrics
+
+# Сколько запрос ждал в очереди (лимиты, 429, занятость чата)
+queue_wait = metrics.histogram('telegram_rate_limit_wait_seconds', 'Ожидание запроса в очереди Telegram', ('chat_type',))
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available_in(self, now):
+        """Через сколько секунд можно будет взять токен"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        """Telegram ответил 429 — ничего не отправлять ещё seconds секунд"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(self.tokens, 0)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class RateLimiter:
+    """
+    Ограничение исходящих запросов к Telegram: общий лимит бота
+    и отдельный лимит на каждый чат (группы строже личных сообщений).
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, global_rate, group_rate, group_burst, private_rate, private_burst):
+        self.global_rate = global_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now):
+        for chat_id in [c for c, b in self._chats.items() if b.idle(now)]:
+            del self._chats[chat_id]
+
+    def acquire(self, chat_id):
+        """
+        Взять токен из общей корзины и корзины чата, если в обеих он есть (вернуть 0).
+        Иначе ничего не занимать и вернуть, через сколько секунд попробовать снова.
+        """
+        now = monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            buckets = [self._global]
+            if chat_id is not None:
+                buckets.append(self._chat_bucket(chat_id))
+            wait = max(b.available_in(now) for b in buckets)
+            if wait > 0:
+                return wait
+            for b in buckets:
+                b.take()
+            return 0.0
+
+    def block(self, chat_id, seconds):
+        now = monotonic()
+        with self._lock:
+            if chat_id is None:
+                self._global.block(now, seconds)
+            else:
+                self._chat_bucket(chat_id).block(now, seconds)
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'enqueued', 'attempts')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued = monotonic()
+        self.attempts = 0
+
+
+class Outbox:
+    """
+    Центральная очередь исходящих запросов к Telegram.
+
+    У каждого чата своя очередь с приоритетами: запросы одного чата уходят
+    по одному и по порядку (внутри приоритета), разные чаты — параллельно.
+    Лимиты и повторы после 429 выполняют рабочие потоки очереди: если чату
+    пока нельзя писать, он откладывается, и поток берёт другой чат, так что
+    зажатый лимитом чат не задерживает остальные и никто не спит в потоке
+    вызывающего. submit() сразу возвращает Future с результатом вызова.
+    """
+
+    HIGH, NORMAL, LOW = 0, 1, 2
+    MAX_RETRIES = 3
+
+    def __init__(self, workers, limiter, retry_after=None):
+        self.workers = workers
+        self.limiter = limiter
+        # retry_after(e) -> секунды ожидания, если ошибка - 429, иначе None
+        self.retry_after = retry_after or (lambda e: None)
+        self._cond = threading.Condition()
+        self._queues = {}  # chat_id -> куча [(priority, seq, job)]
+        self._ready = []  # куча (not_before, seq, chat_id): чаты, которые ждут обслуживания
+        self._scheduled = set()  # чаты, стоящие в _ready
+        self._busy = set()  # чаты, чей запрос сейчас выполняется
+        self._seq = itertools.count()
+        self._threads = []
+        self._local = threading.local()
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._last_lag = 0.0
+
+    def submit(self, chat_id, func, *args, priority=NORMAL, **kwargs):
+        """Поставить вызов в очередь чата; вернуть Future"""
+        job = _Job(func, args, kwargs)
+        with self._cond:
+            if not self._threads:
+                self._start_workers()
+            heapq.heappush(self._queues.setdefault(chat_id, []), (priority, next(self._seq), job))
+            self._schedule(chat_id, monotonic())
+        return job.future
+
+    def post(self, chat_id, func, *args, **kwargs):
+        return self.submit(chat_id, func, *args, **kwargs)
+
+    def in_worker(self):
+        """Вызвано из рабочего потока очереди (ждать свою же очередь нельзя)"""
+        return getattr(self._local, 'worker', False)
+
+    def _start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'outbox_{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _schedule(self, chat_id, when):
+        # Вызывается под self._cond
+        if chat_id in self._busy or chat_id in self._scheduled or not self._queues.get(chat_id):
+            return
+        heapq.heappush(self._ready, (when, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+        self._cond.notify()
+
+    def _next(self):
+        # Вызывается под self._cond: ближайший чат, которому уже можно писать
+        while True:
+            if not self._ready:
+                self._cond.wait()
+                continue
+            not_before, _, chat_id = self._ready[0]
+            now = monotonic()
+            if not_before > now:
+                self._cond.wait(not_before - now)
+                continue
+            heapq.heappop(self._ready)
+            self._scheduled.discard(chat_id)
+            wait = self.limiter.acquire(chat_id)
+            if wait > 0:
+                self._schedule(chat_id, now + wait)
+                continue
+            entry = heapq.heappop(self._queues[chat_id])
+            self._busy.add(chat_id)
+            self._last_lag = now - entry[2].enqueued
+            return chat_id, entry
+
+    def _work(self):
+        self._local.worker = True
+        while True:
+            with self._cond:
+                chat_id, entry = self._next()
+            self._run(chat_id, entry)
+
+    def _run(self, chat_id, entry):
+        job = entry[2]
+        if not job.attempts and not job.future.set_running_or_notify_cancel():
+            # Future отменили, пока запрос ждал в очереди
+            self._finish(chat_id, None, None)
+            return
+        chat_type = 'group' if isinstance(chat_id, int) and chat_id < 0 else 'private'
+        queue_wait.labels(chat_type).observe(monotonic() - job.enqueued)
+        retry_at = None
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            retry_after = self.retry_after(e)
+            if retry_after is not None and job.attempts < self.MAX_RETRIES:
+                # 429: чат ждёт retry_after, запрос остаётся первым в его очереди
+                job.attempts += 1
+                logger.warning(f'429 for chat {chat_id}, retry after {retry_after}s')
+                self.limiter.block(chat_id, retry_after)
+                retry_at = monotonic() + retry_after
+            else:
+                job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        self._finish(chat_id, entry, retry_at)
+
+    def _finish(self, chat_id, entry, retry_at):
+        with self._cond:
+            if retry_at is not None:
+                heapq.heappush(self._queues[chat_id], entry)
+                self._retried += 1
+            elif entry is None:
+                pass
+            elif entry[2].future.exception() is None:
+                self._completed += 1
+            else:
+                self._failed += 1
+            self._busy.discard(chat_id)
+            if self._queues.get(chat_id):
+                self._schedule(chat_id, retry_at or monotonic())
+            else:
+                self._queues.pop(chat_id, None)
+                self._cond.notify_all()
+
+    def queue_depth(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def backlog(self):
+        """За сколько секунд общий лимит бота разгребёт то, что уже стоит в очереди"""
+        return self.queue_depth() / self.limiter.global_rate
+
+    def stats(self):
+        now = monotonic()
+        with self._cond:
+            oldest = [job.enqueued for q in self._queues.values() for _, _, job in q]
+            return {
+                'workers': self.workers,
+                'active_keys': len(self._busy),
+                'queue_depth': len(oldest),
+                'lag': (now - min(oldest)) if oldest else 0.0,
+                'last_start_lag': self._last_lag,
+                'completed': self._completed,
+                'failed': self._failed,
+                'retried': self._retried,
+            }
+
+    def join(self, timeout=None):
+        """Дождаться, пока все очереди опустеют. Возвращает False, если не успели за timeout"""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._queues or self._busy:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 1)
+            return True
+
+
+class EditCoalescer:
+    """
+    Склейка правок «живых» сообщений (таймеры, списки голосов).
+
+    Одинаковый текст повторно не отправляется, а правки одного сообщения
+    чаще интервала схлопываются: уходит только последняя версия. Интервал
+    растёт, когда очередь Telegram не успевает (backlog). edit_func ставит
+    правку в очередь и возвращает Future; текст считается показанным только
+    после успешной правки, так что после ошибки он уйдёт снова.
+    """
+
+    FORGET_AFTER = 3600
+    # Таймер обновляется примерно столько раз за оставшееся время
+    REFRESH_STEPS = 10
+
+    def __init__(self, edit_func, min_interval, max_interval=None, backlog=None):
+        self.edit_func = edit_func
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval or min_interval, min_interval)
+        self.backlog = backlog or (lambda: 0.0)
+        self._lock = threading.Lock()
+        self._messages = {}  # (chat_id, message_id) -> состояние сообщения
+        self.skipped = 0
+        self.coalesced = 0
+
+    def refresh_interval(self, remaining):
+        """
+        Через сколько секунд обновить таймер, до конца которого remaining секунд:
+        пока до конца далеко - реже, ближе к концу - чаще, но не быстрее,
+        чем очередь Telegram разбирает уже накопленные запросы.
+        """
+        interval = min(max(remaining / self.REFRESH_STEPS, self.min_interval), self.max_interval)
+        return max(interval, self.backlog())
+
+    def edit(self, chat_id, message_id, text, **kwargs):
+        key = (chat_id, message_id)
+        now = monotonic()
+        with self._lock:
+            state = self._messages.setdefault(key, {'text': None, 'sending': None, 'future': None,
+                                                    'sent_at': 0.0, 'pending': None, 'timer': None})
+            if state['pending'] is None and text in (state['text'], state['sending']):
+                self.skipped += 1
+                return
+            if state['pending'] is not None:
+                # Уже ждём отправки — просто подменяем текст на свежий
+                self.coalesced += 1
+                state['pending'] = (text, kwargs)
+                return
+            delay = state['sent_at'] + max(self.min_interval, self.backlog()) - now
+            state['pending'] = (text, kwargs)
+            if delay > 0:
+                state['timer'] = threading.Timer(delay, self._flush, args=(key,))
+                state['timer'].daemon = True
+                state['timer'].start()
+                return
+        self._flush(key)
+
+    def discard(self, chat_id, message_id):
+        """Забыть сообщение (оно удалено или больше не обновляется)"""
+        with self._lock:
+            state = self._messages.pop((chat_id, message_id), None)
+        if state and state['timer']:
+            state['timer'].cancel()
+        if state and state['future']:
+            # Правка ещё в очереди - после discard она уже не нужна
+            state['future'].cancel()
+
+    def flush(self):
+        """Отправить все отложенные правки сейчас (перед остановкой бота)"""
+        with self._lock:
+            keys = [k for k, s in self._messages.items() if s['pending'] is not None]
+            for k in keys:
+                if self._messages[k]['timer']:
+                    self._messages[k]['timer'].cancel()
+        for k in keys:
+            self._flush(k)
+
+    def _flush(self, key):
+        with self._lock:
+            state = self._messages.get(key)
+            if not state or state['pending'] is None:
+                return
+            text, kwargs = state['pending']
+            state['pending'] = None
+            state['timer'] = None
+            if text in (state['text'], state['sending']):
+                return
+            state['sending'] = text
+            state['sent_at'] = monotonic()
+            self._forget_old(state['sent_at'])
+        try:
+            future = self.edit_func(text=text, chat_id=key[0], message_id=key[1], **kwargs)
+        except Exception as e:
+            self._done(key, text, e)
+            return
+        with self._lock:
+            state['future'] = future
+        future.add_done_callback(lambda f: self._done(key, text, None if f.cancelled() else f.exception()))
+
+    def _done(self, key, text, error):
+        if error is not None and 'message is not modified' not in str(error):
+            logger.debug(f'Live edit failed for {key}: {error}')
+            text = None
+        with self._lock:
+            state = self._messages.get(key)
+            if state is None or state['sending'] is None:
+                return
+            if text is not None and state['sending'] == text:
+                state['text'] = text
+            state['sending'] = None
+            state['future'] = None
+
+    def _forget_old(self, now):
+        old = [k for k, s in self._messages.items()
+               if s['pending'] is None and s['sending'] is None and now - s['sent_at'] > self.FORGET_AFTER]
+        for k in old:
+            del self._messages[k]
@@ -0,0 +1,160 @@
+"""
+Сэмплирующий профайлер для работающего бота (команда /profile).
+
+Поток-сэмплер раз в PROFILE_SAMPLE_INTERVAL секунд снимает стеки всех
+потоков (sys._current_frames) и считает одинаковые стеки. Результат:
+- <имя>.collapsed - свёрнутые стеки ("поток;функция;... число") для
+  flamegraph.pl и speedscope;
+- <имя>.txt - топ функций по собственным и общим сэмплам и процессорное
+  время каждого потока за время профилирования (stage_cycle, daily_events,
+  обработчики и пулы).
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import config
+from logger import logger
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _thread_cpu(ident):
+    """Процессорное время потока, секунд (None, если ОС не умеет)"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def _thread_group(name):
+    """Потоки одного пула считаем вместе: pm_3 -> pm, Thread-12 -> Thread"""
+    return re.sub(r'[-_ ]?\d+$', '', name) or name
+
+
+class ProfileReport:
+    def __init__(self, stacks, duration, samples, cpu, path):
+        self.stacks = stacks
+        self.duration = duration
+        self.samples = samples
+        self.cpu = cpu
+        self.path = path
+
+    def top_functions(self, limit=15):
+        """[(функция, собственные сэмплы, сэмплы со вложенными)] по убыванию собственных"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+    def collapsed(self):
+        return '\n'.join(
+            f'{";".join(part.replace(";", ",") for part in stack)} {count}'
+            for stack, count in self.stacks.most_common()
+        ) + '\n'
+
+    def summary(self, limit=15):
+        lines = [f'Профиль за {self.duration:.1f} с, {self.samples} снимков', '']
+        lines.append('CPU по потокам:')
+        for name, seconds in sorted(self.cpu.items(), key=lambda item: -item[1]):
+            lines.append(f'  {name}: {seconds:.2f} с ({seconds / self.duration * 100:.0f}%)')
+        lines += ['', 'Топ функций (свои / всего сэмплов):']
+        for frame, own, total in self.top_functions(limit):
+            lines.append(f'  {own:>5} / {total:<5} {frame}')
+        if self.path:
+            lines += ['', f'Стеки: {self.path}.collapsed']
+        return '\n'.join(lines)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        with open(self.path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(self.summary(limit=50) + '\n')
+
+
+class SamplingProfiler:
+    def __init__(self, interval, directory):
+        self.interval = interval
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, seconds, on_done=None):
+        """Профилировать seconds секунд в фоне; False, если профилирование уже идёт"""
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        thread = threading.Thread(target=self._run, args=(seconds, on_done), name='Profiler', daemon=True)
+        thread.start()
+        return True
+
+    def _run(self, seconds, on_done):
+        try:
+            report = self.sample(seconds)
+            report.save()
+            logger.info(f'PROFILE: saved {report.path}.collapsed ({report.samples} samples)')
+            if on_done:
+                on_done(report)
+        except Exception as e:
+            logger.error(f'Profiler failed: {e}')
+        finally:
+            self._running = False
+
+    def sample(self, seconds):
+        """Снимать стеки seconds секунд в текущем потоке и вернуть отчёт"""
+        me = threading.get_ident()
+        names = {}
+        cpu_start = {}
+        stacks = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            threads = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.setdefault(ident, threads.get(ident, str(ident)))
+                if ident not in cpu_start and ident in threads:
+                    cpu_start[ident] = _thread_cpu(ident)
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                frames.append(_thread_group(name))
+                stacks[tuple(reversed(frames))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        duration = time.perf_counter() - started
+
+        # Часы процессорного времени есть только у живых потоков
+        alive = {t.ident for t in threading.enumerate()}
+        cpu = Counter()
+        for ident, before in cpu_start.items():
+            after = _thread_cpu(ident) if ident in alive else None
+            if before is not None and after is not None:
+                cpu[_thread_group(names[ident])] += after - before
+        path = os.path.join(self.directory, datetime.now().strftime('profile-%Y%m%d-%H%M%S'))
+        return ProfileReport(stacks, duration, samples, cpu, path)
+
+
+profiler = SamplingProfiler(config.PROFILE_SAMPLE_INTERVAL, config.PROFILE_DIR)
@@ -0,0 +1,173 @@
+"""
+Восстановление игр после перезапуска бота.
+
+Пока бот лежал, дедлайны стадий прошли. Если просто отдать такие игры
+stage_cycle, все они переключатся одновременно (пачка сообщений упрётся
+в лимиты Telegram), а ночные стадии засчитают игрокам пропуск хода.
+Поэтому при старте каждая просроченная игра получает место в очереди:
+    fast_forward - пропущена одна стадия: обычный переход в свой слот очереди
+    resume       - пропущено больше: текущая стадия начинается заново
+                   с запасом RECOVERY_GRACE секунд, в чат уходит объявление
+    abandon      - игра простояла дольше RECOVERY_ABANDON_AFTER: завершаем
+                   без подсчёта рейтинга и статистики (игроки не виноваты)
+Слоты идут раз в RECOVERY_SPACING секунд. Новые дедлайны пишутся в базу
+сразу, объявления рассылает отдельный поток в том же темпе.
+
+После плавной остановки (app.drain) в коллекции shutdown лежит отметка
+с остатком времени каждой игры: такие игры просто продолжаются с того же
+места, без плана восстановления.
+"""
+import threading
+from time import time, sleep
+
+import config
+import database
+import lang
+from bot import bot
+from game import abandon_game
+from logger import logger
+from settings import get_settings
+from stages import stages, STAGE_TRANSITIONS, MAX_STAGE_STEPS, next_stage_number
+
+NIGHT_STAGES = range(4, 12)
+
+
+def stage_duration(game, stage_number, settings):
+    """Длительность стадии в секундах (так же, как её считает go_to_next_stage)"""
+    if stage_number == 0:
+        return settings.get('discussion_time', 300) * game.get('day_duration_multiplier', 1)
+    if stage_number in NIGHT_STAGES:
+        return settings.get('night_time', 30)
+    stage = stages.get(stage_number)
+    duration = stage['time'] if stage else None
+    return duration if isinstance(duration, (int, float)) else 0
+
+
+def missed_stages(game, now, settings=None):
+    """
+    Сколько стадий игра пропустила к моменту now.
+    Считаем по таблице переходов; на стадиях, исход которых зависит
+    от самой игры (последнее слово, подтверждение голосования), оценка обрывается.
+    """
+    deadline = game.get('next_stage_time')
+    if deadline is None or deadline > now:
+        return 0
+    settings = settings or get_settings(game['chat'])
+    stage_number = game.get('stage', 0)
+    missed = 0
+    while deadline <= now and missed < MAX_STAGE_STEPS:
+        missed += 1
+        if callable(STAGE_TRANSITIONS.get(stage_number)):
+            break
+        stage_number = next_stage_number(game, stage_number)
+        deadline += max(stage_duration(game, stage_number, settings), 1)
+    return missed
+
+
+def plan_recovery(games, now, grace=None, spacing=None, abandon_after=None):
+    """План восстановления: [{'game', 'action', 'deadline', 'missed', 'overdue'}] в порядке очереди"""
+    grace = config.RECOVERY_GRACE if grace is None else grace
+    spacing = config.RECOVERY_SPACING if spacing is None else spacing
+    abandon_after = config.RECOVERY_ABANDON_AFTER if abandon_after is None else abandon_after
+
+    overdue_games = sorted(
+        (g for g in games if g.get('next_stage_time') is not None and g['next_stage_time'] <= now),
+        key=lambda g: g['next_stage_time']
+    )
+    plan = []
+    for slot, game in enumerate(overdue_games):
+        overdue = now - game['next_stage_time']
+        missed = missed_stages(game, now)
+        start = now + slot * spacing
+        if overdue > abandon_after:
+            action, deadline = 'abandon', None
+        elif missed <= 1:
+            action, deadline = 'fast_forward', start
+        else:
+            action, deadline = 'resume', start + grace
+        plan.append({'game': game, 'action': action, 'deadline': deadline, 'missed': missed, 'overdue': overdue})
+    return plan
+
+
+def format_downtime(seconds):
+    minutes = int(seconds // 60)
+    return f'{minutes} мин.' if minutes else f'{int(seconds)} сек.'
+
+
+def recover_games(now=None, games=None):
+    """
+    Перенести дедлайны просроченных игр по плану восстановления.
+    Вызывается при старте до scheduler.rebuild. Возвращает план.
+    """
+    now = time() if now is None else now
+    if games is None:
+        games = database.find('games', {'game': 'mafia'})
+    plan = plan_recovery(games, now)
+    if not plan:
+        return plan
+
+    for item in plan:
+        database.update_one('games', {'_id': item['game']['_id']}, {'$set': {'next_stage_time': item['deadline']}})
+
+    actions = {}
+    for item in plan:
+        actions[item['action']] = actions.get(item['action'], 0) + 1
+    logger.info(f'Recovery: {len(plan)} overdue games {actions}, '
+                f'max {max(item["missed"] for item in plan)} missed stages')
+
+    thread = threading.Thread(target=_announce, args=(plan, config.RECOVERY_SPACING), name='Recovery', daemon=True)
+    thread.start()
+    return plan
+
+
+def _announce(plan, spacing):
+    """Очередь восстановления: объявления и завершения игр по одному на слот"""
+    for item in plan:
+        game = item['game']
+        downtime = format_downtime(item['overdue'])
+        try:
+            if item['action'] == 'abandon':
+                abandon_game(game, lang.recovery_abandoned.format(downtime=downtime))
+            elif item['action'] == 'resume':
+                bot.post_message(game['chat'], lang.recovery_resumed.format(
+                    downtime=downtime, grace=config.RECOVERY_GRACE
+                ), parse_mode='HTML')
+        except Exception as e:
+            logger.error(f"Recovery of game {game.get('_id')} failed: {e}")
+        sleep(spacing)
+
+
+def write_shutdown_marker(games, shard_index=0, now=None):
+    """Отметка о чистой остановке: сколько времени оставалось у каждой игры"""
+    now = time() if now is None else now
+    remaining = {
+        g['_id']: max(g['next_stage_time'] - now, 0)
+        for g in games if g.get('next_stage_time') is not None
+    }
+    database.delete_many('shutdown', {'shard': shard_index})
+    database.insert_one('shutdown', {'shard': shard_index, 'time': now, 'remaining': remaining})
+    return remaining
+
+
+def resume_after_clean_shutdown(games, shard_index=0, now=None):
+    """
+    Если прошлый запуск остановился чисто - вернуть играм остаток времени стадии.
+    Возвращает множество id продолженных игр (остальным нужен recover_games).
+    """
+    marker = database.find_one('shutdown', {'shard': shard_index})
+    if not marker:
+        return set()
+    database.delete_many('shutdown', {'shard': shard_index})
+
+    now = time() if now is None else now
+    remaining = marker.get('remaining', {})
+    resumed = set()
+    for game in games:
+        if game['_id'] not in remaining:
+            continue
+        deadline = now + remaining[game['_id']]
+        database.update_one('games', {'_id': game['_id']}, {'$set': {'next_stage_time': deadline}})
+        game['next_stage_time'] = deadline
+        resumed.add(game['_id'])
+    logger.info(f'Clean shutdown {int(now - marker["time"])}s ago: {len(resumed)} games resumed')
+    return resumed
@@ -0,0 +1,132 @@
+import heapq
+import threading
+from time import time
+
+
+class StageScheduler:
+    """
+    Планировщик дедлайнов стадий: куча (next_stage_time, game_id).
+
+    Вместо опроса базы раз в секунду stage_cycle спит ровно до ближайшего
+    дедлайна. Каждый раз, когда стадии выставляется next_stage_time,
+    нужно вызвать schedule() — устаревшие записи в куче отбрасываются лениво.
+
+    Здесь же учитываются живые таймеры в сообщениях (обсуждение - стадия 0 -
+    и заявки): ключ ('game' | 'request', id) -> дедлайн. stage_cycle берёт их
+    отсюда, а не ищет такие игры и заявки в базе на каждом круге.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._timers = {}
+        self._cond = threading.Condition()
+
+    def schedule(self, game_id, when, live_timer=False):
+        """Поставить (или перенести) дедлайн игры; live_timer - в чате идёт таймер стадии"""
+        if game_id is None or when is None:
+            return
+        with self._cond:
+            self._deadlines[game_id] = when
+            if live_timer:
+                self._timers[('game', game_id)] = when
+            else:
+                self._timers.pop(('game', game_id), None)
+            heapq.heappush(self._heap, (when, game_id))
+            # Будим цикл, только если новый дедлайн раньше текущего ожидания
+            if self._heap[0] == (when, game_id):
+                self._cond.notify_all()
+
+    def cancel(self, game_id):
+        """Убрать игру из планировщика (игра завершена или удалена)"""
+        with self._cond:
+            self._deadlines.pop(game_id, None)
+            self._timers.pop(('game', game_id), None)
+
+    def track_timer(self, key, deadline):
+        """Учитывать живой таймер в сообщении до deadline"""
+        with self._cond:
+            self._timers[key] = deadline
+
+    def untrack_timer(self, key):
+        with self._cond:
+            self._timers.pop(key, None)
+
+    def live_timers(self, now=None):
+        """Живые таймеры [(ключ, дедлайн)]; истёкшие забываются"""
+        now = time() if now is None else now
+        with self._cond:
+            for key in [k for k, deadline in self._timers.items() if deadline <= now]:
+                del self._timers[key]
+            return list(self._timers.items())
+
+    def rebuild(self, games):
+        """Пересобрать кучу и таймеры обсуждений из хранилища (при старте)"""
+        with self._cond:
+            self._deadlines = {
+                g['_id']: g['next_stage_time'] for g in games
+                if g.get('_id') is not None and g.get('next_stage_time') is not None
+            }
+            self._timers = {key: when for key, when in self._timers.items() if key[0] != 'game'}
+            self._timers.update({
+                ('game', g['_id']): g['next_stage_time'] for g in games
+                if g['_id'] in self._deadlines and g.get('stage') == 0
+            })
+            self._heap = [(when, game_id) for game_id, when in self._deadlines.items()]
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+
+    def _drop_stale(self):
+        while self._heap:
+            when, game_id = self._heap[0]
+            if self._deadlines.get(game_id) == when:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Забрать id игр, у которых дедлайн наступил (в порядке дедлайнов)"""
+        now = time() if now is None else now
+        due = []
+        with self._cond:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                when, game_id = heapq.heappop(self._heap)
+                if self._deadlines.get(game_id) == when:
+                    del self._deadlines[game_id]
+                    due.append(game_id)
+                self._drop_stale()
+        return due
+
+    def wait(self, until=None):
+        """Спать до ближайшего дедлайна, но не дольше until (абсолютное время)"""
+        with self._cond:
+            self._drop_stale()
+            wake_at = self._heap[0][0] if self._heap else None
+            if until is not None and (wake_at is None or until < wake_at):
+                wake_at = until
+            timeout = None if wake_at is None else wake_at - time()
+            if timeout is None or timeout > 0:
+                self._cond.wait(timeout)
+
+    def wake(self):
+        """Разбудить stage_cycle, не дожидаясь дедлайна (остановка бота)"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def overdue(self, now=None):
+        """Сколько игр ждут перехода, хотя их дедлайн уже прошёл"""
+        now = time() if now is None else now
+        with self._cond:
+            return sum(1 for when in self._deadlines.values() if when <= now)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._deadlines)
+
+
+scheduler = StageScheduler()
@@ -0,0 +1,117 @@
+"""
+Карта мест за столом: id игрока -> индекс в game['players'] и роль -> индексы,
+плюс счётчики живых игроков по сторонам (alive_counts).
+
+game.start_game сохраняет всё это в документе игры (seats, role_seats,
+alive_counts), поэтому поиск игрока, выборка по роли и проверка победы
+не перебирают весь список players.
+Место игрока не меняется до конца игры, role_seats правится при передаче роли
+(сержант -> комиссар, мафия -> дон), alive_counts — в kill/revive.
+Ключи seats — строки: игра хранится в JSON.
+"""
+
+MAFIA_ROLES = ('mafia', 'don')
+FACTIONS = ('mafia', 'maniac', 'civil')
+
+
+def build_seats(players):
+    """Построить (seats, role_seats) по списку игроков"""
+    seats = {str(p['id']): i for i, p in enumerate(players)}
+    role_seats = {}
+    for i, p in enumerate(players):
+        role_seats.setdefault(p['role'], []).append(i)
+    return seats, role_seats
+
+
+def faction_of(role):
+    """Сторона роли: mafia, maniac или civil"""
+    if role in MAFIA_ROLES:
+        return 'mafia'
+    if role == 'maniac':
+        return 'maniac'
+    return 'civil'
+
+
+def build_alive_counts(players):
+    """Число живых игроков каждой стороны"""
+    counts = dict.fromkeys(FACTIONS, 0)
+    for p in players:
+        if p.get('alive', True):
+            counts[faction_of(p['role'])] += 1
+    return counts
+
+
+def alive_counts(game):
+    """Счётчики живых игроков игры (для старых игр строятся в памяти)"""
+    if 'alive_counts' not in game:
+        game['alive_counts'] = build_alive_counts(game.get('players', []))
+    return game['alive_counts']
+
+
+def kill(game, idx):
+    """Игрок выбывает (в памяти). Возвращает False, если он уже был мёртв"""
+    player = game['players'][idx]
+    counts = alive_counts(game)
+    if not player.get('alive', True):
+        return False
+    player['alive'] = False
+    counts[faction_of(player['role'])] -= 1
+    return True
+
+
+def revive(game, idx):
+    """Игрок возвращается в игру (в памяти). Возвращает False, если он и так жив"""
+    player = game['players'][idx]
+    counts = alive_counts(game)
+    if player.get('alive', True):
+        return False
+    player['alive'] = True
+    counts[faction_of(player['role'])] += 1
+    return True
+
+
+def _ensure_seats(game):
+    # Игры, начатые до появления карты мест, получают её в памяти
+    if 'seats' not in game or 'role_seats' not in game:
+        game['seats'], game['role_seats'] = build_seats(game.get('players', []))
+
+
+def seat_of(game, user_id):
+    """Индекс игрока в game['players'] или None, если он не играет"""
+    _ensure_seats(game)
+    return game['seats'].get(str(user_id))
+
+
+def player_by_id(game, user_id):
+    """Игрок по id или None"""
+    idx = seat_of(game, user_id)
+    return game['players'][idx] if idx is not None else None
+
+
+def role_seats(game, *roles, alive=True):
+    """Индексы игроков с указанными ролями (по умолчанию только живых)"""
+    _ensure_seats(game)
+    players = game['players']
+    seats = sorted(i for role in roles for i in game['role_seats'].get(role, []))
+    return [i for i in seats if not alive or players[i].get('alive', True)]
+
+
+def player_with_role(game, role, alive=True):
+    """Первый игрок с ролью или None"""
+    seats = role_seats(game, role, alive=alive)
+    return game['players'][seats[0]] if seats else None
+
+
+def promote(game, idx, new_role):
+    """Передать игроку новую роль (в памяти), поправив role_seats"""
+    _ensure_seats(game)
+    player = game['players'][idx]
+    old_role = player['role']
+    if idx in game['role_seats'].get(old_role, []):
+        game['role_seats'][old_role].remove(idx)
+    game['role_seats'].setdefault(new_role, []).append(idx)
+    if player.get('alive', True) and faction_of(old_role) != faction_of(new_role):
+        counts = alive_counts(game)
+        counts[faction_of(old_role)] -= 1
+        counts[faction_of(new_role)] += 1
+    player['role'] = new_role
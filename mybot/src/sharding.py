@@ -0,0 +1,152 @@
+"""
+Шардинг чатов по нескольким процессам бота.
+
+Фронт-процесс получает обновления (polling или webhook) и по кольцу
+консистентного хеширования отправляет каждое процессу-владельцу чата.
+Каждый воркер обрабатывает обновления и ведёт стадии только своих чатов.
+Обновления из личных сообщений (кнопки ночи, голосование) направляются
+в процесс чата, где играет пользователь. Чат ищем по играм и заявкам,
+результат ненадолго кешируется.
+
+Данные общие (JSON-файлы в data/), поэтому в этом режиме
+database.enable_interprocess_locks() блокирует коллекции и между процессами.
+"""
+import bisect
+import hashlib
+import threading
+from time import monotonic
+
+import database
+from seats import seat_of
+
+# Обновления, у которых есть чат
+CHAT_UPDATES = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'my_chat_member', 'chat_member')
+# Обновления, у которых есть только пользователь
+USER_UPDATES = ('inline_query', 'chosen_inline_result', 'shipping_query',
+                'pre_checkout_query', 'poll_answer')
+
+
+def _hash(key):
+    return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Кольцо консистентного хеширования: ключ -> узел (индекс воркера)"""
+
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        self._ring = sorted((_hash(f'{node}:{i}'), node) for node in self.nodes for i in range(replicas))
+        self._keys = [h for h, _ in self._ring]
+
+    def node_for(self, key):
+        if not self._ring:
+            return None
+        pos = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        return self._ring[pos][1]
+
+
+class Shard:
+    """Какие чаты принадлежат этому процессу"""
+
+    def __init__(self, index=0, count=1, replicas=160):
+        self.configure(index, count, replicas)
+
+    def configure(self, index, count, replicas=160):
+        self.index = index
+        self.count = count
+        self.ring = HashRing(range(count), replicas) if count > 1 else None
+
+    @property
+    def enabled(self):
+        return self.ring is not None
+
+    @property
+    def is_primary(self):
+        """Процесс для общих фоновых задач (ежедневные события, чистка заявок)"""
+        return self.index == 0
+
+    def shard_for_chat(self, chat_id):
+        return self.ring.node_for(chat_id) if self.ring else 0
+
+    def owns_chat(self, chat_id):
+        return not self.ring or self.ring.node_for(chat_id) == self.index
+
+    def owned(self, docs):
+        """Оставить только игры/заявки чатов этого процесса"""
+        if not self.ring:
+            return list(docs)
+        return [d for d in docs if self.owns_chat(d.get('chat'))]
+
+
+class UserChatLookup:
+    """Пользователь -> чат, где он сейчас играет или записан в заявку (с коротким кешем)"""
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def chat_for_user(self, user_id):
+        now = monotonic()
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached and now - cached[1] < self.ttl:
+                return cached[0]
+        chat_id = self._lookup(user_id)
+        with self._lock:
+            self._cache[user_id] = (chat_id, now)
+            if len(self._cache) > 10000:
+                self._cache = {k: v for k, v in self._cache.items() if now - v[1] < self.ttl}
+        return chat_id
+
+    @staticmethod
+    def _lookup(user_id):
+        for game in database.find('games', {'game': 'mafia'}):
+            if seat_of(game, user_id) is not None:
+                return game['chat']
+        request = database.find_one('requests', {'players.id': user_id})
+        if request:
+            return request['chat']
+        # Вне игры личные сообщения обрабатывает процесс, выбранный по самому пользователю
+        return user_id
+
+
+def update_route_key(update, lookup):
+    """Ключ кольца для сырого обновления Telegram (dict): id чата-владельца"""
+    for kind in CHAT_UPDATES:
+        if kind in update:
+            chat_id = update[kind]['chat']['id']
+            return chat_id if chat_id < 0 else lookup.chat_for_user(chat_id)
+    call = update.get('callback_query')
+    if call:
+        message = call.get('message')
+        if message and message['chat']['id'] < 0:
+            return message['chat']['id']
+        return lookup.chat_for_user(call['from']['id'])
+    for kind in USER_UPDATES:
+        if kind in update:
+            user = update[kind].get('from') or update[kind].get('user')
+            if user:
+                return lookup.chat_for_user(user['id'])
+    return None
+
+
+class UpdateRouter:
+    """Фронт: раскладывает сырые обновления по очередям воркеров"""
+
+    def __init__(self, queues, replicas=160, lookup=None):
+        self.queues = queues
+        self.ring = HashRing(range(len(queues)), replicas)
+        self.lookup = lookup or UserChatLookup()
+        self.routed = [0] * len(queues)
+
+    def dispatch(self, update):
+        key = update_route_key(update, self.lookup)
+        index = self.ring.node_for(key) if key is not None else 0
+        self.routed[index] += 1
+        self.queues[index].put(update)
+        return index
+
+
+shard = Shard()
@@ -254,15 +254,11 @@ def purchase_item(user_id: int, item_id: str, payment_type: str = 'candies') ->
     elif item['type'] == 'case':
         # Открываем кейс и выдаем случайное событие
         try:
-            from game_events import get_available_events
-            events = get_available_events()
+            from game_events import get_available_events, get_events_by_rarity
             event_rarity = item.get('event_rarity', 'common')
             
-            # Фильтруем события по редкости
-            filtered_events = [e for e in events if e.get('rarity') == event_rarity]
-            if not filtered_events:
-                # Если нет событий нужной редкости, берем любые
-                filtered_events = events
+            # События нужной редкости; если таких нет, берем любые
+            filtered_events = get_events_by_rarity(event_rarity) or get_available_events()
             
             if filtered_events:
                 random_event = random.choice(filtered_events)
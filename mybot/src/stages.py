@@ -3,14 +3,23 @@ from bot import bot
 import database
 from game import role_titles, stop_game
 import random
+import threading
 from time import time, sleep
-from collections import Counter
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from telebot.apihelper import ApiException
 from settings import get_settings
+from night import resolve_night, night_rng, apply_night, check_winner
+from seats import seat_of, player_with_role, role_seats, kill, alive_counts
+from scheduler import scheduler
+from concurrent.futures import ThreadPoolExecutor
+from config import PM_FANOUT_WORKERS
+from metrics import metrics
 
 stages = {}
 
+# Потоки для параллельной рассылки личных сообщений игрокам
+pm_executor = ThreadPoolExecutor(max_workers=PM_FANOUT_WORKERS, thread_name_prefix='pm')
+
 def add_stage(number, time=None, delete=False):
     def decorator(func):
         stages[number] = {'time': time, 'func': func, 'delete': delete}
@@ -39,20 +48,58 @@ def format_roles(game, show_roles=False, condition=lambda p: p.get('alive', True
                 result.append(f'{i+1}. {name}')
     return '\n'.join(result)
 
+def record_vote(game, voter_idx, user_id, target_idx, retries=5):
+    """
+    Записать голос и поправить счётчики vote_counts / vote_voters одной записью.
+    Прежний голос игрока вычитается, новый прибавляется; запись идёт только если
+    голос не поменялся с момента чтения, иначе перечитываем игру и пробуем снова.
+    Возвращает обновлённую игру или None.
+    """
+    for _ in range(retries):
+        current = game.get('vote', {}).get(str(voter_idx))
+        if current == target_idx:
+            return game
+        update = {
+            '$set': {f'vote.{voter_idx}': target_idx, f'vote_map_ids.{user_id}': target_idx},
+            '$inc': {f'vote_counts.{target_idx}': 1},
+            '$push': {f'vote_voters.{target_idx}': voter_idx},
+        }
+        if current is not None:
+            update['$inc'][f'vote_counts.{current}'] = -1
+            update['$pull'] = {f'vote_voters.{current}': voter_idx}
+        query = {'_id': game['_id'], f'vote.{voter_idx}': current if current is not None else {'$exists': False}}
+        updated = database.find_one_and_update('games', query, update, return_document=True)
+        if updated:
+            return updated
+        game = database.find_one('games', {'_id': game['_id']})
+        if not game:
+            return None
+    return None
+
+def get_vote_voters(game):
+    """Голоса по целям: {индекс цели: [индексы голосовавших]}"""
+    voters = game.get('vote_voters')
+    if voters is None:
+        # Игра начата до появления счётчиков — собираем из vote
+        voters = {}
+        for voter_idx, target_idx in game.get('vote', {}).items():
+            voters.setdefault(str(target_idx), []).append(int(voter_idx))
+    return {int(t): v for t, v in voters.items() if v}
+
+def get_vote_counts(game):
+    """Число голосов за каждого игрока: {индекс цели: количество}"""
+    counts = game.get('vote_counts')
+    if counts is None:
+        return {t: len(v) for t, v in get_vote_voters(game).items()}
+    return {int(t): c for t, c in counts.items() if c > 0}
+
 def get_votes(game):
     """Формирует список голосования для отображения в чате."""
-    votes = game.get('vote', {})
-    if not votes:
+    # Группировка голосов (за кого -> кто голосовал) хранится в игре
+    vote_map = get_vote_voters(game)
+    if not vote_map:
         return "Пока никто не голосовал."
     
-    # Группируем голоса: за кого -> кто голосовал
-    vote_map = {}
-    for voter_idx, target_idx in votes.items():
-        target_idx = int(target_idx)
-        if target_idx not in vote_map: 
-            vote_map[target_idx] = []
-        vote_map[target_idx].append(int(voter_idx))
-    
     lines = []
     # Сортируем: сначала игроки (0+), потом воздержавшиеся (-1)
     for target_idx in sorted(vote_map.keys()):
@@ -107,14 +154,7 @@ def update_timer(game):
             text += f"{victim_text}\n\n"
         text += f"⏰ Осталось времени: {time_str}\n\n"
         
-        # Подсчитываем голоса для каждого игрока
-        votes = game.get('vote', {})
-        vote_map_ids = game.get('vote_map_ids', {})
-        vote_counts = {}
-        for user_id, target_idx in vote_map_ids.items():
-            target_idx = int(target_idx)
-            if target_idx >= 0 and target_idx < len(game['players']):
-                vote_counts[target_idx] = vote_counts.get(target_idx, 0) + 1
+        vote_counts = get_vote_counts(game)
         
         # Формируем список игроков с голосами
         players_list = []
@@ -135,42 +175,61 @@ def update_timer(game):
             text += f"\n\nПропустили: {', '.join(skipped)}"
     
     if text:
-        try:
-            bot.edit_message_text(
-                text=text, 
-                chat_id=game['chat'], 
-                message_id=game['message_id'], 
-                parse_mode='HTML'
-            )
-        except ApiException: 
-            pass
+        # Таймер и голоса меняются часто — правки склеиваются, одинаковые пропускаются
+        bot.edit_live_message(game['chat'], game['message_id'], text, parse_mode='HTML')
 
-def send_player_message(player, game, text, markup=None):
-    sent = False
-    if player.get('pm_id'):
+def _deliver_player_message(player, text, markup=None, pm_field='pm_id', edit=True):
+    """Обновить или отправить ЛС игроку. Возвращает (успех, id нового сообщения или None)"""
+    if edit and player.get(pm_field):
         try:
             bot.edit_message_text(
                 text=text,
                 chat_id=player['id'],
-                message_id=player['pm_id'],
+                message_id=player[pm_field],
                 reply_markup=markup,
                 parse_mode='HTML'
             )
-            sent = True
+            return True, None
         except ApiException:
             pass 
-            
-    if not sent:
+    
+    try:
+        msg = bot.send_message(player['id'], text, reply_markup=markup, parse_mode='HTML')
+        return True, msg.message_id
+    except:
+        return False, None
+
+def send_player_message(player, game, text, markup=None):
+    sent, pm_id = _deliver_player_message(player, text, markup)
+    if pm_id is not None:
         try:
-            msg = bot.send_message(player['id'], text, reply_markup=markup, parse_mode='HTML')
-            player_idx = next(i for i, p in enumerate(game['players']) if p['id'] == player['id'])
+            player_idx = seat_of(game, player['id'])
             database.update_one('games', {'_id': game['_id']}, {
-                '$set': {f'players.{player_idx}.pm_id': msg.message_id}
+                '$set': {f'players.{player_idx}.pm_id': pm_id}
             })
-            return True
         except:
-            return False 
-    return True
+            return False
+    return sent
+
+def send_player_messages(game, messages, pm_field='pm_id', edit=True, save_pm_ids=True):
+    """
+    Разослать ЛС нескольким игрокам параллельно.
+    messages - список (player, text, markup). Новые id сообщений сохраняются одной записью.
+    """
+    results = list(pm_executor.map(
+        lambda m: _deliver_player_message(m[0], m[1], m[2], pm_field, edit), messages
+    ))
+    
+    if save_pm_ids and game.get('_id'):
+        pm_updates = {}
+        for (player, _, _), (_, pm_id) in zip(messages, results):
+            idx = seat_of(game, player['id'])
+            if pm_id is not None and idx is not None:
+                pm_updates[f'players.{idx}.{pm_field}'] = pm_id
+        if pm_updates:
+            database.update_one('games', {'_id': game['_id']}, {'$set': pm_updates})
+    
+    return [sent for sent, _ in results]
 
 def handle_night_stage(game, stage_num, role, callback_prefix, lang_key, 
                        exclude_self=True, custom_targets=None, custom_kb=None, 
@@ -193,10 +252,6 @@ def handle_night_stage(game, stage_num, role, callback_prefix, lang_key,
     settings = get_settings(game['chat'])
     night_time = settings.get('night_time', 30)
     
-    # Обновляем время стадии
-    if stage_num in stages:
-        stages[stage_num]['time'] = night_time
-    
     # Получаем игроков с нужной ролью
     if isinstance(role, tuple):
         # Множественные роли (например, мафия и дон)
@@ -227,18 +282,17 @@ def handle_night_stage(game, stage_num, role, callback_prefix, lang_key,
     else:
         kb = create_player_buttons(targets, callback_prefix, row_width=2)
     
-    # Отправляем сообщения игрокам
-    for player in players:
-        if player['id'] not in blocks:
-            text = getattr(lang, lang_key).format(time=night_time)
-            send_player_message(player, game, text, kb)
-        else:
-            send_player_message(player, game, lang.action_blocked)
+    # Отправляем сообщения игрокам (параллельно)
+    text = getattr(lang, lang_key).format(time=night_time)
+    send_player_messages(game, [
+        (player, text, kb) if player['id'] not in blocks else (player, lang.action_blocked, None)
+        for player in players
+    ])
     
     # Отправляем сообщение в группу, если нужно
     if group_message:
         try:
-            bot.send_message(game['chat'], group_message, parse_mode='HTML')
+            bot.post_message(game['chat'], group_message, parse_mode='HTML')
         except:
             pass
     
@@ -274,93 +328,91 @@ def create_player_buttons(targets, callback_prefix, row_width=2):
     
     return kb
 
+def _notify_missed_player(player, warning=None):
+    """Убрать у проспавшего игрока кнопки хода и, если нужно, предупредить его"""
+    pm_id = player.get('pm_id')
+    if pm_id:
+        try:
+            bot.delete_message(player['id'], pm_id)
+        except:
+            pass
+    if warning:
+        try:
+            bot.send_message(player['id'], warning, parse_mode='HTML')
+        except:
+            pass
+
 def cleanup_missed_actions(game, expected_players, action_type='ночное действие', role_name=None):
     """
     Удаляет сообщения игроков, которые не сделали ход, и увеличивает счетчик пропущенных действий.
     Если игрок пропустил 2 действия подряд - автокик.
+    
+    В группу уходит одно общее сообщение, личные сообщения рассылаются одной пачкой.
+    В базу ничего не пишет: меняет game на месте и возвращает точечные изменения
+    {'$set': {...}, '$inc': {...}}, которые go_to_next_stage добавляет в запись перехода.
+    Ключи missed_actions - строки: игра хранится в JSON.
     """
     played_ids = set(game.get('played', []))
-    missed_actions = game.get('missed_actions', {})
-    kicked_players = []
-    current_stage = game.get('stage', 0)
+    blocks = set(game.get('blocks', []))
+    missed_actions = game.setdefault('missed_actions', {})
+    changes = {'$set': {}, '$inc': {}}
+    announcements = []
+    kicks = []
+    notices = []
     
     for player in expected_players:
         user_id = player['id']
-        if not player.get('alive', True):
+        # Мертвые и заблокированные игроки хода не пропускают
+        if not player.get('alive', True) or user_id in blocks:
             continue
+        key = str(user_id)
+        current_count = missed_actions.get(key, missed_actions.get(user_id, 0))
         
-        # Проверяем, была ли стадия для этой роли
-        # Если игрок заблокирован, он не должен получать предупреждение
-        if user_id in game.get('blocks', []):
+        if user_id in played_ids:
+            # Игрок сделал ход - сбрасываем счетчик пропущенных действий
+            if current_count:
+                missed_actions[key] = 0
+                changes['$set'][f'missed_actions.{key}'] = 0
             continue
         
-        # Если игрок не сделал ход
-        if user_id not in played_ids:
-            # Удаляем сообщение с кнопками, если оно есть
-            pm_id = player.get('pm_id')
-            if pm_id:
-                try:
-                    bot.delete_message(user_id, pm_id)
-                except:
-                    pass
-            
-            # Отправляем сообщение в группу о пропущенном действии
-            player_pos = player.get('position', game['players'].index(player) + 1)
-            player_role = player.get('role', 'игрок')
-            role_display = role_titles.get(player_role, 'Игрок')
-            
-            if role_name:
-                try:
-                    bot.send_message(
-                        game['chat'],
-                        f'😴 {role_display} №{player_pos} {player["name"]} сегодня проспал.',
-                        parse_mode='HTML'
-                    )
-                except:
-                    pass
-            
-            # Увеличиваем счетчик пропущенных действий
-            current_count = missed_actions.get(user_id, 0)
-            new_count = current_count + 1
-            missed_actions[user_id] = new_count
-            
-            # Если пропустил 2 действия подряд - автокик
-            if new_count >= 2:
-                player['alive'] = False
-                kicked_players.append(player)
-                try:
-                    bot.send_message(
-                        game['chat'],
-                        f'🚫 Игрок №{player_pos} {player["name"]} исключен из игры за пропуск 2 действий подряд.',
-                        parse_mode='HTML'
-                    )
-                except:
-                    pass
-            elif new_count == 1:
-                # Первое предупреждение
-                try:
-                    bot.send_message(
-                        user_id,
-                        f'⚠️ Внимание! Ты пропустил {action_type}. При следующем пропуске будешь исключен из игры.',
-                        parse_mode='HTML'
-                    )
-                except:
-                    pass
+        player_idx = seat_of(game, user_id)
+        player_pos = player.get('position', player_idx + 1)
+        role_display = role_titles.get(player.get('role', 'игрок'), 'Игрок')
+        if role_name:
+            announcements.append(f'😴 {role_display} №{player_pos} {player["name"]} сегодня проспал.')
+        
+        new_count = current_count + 1
+        missed_actions[key] = new_count
+        if current_count:
+            changes['$set'][f'missed_actions.{key}'] = new_count
         else:
-            # Игрок сделал ход - сбрасываем счетчик пропущенных действий
-            if user_id in missed_actions:
-                missed_actions[user_id] = 0
-    
-    # Обновляем missed_actions в базе данных
-    database.update_one('games', {'_id': game['_id']}, {
-        '$set': {'missed_actions': missed_actions, 'players': game['players']}
-    })
-    
-    return kicked_players
+            changes['$inc'][f'missed_actions.{key}'] = 1
+        
+        warning = None
+        if new_count >= 2:
+            # Пропустил 2 действия подряд - автокик
+            kill(game, player_idx)
+            changes['$set'][f'players.{player_idx}.alive'] = False
+            kicks.append(f'🚫 Игрок №{player_pos} {player["name"]} исключен из игры за пропуск 2 действий подряд.')
+        elif new_count == 1:
+            warning = f'⚠️ Внимание! Ты пропустил {action_type}. При следующем пропуске будешь исключен из игры.'
+        notices.append((player, warning))
+    
+    if kicks:
+        counts = alive_counts(game)
+        for faction, count in counts.items():
+            changes['$set'][f'alive_counts.{faction}'] = count
+    
+    if notices:
+        list(pm_executor.map(lambda n: _notify_missed_player(*n), notices))
+    if announcements or kicks:
+        # Синхронно: объявление о пропусках должно уйти до сообщений следующей стадии
+        bot.try_to_send_message(game['chat'], '\n'.join(announcements + kicks), parse_mode='HTML')
+    return changes
 
-def send_vote_buttons(player, game):
-    """Отправляет игроку сообщение с кнопками для голосования во время обсуждения"""
-    player_idx = next(i for i, p in enumerate(game['players']) if p['id'] == player['id'])
+def build_vote_buttons(player, game):
+    """Текст и кнопки голосования во время обсуждения (None, если голосовать не за кого)"""
+    player_idx = seat_of(game, player['id'])
     
     # Получаем список живых игроков, исключая самого игрока
     alive_players = [
@@ -369,7 +421,7 @@ def send_vote_buttons(player, game):
     ]
     
     if not alive_players:
-        return
+        return None
     
     # Формируем текст сообщения
     text = "🗳 <b>Голосование во время обсуждения</b>\n\n"
@@ -392,6 +444,15 @@ def send_vote_buttons(player, game):
     
     # Создаем кнопки для голосования
     kb = create_player_buttons(alive_players, 'vote_discussion', row_width=2)
+    return text, kb
+
+def send_vote_buttons(player, game):
+    """Отправляет игроку сообщение с кнопками для голосования во время обсуждения"""
+    built = build_vote_buttons(player, game)
+    if not built:
+        return
+    text, kb = built
+    player_idx = seat_of(game, player['id'])
     
     # Отправляем сообщение
     try:
@@ -492,14 +553,164 @@ def check_night_stage_complete(game):
     
     return False
 
-def go_to_next_stage(game, inc=1, max_recursion=10):
-    """Переход к следующей стадии с защитой от бесконечной рекурсии"""
-    if max_recursion <= 0:
-        print(f"ERROR: Maximum recursion depth reached in go_to_next_stage. Current stage: {game.get('stage')}")
-        return game
+def stage_delta(game, stage_number, deadline):
+    """Чистая функция: поля игры, которые меняются при входе в стадию stage_number"""
+    delta = {
+        'stage': stage_number,
+        'time': deadline,
+        'next_stage_time': deadline,
+        'played': []
+    }
+    
+    # Сброс ночных действий
+    if stage_number == 3:  # Начало ночи
+        # Применяем блокировки от метели
+        blizzard_blocked = game.get('blizzard_blocked', [])
+        if blizzard_blocked:
+            # Добавляем заблокированных игроков в blocks
+            current_blocks = list(game.get('blocks', []))
+            for blocked_id in blizzard_blocked:
+                if blocked_id not in current_blocks:
+                    current_blocks.append(blocked_id)
+            delta['blocks'] = current_blocks
+            # Очищаем список заблокированных метелью
+            delta['blizzard_blocked'] = []
+        else:
+            # Если нет блокировок от метели, сбрасываем blocks
+            delta['blocks'] = []
+        
+        delta.update({
+            'shots': [], 'heals': [], 'played': [],
+            'commissar_action': None, 'commissar_target': None,
+            'don_check': None, 'lawyer_client': None,
+            'bum_witness': None, 'maniac_shot': None
+        })
+    return delta
+
+# Таблица переходов: текущая стадия -> следующая (номер или функция от игры).
+# Функция может вернуть None - игра завершена, переходить некуда.
+# Стадий, которых нет в таблице, переходят по порядку (stage + inc).
+STAGE_TRANSITIONS = {
+    -3: 0,   # После первой ночи - день
+    0: 2,    # После обсуждения - результаты голосования
+    12: 0,   # После утра - новый день
+    13: 0,   # Доп. обсуждение, последнее слово, подтверждение голосования -
+    14: 0,   # как и раньше, новый день
+    15: 0,
+}
+
+# Переходы, с которых начинается новый день (увеличиваем day_count)
+NEW_DAY_TRANSITIONS = {(12, 0), (13, 0), (14, 0), (15, 0)}
+
+def _lawyer_has_nothing_to_do(game):
+    lawyer = player_with_role(game, 'lawyer')
+    return lawyer is None or bool(lawyer.get('lawyer_client'))
+
+def _nobody_alive(*roles):
+    return lambda game: not role_seats(game, *roles)
+
+# Стадии, которым нечего делать: нет живой роли, адвокат уже выбрал и т.п.
+# Проверки чистые (только читают игру), поэтому такие стадии проходятся
+# внутри одного перехода - без своей записи, таймера, сохранения и сообщений.
+# Стадии, которые пропускают себя с побочным эффектом (комиссару под блоком
+# уходит сообщение), как и раньше сами вызывают go_to_next_stage.
+STAGE_SKIPS = {
+    -3: lambda game: bool(game.get('mafia_met')),
+    4: _nobody_alive('mafia', 'don'),
+    5: _nobody_alive('don'),
+    6: _nobody_alive('commissar'),
+    7: _nobody_alive('doctor'),
+    8: _nobody_alive('maniac'),
+    9: _nobody_alive('mistress'),
+    10: _lawyer_has_nothing_to_do,
+    11: _nobody_alive('bum'),
+    13: lambda game: not game.get('vote_tie'),
+}
+
+# Сколько стадий подряд может пролистать один вызов go_to_next_stage
+MAX_STAGE_STEPS = 20
+
+def next_stage_number(game, current_stage, inc=1):
+    """Номер следующей стадии по таблице переходов (None - игра завершена)"""
+    target = STAGE_TRANSITIONS.get(current_stage)
+    if target is None:
+        stage_number = current_stage + inc
+        # Стадия 1 (голосование) больше не используется - сразу к результатам
+        return 2 if stage_number == 1 else stage_number
+    return target(game) if callable(target) else target
+
+_transition = threading.local()
+
+def go_to_next_stage(game, inc=1, max_steps=MAX_STAGE_STEPS):
+    """Переход к следующей стадии.
     
-    database.delete_many('polls', {'chat': game['chat']})
+    Стадии из STAGE_SKIPS пролистываются внутри одного перехода. Стадии,
+    которые решают пропустить себя уже во время запуска, сами вызывают
+    go_to_next_stage: такой вложенный вызов не уходит в рекурсию, а только
+    запоминает запрос - следующий переход выполняет цикл ниже.
+    """
+    if getattr(_transition, 'active', False):
+        _transition.pending = (game, inc)
+        return game
     
+    _transition.active = True
+    try:
+        result = game
+        for _ in range(max_steps):
+            _transition.pending = None
+            result = _advance_stage(game, inc)
+            if _transition.pending is None:
+                return result
+            game, inc = _transition.pending
+        print(f"ERROR: go_to_next_stage made {max_steps} steps in a row. Current stage: {game.get('stage')}")
+        return result
+    finally:
+        _transition.active = False
+        _transition.pending = None
+
+stage_transitions = metrics.counter('stage_transitions_total', 'Переходы стадий', ('stage',))
+stage_skips = metrics.counter('stage_skips_total', 'Стадии, пролистанные без входа в них', ('stage',))
+
+# Названия ролей ночных стадий для сообщений о пропущенном ходе
+MISSED_ACTION_ROLES = {
+    4: 'Мафия', 5: 'Дон', 6: 'Комиссар', 7: None,
+    8: 'Доктор', 9: 'Маньяк', 10: 'Любовница', 11: 'Адвокат', 12: 'Бомж'
+}
+
+def _collect_missed_actions(game, stage_number, updates, increments):
+    """Пропущенные ходы на ночной стадии - в общую запись перехода"""
+    if stage_number not in STAGE_ROLE_CONFIG:
+        return
+    expected_players = get_expected_players_for_stage(game, stage_number)
+    role_name = MISSED_ACTION_ROLES.get(stage_number)
+    if expected_players and role_name:
+        changes = cleanup_missed_actions(game, expected_players, 'ночное действие', role_name)
+        updates.update(changes['$set'])
+        for key, value in changes['$inc'].items():
+            increments[key] = increments.get(key, 0) + value
+
+def _find_stage(stage_number, current_stage, inc):
+    """Стадия по номеру; если её нет - ближайшая следующая (None, если нет и её)"""
+    stage = stages.get(stage_number)
+    if stage:
+        return stage_number, stage
+    print(f"ERROR: Stage {stage_number} not found. Current stage: {current_stage}, inc: {inc}")
+    print(f"Available stages: {sorted(stages.keys())}")
+    # Пытаемся найти следующую доступную стадию
+    for next_stage in range(stage_number, stage_number + 20):
+        if stages.get(next_stage):
+            print(f"Found alternative stage: {next_stage}")
+            return next_stage, stages[next_stage]
+    print(f"FATAL ERROR: No stage found after {stage_number}. Stopping game.")
+    return stage_number, None
+
+def _advance_stage(game, inc):
+    """
+    Один переход. Стадии, которым нечего делать (STAGE_SKIPS), проходятся
+    по таблице в том же цикле: их пропуски ходов и счётчики копятся, а
+    записывается, ставится в планировщик, сохраняется и запускается только
+    стадия, на которой игра остановится.
+    """
     current_stage = game['stage']
     # Убеждаемся, что current_stage - это число
     if isinstance(current_stage, str):
@@ -508,140 +719,68 @@ def go_to_next_stage(game, inc=1, max_recursion=10):
         except:
             current_stage = 0
     
-    # После стадии 12 (утро) возвращаемся к стадии 0 (день)
-    if current_stage >= 12:
-        stage_number = 0
-        database.update_one('games', {'_id': game['_id']}, {'$inc': {'day_count': 1}})
-    elif current_stage == -3:
-        # После первой ночи переходим к дню (стадия 0)
-        stage_number = 0
-    elif current_stage == 0:
-        # После обсуждения переходим к результатам голосования (стадия 2)
-        stage_number = 2
-    elif current_stage == 13:
-        # После дополнительного обсуждения при ничьей - повторное голосование
-        # Переходим к стадии 2 (результаты голосования) для повторного голосования
-        stage_number = 2
-    elif current_stage == 14:
-        # После последнего слова - проверяем победу и переходим к ночи
-        alive = [p for p in game['players'] if p['alive']]
-        mafia = [p for p in alive if p['role'] in ('mafia', 'don')]
-        maniac = [p for p in alive if p['role'] == 'maniac']
-        
-        if not mafia and not maniac:
-            return stop_game(game, 'Мирные победили!')
-        if len(mafia) >= len(alive) - len(mafia):
-            return stop_game(game, 'Мафия победила!')
-        if maniac and len(maniac) >= len(alive) - 1:
-            return stop_game(game, 'Маньяк победил!')
-        
-        # Игра продолжается - переходим к ночи
-        stage_number = 3  # Начало ночи
-    elif current_stage == 15:
-        # После подтверждения голосования - если не подтвердили, возвращаемся к обсуждению
-        # Если подтвердили - исключаем игрока (переход к стадии 14)
-        vote_confirmation = game.get('vote_confirmation')
-        if vote_confirmation is None:
-            # Не подтвердили - возвращаемся к обсуждению
-            stage_number = 0
-        else:
-            # Подтвердили - переходим к последнему слову
-            stage_number = 14
-    else:
-        stage_number = current_stage + inc
-        # Защита: если пытаемся перейти к несуществующей стадии 1, переходим к стадии 2
-        if stage_number == 1:
-            stage_number = 2
-
-    stage = stages.get(stage_number)
-    if not stage:
-        print(f"ERROR: Stage {stage_number} not found. Current stage: {current_stage}, inc: {inc}")
-        print(f"Available stages: {sorted(stages.keys())}")
-        # Пытаемся найти следующую доступную стадию
-        for next_stage in range(stage_number, stage_number + 20):
-            if stages.get(next_stage):
-                print(f"Found alternative stage: {next_stage}")
-                stage_number = next_stage
-                stage = stages.get(stage_number)
-                break
-        
+    # Всё, что меняется при переходе, копим здесь и пишем одной операцией
+    updates = {}
+    increments = {}
+    
+    # Перед уходом с ночной стадии считаем пропущенные действия
+    _collect_missed_actions(game, current_stage, updates, increments)
+    
+    for _ in range(MAX_STAGE_STEPS):
+        stage_number = next_stage_number(game, current_stage, inc)
+        if stage_number is None:
+            return None
+        if (current_stage, stage_number) in NEW_DAY_TRANSITIONS:
+            increments['day_count'] = increments.get('day_count', 0) + 1
+        stage_number, stage = _find_stage(stage_number, current_stage, inc)
         if not stage:
-            print(f"FATAL ERROR: No stage found after {stage_number}. Stopping game.")
-            # Останавливаем игру, чтобы избежать бесконечной рекурсии
+            # Останавливаем игру, чтобы избежать бесконечного цикла
             return game
-
-    # Перед переходом к следующей стадии проверяем пропущенные действия
-    # для текущей ночной стадии (4-12)
-    if current_stage in STAGE_ROLE_CONFIG:
-        # Определяем, какие игроки должны были сделать ход
-        expected_players = get_expected_players_for_stage(game, current_stage)
-        
-        # Получаем название роли для сообщения
-        role_names = {
-            4: 'Мафия', 5: 'Дон', 6: 'Комиссар', 7: None,
-            8: 'Доктор', 9: 'Маньяк', 10: 'Любовница', 11: 'Адвокат', 12: 'Бомж'
-        }
-        role_name = role_names.get(current_stage)
-        
-        # Очищаем пропущенные действия
-        if expected_players and role_name:
-            cleanup_missed_actions(game, expected_players, 'ночное действие', role_name)
-            # Обновляем игру после cleanup
-            game = database.find_one('games', {'_id': game['_id']})
+        skip = STAGE_SKIPS.get(stage_number)
+        if not (skip and skip(game)):
+            break
+        # Стадия пролистывается: ход в ней никому не показывается, но пропуски
+        # считаются так же, как если бы игра вошла в неё и сразу вышла
+        stage_skips.labels(stage_number).inc()
+        game = dict(game, stage=stage_number, played=[])
+        _collect_missed_actions(game, stage_number, updates, increments)
+        current_stage, inc = stage_number, 1
+    else:
+        print(f"ERROR: skipped {MAX_STAGE_STEPS} stages in a row. Current stage: {current_stage}")
     
-    # Получаем время из настроек для соответствующих стадий
+    # Длительность стадии считаем локально: переходы разных игр идут
+    # параллельно, общий словарь stages менять нельзя
     settings = get_settings(game['chat'])
     if stage_number == 0:
         # Обсуждение
         discussion_time = settings.get('discussion_time', 300)
         # Применяем множитель времени, если есть событие замедления времени
         multiplier = game.get('day_duration_multiplier', 1)
-        discussion_time = int(discussion_time * multiplier)
+        duration = int(discussion_time * multiplier)
         # Сбрасываем множитель после использования
         if multiplier > 1:
-            database.update_one('games', {'_id': game['_id']}, {'$set': {'day_duration_multiplier': 1}})
-        stage['time'] = discussion_time
+            updates['day_duration_multiplier'] = 1
     # Стадия 1 (голосование) больше не используется - голосуем во время обсуждения
     elif stage_number in [4, 5, 6, 7, 8, 9, 10, 11]:
         # Ночные действия (мафия, дон, комиссар, доктор, маньяк, любовница, адвокат, бомж)
-        night_time = settings.get('night_time', 30)
-        stage['time'] = night_time
-    
-    duration = stage['time'](game) if callable(stage['time']) else stage['time']
-    
-    updates = {
-        'stage': stage_number,
-        'time': time() + duration,
-        'next_stage_time': time() + duration,
-        'played': []
-    }
-    
-    # Сброс ночных действий
-    if stage_number == 3:  # Начало ночи
-        # Применяем блокировки от метели
-        blizzard_blocked = game.get('blizzard_blocked', [])
-        if blizzard_blocked:
-            # Добавляем заблокированных игроков в blocks
-            current_blocks = game.get('blocks', [])
-            for blocked_id in blizzard_blocked:
-                if blocked_id not in current_blocks:
-                    current_blocks.append(blocked_id)
-            updates['blocks'] = current_blocks
-            # Очищаем список заблокированных метелью
-            updates['blizzard_blocked'] = []
-        else:
-            # Если нет блокировок от метели, сбрасываем blocks
-            updates['blocks'] = []
-        
-        updates.update({
-            'shots': [], 'heals': [], 'played': [],
-            'commissar_action': None, 'commissar_target': None,
-            'don_check': None, 'lawyer_client': None,
-            'bum_witness': None, 'maniac_shot': None
-        })
-    
-    database.update_one('games', {'_id': game['_id']}, {'$set': updates})
-    new_game = database.find_one('games', {'_id': game['_id']})
+        duration = settings.get('night_time', 30)
+    else:
+        duration = stage['time'](game) if callable(stage['time']) else stage['time']
+    deadline = time() + duration
+    updates.update(stage_delta(game, stage_number, deadline))
+    
+    # Единственная запись за переход; обновлённый документ возвращается сразу
+    update = {'$set': updates}
+    if increments:
+        update['$inc'] = increments
+    new_game = database.find_one_and_update('games', {'_id': game['_id']}, update, return_document=True)
+    if new_game is None:
+        # Игру успели удалить (завершили) — переходить некуда
+        return game
+    scheduler.schedule(game['_id'], deadline, live_timer=stage_number == 0)
+    stage_transitions.labels(stage_number).inc()
+    # Граница стадии: в режиме акторов сохраняем состояние игр на диск
+    database.checkpoint('games')
     
     try: 
         stage['func'](new_game)
@@ -665,20 +804,19 @@ def first_night(game):
         go_to_next_stage(game)
         return
     
-    mafiosi = [p for p in game['players'] if p['role'] in ('mafia', 'don')]
+    mafiosi = [game['players'][i] for i in role_seats(game, 'mafia', 'don', alive=False)]
     if not mafiosi:
         database.update_one('games', {'_id': game['_id']}, {'$set': {'mafia_met': True}})
         go_to_next_stage(game)
         return
     
-    mafia_team = '\n'.join([f'№{p.get("position", game["players"].index(p) + 1)} {p["name"]}' for p in mafiosi])
+    mafia_team = '\n'.join([f'№{p.get("position", seat_of(game, p["id"]) + 1)} {p["name"]}' for p in mafiosi])
     
-    for p in mafiosi:
-        text = lang.first_night_mafia.format(mafia_team=mafia_team)
-        text += '\n\n💬 <b>Вы можете общаться между собой!</b>\n'
-        text += 'Напишите боту в личные сообщения, и ваше сообщение будет переслано всем мафии.\n'
-        text += 'Используйте команду: <code>/mafia &lt;сообщение&gt;</code>'
-        send_player_message(p, game, text)
+    text = lang.first_night_mafia.format(mafia_team=mafia_team)
+    text += '\n\n💬 <b>Вы можете общаться между собой!</b>\n'
+    text += 'Напишите боту в личные сообщения, и ваше сообщение будет переслано всем мафии.\n'
+    text += 'Используйте команду: <code>/mafia &lt;сообщение&gt;</code>'
+    send_player_messages(game, [(p, text, None) for p in mafiosi])
     
     # Сохраняем список ID мафии для общения
     mafia_ids = [p['id'] for p in mafiosi]
@@ -687,7 +825,7 @@ def first_night(game):
     })
     
     # После минуты отправляем сообщение о завершении
-    bot.send_message(game['chat'], lang.first_night_done, parse_mode='HTML')
+    bot.post_message(game['chat'], lang.first_night_done, parse_mode='HTML')
 
 # ДЕНЬ - обсуждение (свободное общение)
 @add_stage(0, None)  # Время будет браться из настроек динамически
@@ -696,12 +834,10 @@ def discussion(game):
     settings = get_settings(game['chat'])
     discussion_time = settings.get('discussion_time', 300)  # По умолчанию 5 минут
     
-    # Обновляем время стадии в словаре stages
-    if 0 in stages:
-        stages[0]['time'] = discussion_time
     # Сбрасываем кандидатов и голоса (теперь голосуем во время обсуждения)
     database.update_one('games', {'_id': game['_id']}, {
-        '$set': {'candidates': [], 'vote': {}, 'vote_map_ids': {}, 'vote_confirmation': None}
+        '$set': {'candidates': [], 'vote': {}, 'vote_map_ids': {}, 'vote_counts': {}, 'vote_voters': {},
+                 'vote_confirmation': None}
     })
     
     # Определяем живых игроков
@@ -744,9 +880,13 @@ def discussion(game):
         '$set': {'message_id': sent.message_id}
     })
     
-    # Отправляем всем игрокам сообщение с кнопками для голосования
+    # Отправляем всем игрокам сообщение с кнопками для голосования (параллельно)
+    vote_messages = []
     for player in alive_players:
-        send_vote_buttons(player, game)
+        built = build_vote_buttons(player, game)
+        if built:
+            vote_messages.append((player, built[0], built[1]))
+    send_player_messages(game, vote_messages, pm_field='vote_pm_id', edit=False)
 
 # ГОЛОСОВАНИЕ (теперь не используется, голосуем во время обсуждения)
 # Стадия 1 оставлена для совместимости, но теперь сразу переходим к результатам
@@ -754,7 +894,6 @@ def discussion(game):
 # РЕЗУЛЬТАТЫ ГОЛОСОВАНИЯ
 @add_stage(2, 10)
 def vote_results(game):
-    votes = game.get('vote', {})
     vote_map_ids = game.get('vote_map_ids', {})
     
     # Удаляем сообщения с кнопками голосования для тех, кто не проголосовал
@@ -778,19 +917,15 @@ def vote_results(game):
         pass
     
     if not vote_map_ids:
-        bot.send_message(game['chat'], lang.vote_result_nobody, parse_mode='HTML')
+        bot.post_message(game['chat'], lang.vote_result_nobody, parse_mode='HTML')
         go_to_next_stage(game)
         return
     
-    # Подсчитываем голоса (используем vote_map_ids для подсчета)
-    vote_counts = {}
-    for user_id, target_idx in vote_map_ids.items():
-        target_idx = int(target_idx)
-        if target_idx >= 0 and target_idx < len(game['players']):
-            vote_counts[target_idx] = vote_counts.get(target_idx, 0) + 1
+    # Голоса уже подсчитаны в игре при каждом голосовании
+    vote_counts = {t: c for t, c in get_vote_counts(game).items() if 0 <= t < len(game['players'])}
     
     if not vote_counts:
-        bot.send_message(game['chat'], lang.vote_result_nobody, parse_mode='HTML')
+        bot.post_message(game['chat'], lang.vote_result_nobody, parse_mode='HTML')
         go_to_next_stage(game)
         return
     
@@ -804,7 +939,7 @@ def vote_results(game):
         # Если это уже повторное голосование и снова ничья - ставим вопрос о выбывании всех
         if vote_tie_count > 0:
             tied_names = [f'№{game["players"][idx].get("position", idx + 1)} {game["players"][idx]["name"]}' for idx in winners]
-            bot.send_message(game['chat'], 
+            bot.post_message(game['chat'], 
                 f'⚖️ <b>Снова ничья!</b>\n\n'
                 f'Кандидаты: {", ".join(tied_names)}\n\n'
                 f'Ставится вопрос: "Кто за то, чтобы все голосуемые игроки покинули стол?"\n'
@@ -816,20 +951,23 @@ def vote_results(game):
             # Все связанные игроки покидают игру
             for idx in winners:
                 if idx < len(game['players']):
-                    game['players'][idx]['alive'] = False
+                    kill(game, idx)
                     # Сохраняем для последнего слова
                     database.update_one('games', {'_id': game['_id']}, {
-                        '$set': {'players': game['players'], 'vote_tie': None, 'vote_tie_count': 0, 'last_word_player': idx}
+                        '$set': {'players': game['players'], 'alive_counts': game['alive_counts'],
+                                 'vote_tie': None, 'vote_tie_count': 0, 'last_word_player': idx}
                     })
             # Переходим к последнему слову для всех связанных
+            deadline = time() + 60
             database.update_one('games', {'_id': game['_id']}, {
-                '$set': {'stage': 14, 'next_stage_time': time() + 60}
+                '$set': {'stage': 14, 'next_stage_time': deadline}
             })
+            scheduler.schedule(game['_id'], deadline)
             return
         else:
             # Первая ничья - дополнительные 30 секунд на обсуждение, затем повторное голосование
             tied_names = [f'№{game["players"][idx].get("position", idx + 1)} {game["players"][idx]["name"]}' for idx in winners]
-            bot.send_message(game['chat'], lang.vote_tie.format(candidates=', '.join(tied_names)) if hasattr(lang, 'vote_tie') and '{candidates}' in lang.vote_tie else f'⚖️ <b>Ничья!</b>\n\nКандидаты: {", ".join(tied_names)}', parse_mode='HTML')
+            bot.post_message(game['chat'], lang.vote_tie.format(candidates=', '.join(tied_names)) if hasattr(lang, 'vote_tie') and '{candidates}' in lang.vote_tie else f'⚖️ <b>Ничья!</b>\n\nКандидаты: {", ".join(tied_names)}', parse_mode='HTML')
             
             # Сохраняем информацию о ничьей для повторного голосования
             database.update_one('games', {'_id': game['_id']}, {
@@ -837,49 +975,53 @@ def vote_results(game):
             })
             
             # Переходим к стадии дополнительного обсуждения (30 секунд)
+            deadline = time() + 30
             database.update_one('games', {'_id': game['_id']}, {
-                '$set': {'stage': 13, 'next_stage_time': time() + 30}
+                '$set': {'stage': 13, 'next_stage_time': deadline}
             })
+            scheduler.schedule(game['_id'], deadline)
             return
     
     # Нет ничьей - определяем победителя
     winner_idx = winners[0]
     victim = game['players'][winner_idx]
-    victim['alive'] = False
+    kill(game, winner_idx)
     
     # Камикадзе забирает с собой
     if victim['role'] == 'kamikaze':
-        voters = [int(v_id) for v_id, t_idx in votes.items() if int(t_idx) == winner_idx]
+        voters = get_vote_voters(game).get(winner_idx, [])
         if voters:
             boom_target_idx = random.choice(voters)
             if boom_target_idx < len(game['players']):
-                game['players'][boom_target_idx]['alive'] = False
-                bot.send_message(game['chat'], lang.kamikaze_boom.format(
+                kill(game, boom_target_idx)
+                bot.post_message(game['chat'], lang.kamikaze_boom.format(
                     name=game['players'][boom_target_idx]['name']
                 ), parse_mode='HTML')
     
     victim_pos = victim.get('position', winner_idx + 1)
-    bot.send_message(game['chat'], lang.vote_result_jail.format(
+    bot.post_message(game['chat'], lang.vote_result_jail.format(
         criminal_name=victim['name'],
         criminal_num=victim_pos
     ), parse_mode='HTML')
     
     # Сохраняем информацию о жертве для последнего слова
     database.update_one('games', {'_id': game['_id']}, {
-        '$set': {'players': game['players'], 'last_word_player': winner_idx}
+        '$set': {'players': game['players'], 'alive_counts': game['alive_counts'], 'last_word_player': winner_idx}
     })
     
     # Переходим к стадии последнего слова
+    deadline = time() + 60  # 1 минута на последнее слово
     database.update_one('games', {'_id': game['_id']}, {
-        '$set': {'stage': 14, 'next_stage_time': time() + 60}  # 1 минута на последнее слово
+        '$set': {'stage': 14, 'next_stage_time': deadline}
     })
+    scheduler.schedule(game['_id'], deadline)
 
 # НОЧЬ
 @add_stage(3, 5)
 def night_start(game):
     game['night_count'] = game.get('night_count', 0) + 1
     database.update_one('games', {'_id': game['_id']}, {'$inc': {'night_count': 1}})
-    bot.send_message(game['chat'], lang.night_start, parse_mode='HTML')
+    bot.post_message(game['chat'], lang.night_start, parse_mode='HTML')
 
 # МАФИЯ СТРЕЛЯЕТ
 @add_stage(4, None)  # Время будет браться из настроек динамически
@@ -887,10 +1029,7 @@ def mafia_stage(game):
     settings = get_settings(game['chat'])
     night_time = settings.get('night_time', 30)
     
-    if 4 in stages:
-        stages[4]['time'] = night_time
-    
-    mafiosi = [p for p in game['players'] if p['role'] in ('mafia', 'don') and p.get('alive')]
+    mafiosi = [game['players'][i] for i in role_seats(game, 'mafia', 'don')]
     if not mafiosi:
         go_to_next_stage(game)
         return
@@ -899,13 +1038,15 @@ def mafia_stage(game):
     kb = create_player_buttons(targets, 'shot', row_width=2)
     
     blocks = game.get('blocks', [])
+    messages = []
     for p in mafiosi:
         if p['id'] not in blocks:
             team = ", ".join([m['name'] for m in mafiosi if m['id'] != p['id']])
             text = lang.mafia_pm.format(time=night_time, mafia_team=team or "Ты один")
-            send_player_message(p, game, text, kb)
+            messages.append((p, text, kb))
         else:
-            send_player_message(p, game, lang.action_blocked)
+            messages.append((p, lang.action_blocked, None))
+    send_player_messages(game, messages)
 
 # ДОН ИЩЕТ КОМИССАРА
 @add_stage(5, 10)
@@ -927,11 +1068,7 @@ def commissar_stage(game):
     settings = get_settings(game['chat'])
     night_time = settings.get('night_time', 30)
     
-    # Обновляем время стадии в словаре stages
-    if 6 in stages:
-        stages[6]['time'] = night_time
-    
-    commissar = next((p for p in game['players'] if p['role'] == 'commissar' and p['alive']), None)
+    commissar = player_with_role(game, 'commissar')
     if not commissar:
         go_to_next_stage(game)
         return
@@ -974,10 +1111,10 @@ def commissar_stage(game):
         text = lang.commissar_pm.format(time=night_time)
     
     send_player_message(commissar, game, text, kb)
-    bot.send_message(game['chat'], lang.commissar_turn_group, parse_mode='HTML')
+    bot.post_message(game['chat'], lang.commissar_turn_group, parse_mode='HTML')
     
     # Сержант узнаёт о проверке
-    sergeant = next((p for p in game['players'] if p['role'] == 'sergeant' and p['alive']), None)
+    sergeant = player_with_role(game, 'sergeant')
     if sergeant:
         bot.send_message(sergeant['id'], '👮 Комиссар проснулся. Ты узнаешь о его действии.', parse_mode='HTML')
 
@@ -999,7 +1136,7 @@ def mistress_stage(game):
 # АДВОКАТ ВЫБИРАЕТ ПОДЗАЩИТНОГО
 @add_stage(10, None)  # Время будет браться из настроек динамически
 def lawyer_stage(game):
-    lawyer = next((p for p in game['players'] if p['role'] == 'lawyer' and p.get('alive')), None)
+    lawyer = player_with_role(game, 'lawyer')
     if lawyer and lawyer.get('lawyer_client'):
         go_to_next_stage(game)  # Уже выбрал
         return
@@ -1014,102 +1151,66 @@ def bum_stage(game):
 # УТРО - РЕЗУЛЬТАТЫ НОЧИ
 @add_stage(12, 20)
 def morning_results(game):
-    dead = []
+    # Итоги ночи считает чистый движок, здесь - только сообщения и запись
+    result = resolve_night(game, rng=night_rng(game))
+    apply_night(game, result)
+    players = game['players']
     
-    # Выстрелы мафии
-    if game.get('shots'):
-        target_idx = int(Counter(game['shots']).most_common(1)[0][0])
-        is_healed = target_idx in [int(x) for x in game.get('heals', [])]
-        is_lucky = game['players'][target_idx]['role'] == 'lucky' and random.random() < 0.5
-        
-        if not is_healed and not is_lucky:
-            dead.append(target_idx)
-        elif is_lucky:
-            lucky_pos = game["players"][target_idx].get("position", target_idx + 1)
-            bot.send_message(game['chat'], f'🍀 Игрок №{lucky_pos} {game["players"][target_idx]["name"]} выжил благодаря удаче!', parse_mode='HTML')
-    
-    # Выстрел маньяка
-    if game.get('maniac_shot') is not None:
-        maniac_target = int(game['maniac_shot'])
-        is_healed = maniac_target in [int(x) for x in game.get('heals', [])]
-        is_lucky = game['players'][maniac_target]['role'] == 'lucky' and random.random() < 0.5
-        
-        if not is_healed and not is_lucky:
-            dead.append(maniac_target)
-    
-    # Убийство комиссара
-    if game.get('commissar_action') == 'kill' and game.get('commissar_target') is not None:
-        kill_target = int(game['commissar_target'])
-        is_healed = kill_target in [int(x) for x in game.get('heals', [])]
-        if not is_healed:
-            dead.append(kill_target)
-            kill_target_pos = game['players'][kill_target].get('position', kill_target + 1)
-            bot.send_message(game['chat'], lang.commissar_kill_result.format(target_num=kill_target_pos), parse_mode='HTML')
-    
-    # Обрабатываем смерти
-    for idx in set(dead):
-        p = game['players'][idx]
-        p['alive'] = False
-        p['died_night'] = True
-        
-        # Если убит комиссар, сержант становится комиссаром
-        if p['role'] == 'commissar':
-            sergeant = next((s for s in game['players'] if s['role'] == 'sergeant' and s['alive']), None)
-            if sergeant:
-                sergeant['role'] = 'commissar'
-                bot.send_message(sergeant['id'], '👮 Комиссар погиб! Ты становишься новым Комиссаром.', parse_mode='HTML')
-        
-        # Если убит дон, мафия выбирает нового
-        if p['role'] == 'don':
-            mafia = next((m for m in game['players'] if m['role'] == 'mafia' and m['alive']), None)
-            if mafia:
-                mafia['role'] = 'don'
-                bot.send_message(mafia['id'], '🎩 Дон погиб! Ты становишься новым Доном.', parse_mode='HTML')
-        
+    for idx in result['lucky_saved']:
+        lucky_pos = players[idx].get("position", idx + 1)
+        bot.post_message(game['chat'], f'🍀 Игрок №{lucky_pos} {players[idx]["name"]} выжил благодаря удаче!', parse_mode='HTML')
+    
+    if result['commissar_kill'] is not None:
+        kill_target_pos = players[result['commissar_kill']].get('position', result['commissar_kill'] + 1)
+        bot.post_message(game['chat'], lang.commissar_kill_result.format(target_num=kill_target_pos), parse_mode='HTML')
+    
+    promotion_texts = {
+        'commissar': '👮 Комиссар погиб! Ты становишься новым Комиссаром.',
+        'don': '🎩 Дон погиб! Ты становишься новым Доном.'
+    }
+    for idx, role in result['promotions']:
+        bot.send_message(players[idx]['id'], promotion_texts[role], parse_mode='HTML')
+    
+    for idx in result['deaths']:
+        p = players[idx]
         victim_pos = p.get('position', idx + 1)
-        bot.send_message(game['chat'], lang.morning_victim.format(
+        bot.post_message(game['chat'], lang.morning_victim.format(
             victim_name=p['name'],
             victim_num=victim_pos
         ), parse_mode='HTML')
-        
-        # Лучший ход (только если не первая ночь и не было двойного голосования)
-        if game['night_count'] > 1 and game['day_count'] > 0:
-            if len([c for c in game.get('candidates', [])]) < 2:
-                database.update_one('games', {'_id': game['_id']}, {'$set': {'best_move_player': idx}})
-                text = lang.best_move_prompt.format(
-                    player_num=victim_pos,
-                    player_name=p['name']
-                )
-                bot.send_message(p['id'], text, parse_mode='HTML')
     
-    if not dead:
-        bot.send_message(game['chat'], lang.morning_peaceful, parse_mode='HTML')
+    # Лучший ход (только если не первая ночь и не было двойного голосования)
+    for idx in result['best_move']:
+        p = players[idx]
+        text = lang.best_move_prompt.format(
+            player_num=p.get('position', idx + 1),
+            player_name=p['name']
+        )
+        bot.send_message(p['id'], text, parse_mode='HTML')
+    
+    if not result['deaths']:
+        bot.post_message(game['chat'], lang.morning_peaceful, parse_mode='HTML')
     
     # Информация бомжу
-    if game.get('bum_witness'):
-        bum = next((p for p in game['players'] if p['role'] == 'bum' and p['alive']), None)
-        if bum and game.get('bum_witness'):
-            witness_info = game['bum_witness']
-            source_pos = game['players'][witness_info['source']].get('position', witness_info['source'] + 1)
-            target_pos = game['players'][witness_info['target']].get('position', witness_info['target'] + 1)
-            bot.send_message(bum['id'], lang.bum_witness.format(
-                source_num=source_pos,
-                target_num=target_pos
-            ), parse_mode='HTML')
+    witness = result['bum_witness']
+    if witness:
+        source_pos = players[witness['source']].get('position', witness['source'] + 1)
+        target_pos = players[witness['target']].get('position', witness['target'] + 1)
+        bot.send_message(players[witness['bum']]['id'], lang.bum_witness.format(
+            source_num=source_pos,
+            target_num=target_pos
+        ), parse_mode='HTML')
     
-    database.update_one('games', {'_id': game['_id']}, {'$set': {'players': game['players']}})
+    updates = {'players': players, 'alive_counts': alive_counts(game)}
+    if result['promotions']:
+        updates['role_seats'] = game['role_seats']
+    if result['best_move']:
+        updates['best_move_player'] = result['best_move'][-1]
+    database.update_one('games', {'_id': game['_id']}, {'$set': updates})
     
     # Проверка победы
-    alive = [p for p in game['players'] if p['alive']]
-    mafia = [p for p in alive if p['role'] in ('mafia', 'don')]
-    maniac = [p for p in alive if p['role'] == 'maniac']
-    
-    if not mafia and not maniac:
-        return stop_game(game, 'Мирные победили!')
-    if len(mafia) >= len(alive) - len(mafia):
-        return stop_game(game, 'Мафия победила!')
-    if maniac and len(maniac) >= len(alive) - 1:
-        return stop_game(game, 'Маньяк победил!')
+    if result['winner']:
+        return stop_game(game, result['winner'])
     
     go_to_next_stage(game)
 
@@ -1123,7 +1224,7 @@ def vote_tie_discussion(game):
         return
     
     tied_names = [f'№{game["players"][idx].get("position", idx + 1)} {game["players"][idx]["name"]}' for idx in tied]
-    bot.send_message(game['chat'], 
+    bot.post_message(game['chat'], 
         f'⚖️ <b>Ничья!</b>\n\n'
         f'Кандидаты: {", ".join(tied_names)}\n\n'
         f'⏰ Дополнительные 30 секунд на обсуждение, затем повторное голосование.',
@@ -1137,16 +1238,9 @@ def last_word_stage(game):
     last_word_idx = game.get('last_word_player')
     if last_word_idx is None:
         # Проверяем победу и переходим к ночи
-        alive = [p for p in game['players'] if p['alive']]
-        mafia = [p for p in alive if p['role'] in ('mafia', 'don')]
-        maniac = [p for p in alive if p['role'] == 'maniac']
-        
-        if not mafia and not maniac:
-            return stop_game(game, 'Мирные победили!')
-        if len(mafia) >= len(alive) - len(mafia):
-            return stop_game(game, 'Мафия победила!')
-        if maniac and len(maniac) >= len(alive) - 1:
-            return stop_game(game, 'Маньяк победил!')
+        winner = check_winner(game)
+        if winner:
+            return stop_game(game, winner)
         
         go_to_next_stage(game)
         return
@@ -1154,7 +1248,7 @@ def last_word_stage(game):
     victim = game['players'][last_word_idx]
     victim_pos = victim.get('position', last_word_idx + 1)
     
-    bot.send_message(game['chat'], lang.last_word_prompt.format(
+    bot.post_message(game['chat'], lang.last_word_prompt.format(
         player_num=victim_pos,
         player_name=victim['name']
     ), parse_mode='HTML')
@@ -0,0 +1,180 @@
+"""
+Лёгкая трассировка обновлений и переходов стадий.
+
+tracer.trace() открывает корневой спан (обработчик обновления, переход стадии)
+с новым trace id; tracer.span() внутри него записывает вложенные спаны -
+операции с базой и вызовы Bot API. Вне трассы span() ничего не делает.
+Вызовы, которые выполняет другой поток (очередь исходящих), продолжают трассу
+того, кто их поставил: tracer.context() запоминает трассу и текущий спан,
+tracer.attach() подключает их в рабочем потоке.
+Трассы дольше TRACE_SLOW_THRESHOLD секунд дописываются в TRACE_EXPORT_PATH:
+одна строка - один JSON в формате Trace Event (ключ traceEvents), его можно
+открыть в chrome://tracing или Perfetto.
+
+Модуль не читает config (его импортирует database, а база используется и
+вне бота, например в бенчмарках): трассировка выключена, пока app не вызовет
+tracer.configure() со значениями из config.
+"""
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from logger import logger
+
+_local = threading.local()
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'attrs', 'span_id', 'parent_id', 'root', 'wall_start', 'started')
+
+    def __init__(self, tracer, name, attrs, root=False):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.root = root
+
+    def set(self, **attrs):
+        """Добавить атрибуты к спану (например, id чата, когда он стал известен)"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        if self.root:
+            _local.trace = {'id': uuid.uuid4().hex, 'events': [], 'stack': []}
+        trace = _local.trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = trace['stack'][-1] if trace['stack'] else None
+        trace['stack'].append(self.span_id)
+        self.wall_start = time()
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = perf_counter() - self.started
+        trace = _local.trace
+        trace['stack'].pop()
+        args = dict(self.attrs, trace_id=trace['id'], span_id=self.span_id)
+        if self.parent_id:
+            args['parent_id'] = self.parent_id
+        if exc is not None:
+            args['error'] = repr(exc)
+        trace['events'].append({
+            'name': self.name, 'cat': 'mafbot', 'ph': 'X',
+            'ts': int(self.wall_start * 1e6), 'dur': int(duration * 1e6),
+            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args,
+        })
+        if self.root:
+            _local.trace = None
+            slow = duration >= self.tracer.threshold
+            # После этого спаны из других потоков в трассу уже не попадут
+            with self.tracer._lock:
+                trace['done'] = True
+                trace['name'] = self.name
+                trace['exported'] = slow
+            if slow:
+                self.tracer.export(self.name, trace, duration)
+        return False
+
+
+class Tracer:
+    def __init__(self, path, threshold, enabled=True):
+        self.path = path
+        self.threshold = threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.exported = 0
+
+    def configure(self, path, threshold, enabled):
+        self.path = path
+        self.threshold = threshold
+        self.enabled = enabled
+
+    def trace(self, name, **attrs):
+        """Корневой спан; внутри уже идущей трассы - обычный вложенный спан"""
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, name, attrs, root=getattr(_local, 'trace', None) is None)
+
+    def span(self, name, **attrs):
+        """Вложенный спан (ничего не стоит, если трасса не открыта)"""
+        if getattr(_local, 'trace', None) is None:
+            return _NOOP
+        return _Span(self, name, attrs)
+
+    def context(self):
+        """Текущая трасса и открытый спан - чтобы продолжить их в другом потоке"""
+        trace = getattr(_local, 'trace', None)
+        if trace is None:
+            return None
+        return trace, trace['stack'][-1] if trace['stack'] else None
+
+    @contextmanager
+    def attach(self, context):
+        """
+        Продолжить трассу из tracer.context() в текущем потоке: спаны внутри
+        становятся дочерними к сохранённому спану и попадают в ту же трассу.
+        """
+        if context is None:
+            yield
+            return
+        trace, parent_id = context
+        previous = getattr(_local, 'trace', None)
+        attached = {'id': trace['id'], 'events': [], 'stack': [parent_id] if parent_id else []}
+        _local.trace = attached
+        try:
+            yield
+        finally:
+            _local.trace = previous
+            self._merge(trace, attached['events'])
+
+    def _merge(self, trace, events):
+        """Дописать спаны другого потока в трассу (или отдельной строкой, если она уже закрыта)"""
+        if not events:
+            return
+        with self._lock:
+            if not trace.get('done'):
+                trace['events'].extend(events)
+                return
+            exported = trace['exported']
+        # Корень уже завершился (вызов был отправлен без ожидания): дописываем
+        # спаны продолжением с тем же trace id, если сама трасса выгружена
+        # или они медленные сами по себе
+        duration = sum(e['dur'] for e in events) / 1e6
+        if exported or duration >= self.threshold:
+            self.export(trace['name'], {'id': trace['id'], 'events': events}, duration)
+
+    def export(self, name, trace, duration):
+        line = json.dumps({
+            'trace_id': trace['id'], 'name': name, 'duration_ms': round(duration * 1000, 3),
+            # Родитель раньше детей - так удобнее читать в просмотрщике
+            'traceEvents': sorted(trace['events'], key=lambda e: e['ts']),
+        }, ensure_ascii=False, default=str)
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                self.exported += 1
+        except OSError as e:
+            logger.error(f'Не удалось записать трассу {trace["id"]}: {e}')
+
+
+tracer = Tracer(os.path.join('logs', 'traces.jsonl'), 1.0, enabled=False)
@@ -0,0 +1,100 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep
+
+from logger import logger
+
+
+class KeyedWorkerPool:
+    """
+    Ограниченный пул потоков с последовательным выполнением по ключу.
+
+    Задачи с одним ключом (id игры) выполняются строго по очереди — не больше
+    одной одновременно, задачи с разными ключами идут параллельно.
+    Медленная отправка или 429 в одном чате не задерживает остальные.
+    """
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queues = {}  # key -> deque[(enqueued_at, func, args, kwargs)]
+        self._active = set()  # ключи, для которых сейчас работает поток
+        self._completed = 0
+        self._failed = 0
+        self._last_lag = 0.0
+
+    def submit(self, key, func, *args, **kwargs):
+        """Поставить задачу в очередь ключа; запускает обработчик, если ключ свободен"""
+        with self._lock:
+            self._queues.setdefault(key, deque()).append((time(), func, args, kwargs))
+            if key in self._active:
+                return
+            self._active.add(key)
+        self._executor.submit(self._drain, key)
+
+    def is_pending(self, key):
+        """Есть ли для ключа задача в очереди или в работе"""
+        with self._lock:
+            return key in self._active
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues.get(key)
+                if not queue:
+                    self._queues.pop(key, None)
+                    self._active.discard(key)
+                    return
+                enqueued_at, func, args, kwargs = queue.popleft()
+                self._last_lag = time() - enqueued_at
+            try:
+                func(*args, **kwargs)
+                with self._lock:
+                    self._completed += 1
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                logger.error(f"{self.name}: task for {key} failed: {e}")
+
+    def queue_depth(self):
+        """Сколько задач ждёт выполнения (без выполняющихся)"""
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def lag(self):
+        """Возраст самой старой ожидающей задачи, секунд"""
+        now = time()
+        with self._lock:
+            oldest = [q[0][0] for q in self._queues.values() if q]
+        return now - min(oldest) if oldest else 0.0
+
+    def stats(self):
+        with self._lock:
+            depth = sum(len(q) for q in self._queues.values())
+            oldest = [q[0][0] for q in self._queues.values() if q]
+            return {
+                'workers': self.max_workers,
+                'active_keys': len(self._active),
+                'queue_depth': depth,
+                'lag': (time() - min(oldest)) if oldest else 0.0,
+                'last_start_lag': self._last_lag,
+                'completed': self._completed,
+                'failed': self._failed,
+            }
+
+    def join(self, timeout=None):
+        """Дождаться, пока все очереди опустеют. Возвращает False, если не успели за timeout"""
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            with self._lock:
+                if not self._active:
+                    return True
+            if deadline is not None and time() >= deadline:
+                return False
+            sleep(0.05)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
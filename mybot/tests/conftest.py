@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Модули бота импортируются по имени из src (как в app.py), config - из mybot
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'src'), ROOT]
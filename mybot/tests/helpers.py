@@ -0,0 +1,18 @@
+from seats import build_seats, build_alive_counts
+
+
+def make_game(roles, **fields):
+    """Документ игры с игроками заданных ролей (все живы), картой мест и счётчиками"""
+    players = [{'id': 100 + i, 'name': f'p{i + 1}', 'role': role, 'alive': True}
+               for i, role in enumerate(roles)]
+    seats, role_seats = build_seats(players)
+    game = {
+        'players': players,
+        'seats': seats,
+        'role_seats': role_seats,
+        'alive_counts': build_alive_counts(players),
+        'night_count': 1,
+        'day_count': 0,
+    }
+    game.update(fields)
+    return game
@@ -0,0 +1,148 @@
+import random
+from copy import deepcopy
+
+from helpers import make_game
+from seats import kill
+from night import resolve_night, apply_night, night_rng, check_winner
+
+# Места: 0 дон, 1 мафия, 2 комиссар, 3 сержант, 4 доктор, 5 маньяк, 6 счастливчик, 7-9 мирные
+ROLES = ['don', 'mafia', 'commissar', 'sergeant', 'doctor', 'maniac', 'lucky', 'peace', 'peace', 'peace']
+
+
+def resolve(game, seed=0):
+    return resolve_night(game, random.Random(seed))
+
+
+def test_mafia_shot_kills_target():
+    game = make_game(ROLES, shots=[7, 7, 8])
+    result = resolve(game)
+    assert result['deaths'] == [7]
+    assert result['winner'] is None
+
+
+def test_heal_saves_mafia_target():
+    game = make_game(ROLES, shots=[7], heals=[7])
+    assert resolve(game)['deaths'] == []
+
+
+def test_lucky_survival_follows_seeded_rng():
+    outcomes = set()
+    for seed in range(20):
+        game = make_game(ROLES, shots=[6])
+        survives = random.Random(seed).random() < 0.5
+        result = resolve(game, seed)
+        if survives:
+            assert result['deaths'] == [] and result['lucky_saved'] == [6]
+        else:
+            assert result['deaths'] == [6] and result['lucky_saved'] == []
+        outcomes.add(survives)
+    assert outcomes == {True, False}
+
+
+def test_maniac_shot_and_heal():
+    game = make_game(ROLES, maniac_shot=8)
+    assert resolve(game)['deaths'] == [8]
+    game = make_game(ROLES, maniac_shot=8, heals=[8])
+    assert resolve(game)['deaths'] == []
+
+
+def test_mafia_and_maniac_deaths_are_sorted_and_unique():
+    game = make_game(ROLES, shots=[9], maniac_shot=7, commissar_action='kill', commissar_target=9)
+    assert resolve(game)['deaths'] == [7, 9]
+
+
+def test_commissar_kill():
+    game = make_game(ROLES, commissar_action='kill', commissar_target=1)
+    result = resolve(game)
+    assert result['deaths'] == [1]
+    assert result['commissar_kill'] == 1
+
+
+def test_commissar_kill_is_healed():
+    game = make_game(ROLES, commissar_action='kill', commissar_target=1, heals=[1])
+    result = resolve(game)
+    assert result['deaths'] == []
+    assert result['commissar_kill'] is None
+
+
+def test_commissar_check_does_not_kill():
+    game = make_game(ROLES, commissar_action='check', commissar_target=1)
+    assert resolve(game)['deaths'] == []
+
+
+def test_sergeant_promoted_when_commissar_dies():
+    game = make_game(ROLES, shots=[2])
+    result = resolve(game)
+    assert result['promotions'] == [(3, 'commissar')]
+
+    apply_night(game, result)
+    assert game['players'][3]['role'] == 'commissar'
+    assert 3 in game['role_seats']['commissar']
+    assert 3 not in game['role_seats'].get('sergeant', [])
+
+
+def test_mafia_promoted_when_don_dies():
+    game = make_game(ROLES, commissar_action='kill', commissar_target=0)
+    result = resolve(game)
+    assert result['promotions'] == [(1, 'don')]
+
+    apply_night(game, result)
+    assert game['players'][1]['role'] == 'don'
+    # Передача роли внутри мафии не меняет счётчики сторон
+    assert game['alive_counts'] == {'mafia': 1, 'maniac': 1, 'civil': 7}
+
+
+def test_no_promotion_without_living_heir():
+    game = make_game(ROLES, shots=[2])
+    kill(game, 3)
+    result = resolve(game)
+    assert result['deaths'] == [2]
+    assert result['promotions'] == []
+
+
+def test_resolve_night_does_not_change_game():
+    game = make_game(ROLES, shots=[2], maniac_shot=0, heals=[4])
+    before = deepcopy(game)
+    resolve(game)
+    assert game == before
+
+
+def test_apply_night_updates_alive_counts():
+    game = make_game(ROLES, shots=[7], maniac_shot=1)
+    apply_night(game, resolve(game))
+    assert not game['players'][7]['alive'] and game['players'][7]['died_night']
+    assert not game['players'][1]['alive']
+    assert game['alive_counts'] == {'mafia': 1, 'maniac': 1, 'civil': 6}
+
+
+def test_mafia_wins_on_parity():
+    game = make_game(['don', 'mafia', 'doctor', 'peace', 'peace'], shots=[3])
+    result = resolve(game)
+    assert result['winner'] == 'Мафия победила!'
+    apply_night(game, result)
+    assert check_winner(game) == result['winner']
+
+
+def test_civilians_win_when_last_mafia_killed():
+    game = make_game(['don', 'commissar', 'peace', 'peace'], commissar_action='kill', commissar_target=0)
+    assert resolve(game)['winner'] == 'Мирные победили!'
+
+
+def test_maniac_wins_when_one_left():
+    game = make_game(['maniac', 'peace', 'peace'], maniac_shot=1)
+    assert resolve(game)['winner'] == 'Маньяк победил!'
+
+
+def test_best_move_only_after_first_night():
+    game = make_game(ROLES, shots=[7])
+    assert resolve(game)['best_move'] == []
+    game = make_game(ROLES, shots=[7], night_count=2, day_count=1)
+    assert resolve(game)['best_move'] == [7]
+
+
+def test_night_rng_is_reproducible_per_game_and_night():
+    game = make_game(ROLES, rng_seed=42, night_count=3)
+    first = [night_rng(game).random() for _ in range(2)]
+    assert first[0] == first[1]
+    assert night_rng(dict(game, night_count=4)).random() != first[0]
+    assert night_rng(make_game(ROLES)) is random
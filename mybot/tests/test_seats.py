@@ -0,0 +1,55 @@
+from helpers import make_game
+from seats import (seat_of, player_by_id, role_seats, player_with_role, kill, revive, promote,
+                   alive_counts, build_alive_counts, faction_of)
+
+ROLES = ['don', 'mafia', 'commissar', 'sergeant', 'maniac', 'peace', 'peace']
+
+
+def test_seat_of_and_player_by_id():
+    game = make_game(ROLES)
+    assert seat_of(game, 102) == 2
+    assert seat_of(game, '102') == 2
+    assert seat_of(game, 999) is None
+    assert player_by_id(game, 104)['role'] == 'maniac'
+    assert player_by_id(game, 999) is None
+
+
+def test_seats_built_for_old_games():
+    game = make_game(ROLES)
+    del game['seats'], game['role_seats'], game['alive_counts']
+    assert seat_of(game, 105) == 5
+    assert role_seats(game, 'peace') == [5, 6]
+    assert alive_counts(game) == {'mafia': 2, 'maniac': 1, 'civil': 4}
+
+
+def test_role_seats_filters_dead_players():
+    game = make_game(ROLES)
+    kill(game, 0)
+    assert role_seats(game, 'don', 'mafia') == [1]
+    assert role_seats(game, 'don', 'mafia', alive=False) == [0, 1]
+    assert player_with_role(game, 'don') is None
+    assert player_with_role(game, 'don', alive=False)['id'] == 100
+
+
+def test_kill_and_revive_keep_alive_counts():
+    game = make_game(ROLES)
+    assert kill(game, 5)
+    assert not kill(game, 5)
+    assert game['alive_counts'] == {'mafia': 2, 'maniac': 1, 'civil': 3}
+    assert revive(game, 5)
+    assert not revive(game, 5)
+    assert game['alive_counts'] == build_alive_counts(game['players'])
+
+
+def test_promote_moves_role_seat_and_faction():
+    game = make_game(ROLES)
+    promote(game, 3, 'commissar')
+    assert game['role_seats']['commissar'] == [2, 3]
+    assert game['role_seats']['sergeant'] == []
+    assert game['alive_counts'] == {'mafia': 2, 'maniac': 1, 'civil': 4}
+
+    # Переход на другую сторону меняет счётчики
+    promote(game, 5, 'mafia')
+    assert faction_of(game['players'][5]['role']) == 'mafia'
+    assert game['alive_counts'] == {'mafia': 3, 'maniac': 1, 'civil': 3}
+    assert game['alive_counts'] == build_alive_counts(game['players'])
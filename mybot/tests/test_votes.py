@@ -0,0 +1,61 @@
+import pytest
+
+from helpers import make_game
+
+pytest.importorskip('telebot')
+
+
+@pytest.fixture
+def votes(tmp_path, monkeypatch):
+    """stages с базой во временном каталоге; возвращает (stages, database, id игры)"""
+    monkeypatch.chdir(tmp_path)
+    import database
+    import stages
+    db = database.Database(str(tmp_path / 'data'))
+    for name in ('find_one', 'find_one_and_update'):
+        monkeypatch.setattr(database, name, getattr(db, name))
+    game_id = db.insert_one('games', make_game(['don', 'mafia', 'peace', 'peace', 'peace'], stage=0))
+    return stages, database, game_id
+
+
+def read(database, game_id):
+    return database.find_one('games', {'_id': game_id})
+
+
+def test_first_vote_counts(votes):
+    stages, database, game_id = votes
+    game = stages.record_vote(read(database, game_id), 0, 100, 2)
+    assert game['vote'] == {'0': 2}
+    assert stages.get_vote_counts(game) == {2: 1}
+    assert stages.get_vote_voters(game) == {2: [0]}
+
+
+def test_changed_vote_moves_tally(votes):
+    stages, database, game_id = votes
+    stages.record_vote(read(database, game_id), 0, 100, 2)
+    stages.record_vote(read(database, game_id), 1, 101, 2)
+    game = stages.record_vote(read(database, game_id), 0, 100, 3)
+    assert stages.get_vote_counts(game) == {2: 1, 3: 1}
+    assert stages.get_vote_voters(game) == {2: [1], 3: [0]}
+
+
+def test_repeated_vote_is_not_counted_twice(votes):
+    stages, database, game_id = votes
+    stages.record_vote(read(database, game_id), 0, 100, 2)
+    game = stages.record_vote(read(database, game_id), 0, 100, 2)
+    assert stages.get_vote_counts(game) == {2: 1}
+
+
+def test_stale_game_is_reread(votes):
+    stages, database, game_id = votes
+    stale = read(database, game_id)
+    stages.record_vote(read(database, game_id), 0, 100, 2)
+    # Голос поменялся после чтения stale - запись перечитывает игру и не теряет счёт
+    game = stages.record_vote(stale, 0, 100, 4)
+    assert stages.get_vote_counts(game) == {4: 1}
+
+
+def test_missing_game_returns_none(votes):
+    stages, database, game_id = votes
+    game = dict(read(database, game_id), _id='missing')
+    assert stages.record_vote(game, 0, 100, 2) is None